@@ -0,0 +1,77 @@
+'''
+上传前压缩的压缩比 / CPU 开销测试
+
+用法:
+    python benchmarks/bench_compression.py [文件 ...]
+
+不传文件时生成一张 16 位整数、带大片空白区域的模拟 FITS 帧。
+对每种格式和级别走一遍 `CompressedReader`（和上传切片时同一条路径），
+输出压缩比和单核吞吐（原始 MB / CPU 秒），用来估算多少核能跟上上传带宽。
+'''
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(project_path, 'src'))
+
+import random
+import struct
+import tempfile
+import time
+
+from compressor import CompressedReader, zstandard
+
+CASES = [('gzip', 1), ('gzip', 6)]
+if zstandard is not None:
+    CASES += [('zstd', 1), ('zstd', 3), ('zstd', 9)]
+
+
+def make_fake_fits(path, width=2048, height=2048):
+    '''2880 字节头 + 大端 int16 像素，上 1/3 为空白，其余为本底噪声加少量星点'''
+    header = 'SIMPLE  =                    T'.ljust(80) + 'BITPIX  =                   16'.ljust(80)
+    header = header.ljust(2880).encode('ascii')
+    rng = random.Random(0)
+    with open(path, 'wb') as f:
+        f.write(header)
+        blank = height // 3
+        f.write(bytes(width * 2 * blank))
+        for _ in range(height - blank):
+            row = [1000 + int(rng.gauss(0, 12)) for _ in range(width)]
+            for _ in range(3):
+                row[rng.randrange(width)] = rng.randrange(5000, 30000)
+            f.write(struct.pack(f'>{width}h', *row))
+
+
+def bench(path, codec, level):
+    size = os.path.getsize(path)
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    with CompressedReader(path, codec, level) as reader:
+        while reader.read(4 * 1024 * 1024):
+            pass
+        compressed = reader.compressed_bytes
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    return size / compressed, size / 1024 / 1024 / max(cpu, 1e-9), wall
+
+
+def main(paths):
+    tmpdir = None
+    if not paths:
+        tmpdir = tempfile.mkdtemp()
+        paths = [os.path.join(tmpdir, 'light.fits')]
+        make_fake_fits(paths[0])
+    if zstandard is None:
+        print('未安装 zstandard，只测试 gzip')
+
+    print(f'{"文件":<24}{"格式":<8}{"级别":>4}{"压缩比":>10}{"MB/CPU秒":>12}{"耗时(s)":>10}')
+    for path in paths:
+        for codec, level in CASES:
+            ratio, per_core, wall = bench(path, codec, level)
+            print(f'{os.path.basename(path)[:22]:<24}{codec:<8}{level:>4}{ratio:>10.2f}{per_core:>12.1f}{wall:>10.2f}')
+
+    if tmpdir:
+        os.remove(paths[0])
+        os.rmdir(tmpdir)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
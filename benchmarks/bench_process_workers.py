@@ -0,0 +1,134 @@
+'''
+线程池上传和多进程上传随核数的扩展性对比
+
+用法:
+    python benchmarks/bench_process_workers.py [文件数] [每个文件 MB]
+
+在另一个进程里起一个本地的模拟百度网盘（tests/fake_pcs.py），生成若干随机内容的帧，
+分别用 1、2、4 …… 到 CPU 核数个线程 / 子进程完整上传一遍（哈希、切片、预上传、分片、
+创建），输出耗时和吞吐。不走真实网络，测的是一个进程里 GIL 对哈希、SSL 之外的 CPU
+开销的限制：线程数加上去吞吐基本不变，子进程数加上去吞吐随核数增长。
+'''
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(project_path, 'src'))
+sys.path.append(os.path.join(project_path, 'tests'))
+
+import concurrent.futures
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+from configer import Config
+from file_uploader import BaiduCloudUploader
+from process_uploader import ProcessBaiduCloudUploader, ProcessUploadEngine
+import process_uploader
+
+
+def _serve(urls, stop):
+    '''模拟网盘跑在单独的进程里，不和被测的上传抢 GIL'''
+    from fake_pcs import FakePCS
+    fake = FakePCS().start()
+    urls.put(fake.url)
+    stop.wait()
+    fake.stop()
+
+
+def _config(workdir, url):
+    config_file = os.path.join(workdir, 'config.ini')
+    with open(config_file, 'w', encoding='utf-8') as f:
+        f.write(f'''
+[LocalFiles]
+devicename = bench
+localdirectory = {os.path.join(workdir, 'local')}
+
+[BaiduCloud]
+appname = bench
+appid = 1
+appkey = key
+secretkey = secret
+accesstoken = token
+
+[Upload]
+hostdiscovery = false
+uploadhosts = {url}
+rapidupload = false
+dedup = false
+
+[Timeouts]
+hedge = false
+
+[CircuitBreaker]
+enabled = false
+''')
+    return Config(config_file)
+
+
+def bench_threads(config, paths, url, workers):
+    def upload(path):
+        uploader = BaiduCloudUploader(path, config)
+        uploader.pan_host = url
+        return uploader.start_upload()
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        assert all(executor.map(upload, paths))
+    return time.perf_counter() - start
+
+
+def bench_processes(config, paths, url, workers):
+    engine = ProcessUploadEngine(config.filename, workers)
+    process_uploader._engine = engine
+    # 先让子进程都启动起来，不把 spawn 的时间算进去
+    concurrent.futures.wait([engine.pool.submit(time.sleep, 0.5) for _ in range(workers)])
+
+    start = time.perf_counter()
+    futures = []
+    for path in paths:
+        uploader = ProcessBaiduCloudUploader(path, config)
+        uploader.pan_host = url
+        futures.append(uploader.submit_transfer())
+    assert all(future.result() for future in futures)
+    elapsed = time.perf_counter() - start
+    engine.close()
+    process_uploader._engine = None
+    return elapsed
+
+
+def main(files, size_mb):
+    context = multiprocessing.get_context('spawn')
+    urls, stop = context.Queue(), context.Event()
+    server = context.Process(target=_serve, args=(urls, stop), daemon=True)
+    server.start()
+    url = urls.get()
+
+    workdir = tempfile.mkdtemp(prefix='bench_process_')
+    try:
+        config = _config(workdir, url)
+        os.makedirs(os.path.join(workdir, 'local'))
+        paths = []
+        for i in range(files):
+            path = os.path.join(workdir, 'local', f'light_{i:03d}.fits')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size_mb * 1024 * 1024))
+            paths.append(path)
+
+        cores = os.cpu_count() or 1
+        counts = sorted({1, 2, 4, 8, 16, cores} & set(range(1, cores + 1)))
+        total_mb = files * size_mb
+        print(f'{files} 个文件 x {size_mb}MB，CPU 核数 {cores}')
+        print(f'{"并发":>6}{"线程(s)":>10}{"线程MB/s":>10}{"进程(s)":>10}{"进程MB/s":>10}')
+        for n in counts:
+            threaded = bench_threads(config, paths, url, n)
+            processed = bench_processes(config, paths, url, n)
+            print(f'{n:>6}{threaded:>10.2f}{total_mb / threaded:>10.1f}{processed:>10.2f}{total_mb / processed:>10.1f}')
+    finally:
+        stop.set()
+        server.join(5)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 16)
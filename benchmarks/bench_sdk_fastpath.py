@@ -0,0 +1,101 @@
+'''
+SDK 默认反序列化与 `_raw_response` 快速路径的对比
+
+用法:
+    python benchmarks/bench_sdk_fastpath.py [次数]
+
+不发网络请求：替换 `ApiClient.request` 直接返回准备好的响应，测的是一次接口调用里
+参数校验 + 反序列化的纯 CPU 开销。覆盖上传（precreate / superfile2 / create）和
+多媒体（listall，1000 条记录）几种典型返回。
+'''
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(project_path, 'external/baidusdk'))
+
+import json
+import tempfile
+import time
+
+import openapi_client
+from openapi_client.api import fileupload_api, multimediafile_api
+from openapi_client.rest import RESTResponse
+
+
+class _CannedResponse:
+    def __init__(self, data):
+        self.status = 200
+        self.reason = 'OK'
+        self.data = data
+
+    def getheaders(self):
+        return {'Content-Type': 'application/json'}
+
+    def getheader(self, name, default=None):
+        return self.getheaders().get(name, default)
+
+
+class CannedApiClient(openapi_client.ApiClient):
+    '''每次请求都返回同一个准备好的响应'''
+    data = b'{}'
+
+    def request(self, method, url, **kwargs):
+        return RESTResponse(_CannedResponse(self.data))
+
+
+LISTALL = {
+    'errno': 0, 'has_more': 1, 'cursor': 1000,
+    'list': [{
+        'fs_id': 1000 + i, 'path': f'/apps/test/night/light_{i:04d}.fits', 'server_filename': f'light_{i:04d}.fits',
+        'size': 33554432, 'md5': '0' * 32, 'isdir': 0, 'category': 6,
+        'server_mtime': 1700000000, 'server_ctime': 1700000000, 'local_mtime': 1700000000, 'local_ctime': 1700000000,
+    } for i in range(1000)],
+}
+
+PART = tempfile.NamedTemporaryFile(suffix='_chunk_0', delete=False)
+PART.write(b'x' * 1024)
+PART.close()
+
+CASES = [
+    ('precreate', fileupload_api.FileuploadApi, {'errno': 0, 'return_type': 1, 'uploadid': 'N1-abc', 'block_list': [], 'request_id': 1},
+     lambda api: api.xpanfileprecreate('token', '/apps/test/a.fits', 0, 1024, 1, '["0"]', rtype=2, **_kw())),
+    ('superfile2', fileupload_api.FileuploadApi, {'md5': '0' * 32, 'request_id': 1},
+     lambda api: api.pcssuperfile2('token', '0', '/apps/test/a.fits', 'N1-abc', 'tmpfile',
+                                   file=open(PART.name, 'rb'), **_kw())),
+    ('create', fileupload_api.FileuploadApi, {'errno': 0, 'fs_id': 1, 'md5': '0' * 32, 'size': 1024, 'path': '/apps/test/a.fits', 'isdir': 0},
+     lambda api: api.xpanfilecreate('token', '/apps/test/a.fits', 0, 1024, 'N1-abc', '["0"]', rtype=2, **_kw())),
+    ('listall x1000', multimediafile_api.MultimediafileApi, LISTALL,
+     lambda api: api.xpanfilelistall('token', '/apps/test', 1, **_kw())),
+]
+
+_options = {}
+
+def _kw():
+    return _options
+
+
+def bench(api_class, payload, call, number, raw):
+    CannedApiClient.data = json.dumps(payload).encode('utf-8')
+    _options.clear()
+    if raw:
+        _options['_raw_response'] = True
+    with CannedApiClient(openapi_client.Configuration(host='http://127.0.0.1')) as api_client:
+        api = api_class(api_client)
+        call(api) # 预热
+        start = time.perf_counter()
+        for _ in range(number):
+            call(api)
+        return (time.perf_counter() - start) / number
+
+
+def main(number):
+    print(f'{"接口":<16}{"默认(us)":>12}{"raw(us)":>12}{"加速":>8}')
+    for name, api_class, payload, call in CASES:
+        n = max(1, number // 50) if len(payload.get('list', [])) > 100 else number
+        default = bench(api_class, payload, call, n, raw=False)
+        raw = bench(api_class, payload, call, n, raw=True)
+        print(f'{name:<16}{default * 1e6:>12.1f}{raw * 1e6:>12.1f}{default / raw:>7.1f}x')
+    os.remove(PART.name)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
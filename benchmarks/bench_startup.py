@@ -0,0 +1,96 @@
+'''
+守护进程启动耗时，按阶段拆开
+
+用法:
+    python benchmarks/bench_startup.py [状态条数]
+
+每个阶段在新的子进程里测，避免模块缓存影响：
+
+- import 主流程模块（configer / status_manager / file_checker / upload_monitor）
+- import 百度网盘SDK（现在推迟到第一次调用接口）
+- 旧版：json.load 整个状态文件并把待上传文件全部放进队列
+- 迁移：JSON 状态文件导入 SQLite（只在第一次启动发生）
+- 新版：打开状态库到队列里出现第一个文件、到全部恢复完成
+'''
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+import json
+import shutil
+import subprocess
+import tempfile
+
+STATUS_VALUES = ['已上传', '已上传', '已上传', '未上传']
+
+PRELUDE = f'''
+import sys, time
+sys.path.append({os.path.join(project_path, 'src')!r})
+sys.path.append({os.path.join(project_path, 'external/baidusdk')!r})
+t = time.perf_counter()
+'''
+
+STAGES = [
+    ('import 主流程模块', '''
+import configer, status_manager, file_checker, upload_monitor
+print(time.perf_counter() - t)
+'''),
+    ('import 百度网盘SDK', '''
+import openapi_client
+from openapi_client.api import fileupload_api
+print(time.perf_counter() - t)
+'''),
+    ('旧版 json 加载 + 全量入队', '''
+import json
+from queue import Queue
+q = Queue()
+with open('upload_status.json', encoding='utf-8') as f:
+    status = json.load(f)
+for name, s in status.items():
+    if s in ('未上传', '正在上传'):
+        q.put(name)
+print(time.perf_counter() - t)
+'''),
+    ('迁移 json -> sqlite', '''
+from queue import Queue
+from status_manager import StatusManager
+m = StatusManager(Queue(), 'upload_status.db', 'upload_status.json')
+print(time.perf_counter() - t)
+m.restored.wait()
+'''),
+    ('sqlite 打开到第一个文件入队', '''
+from queue import Queue
+from status_manager import StatusManager
+q = Queue()
+m = StatusManager(q, 'upload_status.db', None)
+q.get()
+print(time.perf_counter() - t)
+'''),
+    ('sqlite 全部恢复完成', '''
+from queue import Queue
+from status_manager import StatusManager
+m = StatusManager(Queue(), 'upload_status.db', None)
+m.restored.wait()
+print(time.perf_counter() - t)
+'''),
+]
+
+
+def main(entries):
+    workdir = tempfile.mkdtemp()
+    try:
+        status = {f'/data/night{i // 1000:04d}/light_{i:07d}.fits': STATUS_VALUES[i % len(STATUS_VALUES)]
+                  for i in range(entries)}
+        with open(os.path.join(workdir, 'upload_status.json'), 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=4, ensure_ascii=False)
+        print(f'状态条数 {entries}，其中待上传 {entries // len(STATUS_VALUES)}')
+
+        for name, code in STAGES:
+            result = subprocess.run([sys.executable, '-c', PRELUDE + code], cwd=workdir,
+                                    capture_output=True, text=True, check=True)
+            print(f'{name:<24}{float(result.stdout.split()[0]) * 1000:>10.1f} ms')
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -133,7 +133,8 @@ class ApiClient(object):
         _request_timeout: typing.Optional[typing.Union[int, float, typing.Tuple]] = None,
         _host: typing.Optional[str] = None,
         _check_type: typing.Optional[bool] = None,
-        _content_type: typing.Optional[str] = None
+        _content_type: typing.Optional[str] = None,
+        _raw_response: bool = False
     ):
 
         config = self.configuration
@@ -211,7 +212,9 @@ class ApiClient(object):
             return return_data
 
         # deserialize response data
-        if response_type:
+        if _raw_response:
+            return_data = self.raw_deserialize(response_data)
+        elif response_type:
             if response_type != (file_type,):
                 encoding = "utf-8"
                 content_type = response_data.getheader('content-type')
@@ -287,6 +290,21 @@ class ApiClient(object):
             return {key: cls.sanitize_for_serialization(val) for key, val in obj.items()}
         raise ApiValueError('Unable to prepare type {} for serialization'.format(obj.__class__.__name__))
 
+    def raw_deserialize(self, response):
+        """Parses the response body as plain JSON, skipping model validation.
+
+        Used by the `_raw_response` fast path: the result is whatever
+        `json.loads` returns (usually a dict), or the raw bytes when the
+        body is not JSON.
+
+        :param response: RESTResponse object to be parsed.
+        :return: parsed JSON data.
+        """
+        try:
+            return json.loads(response.data)
+        except ValueError:
+            return response.data
+
     def deserialize(self, response, response_type, _check_type):
         """Deserializes response into an object.
 
@@ -350,7 +368,8 @@ class ApiClient(object):
         _preload_content: bool = True,
         _request_timeout: typing.Optional[typing.Union[int, float, typing.Tuple]] = None,
         _host: typing.Optional[str] = None,
-        _check_type: typing.Optional[bool] = None
+        _check_type: typing.Optional[bool] = None,
+        _raw_response: bool = False
     ):
         """Makes the HTTP request (synchronous) and returns deserialized data.
 
@@ -398,6 +417,9 @@ class ApiClient(object):
         :param _check_type: boolean describing if the data back from the server
             should have its type checked.
         :type _check_type: bool, optional
+        :param _raw_response: if True, return the parsed JSON body as-is
+            without building or validating models. Default is False.
+        :type _raw_response: bool, optional
         :return:
             If async_req parameter is True,
             the request will be called asynchronously.
@@ -412,7 +434,7 @@ class ApiClient(object):
                                    response_type, auth_settings,
                                    _return_http_data_only, collection_formats,
                                    _preload_content, _request_timeout, _host,
-                                   _check_type)
+                                   _check_type, _raw_response=_raw_response)
 
         return self.pool.apply_async(self.__call_api, (resource_path,
                                                        method, path_params,
@@ -425,7 +447,8 @@ class ApiClient(object):
                                                        collection_formats,
                                                        _preload_content,
                                                        _request_timeout,
-                                                       _host, _check_type))
+                                                       _host, _check_type,
+                                                       None, _raw_response))
 
     def request(self, method, url, query_params=None, headers=None,
                 post_params=None, body=None, _preload_content=True,
@@ -674,9 +697,10 @@ class Endpoint(object):
             '_check_input_type',
             '_check_return_type',
             '_content_type',
-            '_spec_property_naming'
+            '_spec_property_naming',
+            '_raw_response'
         ])
-        self.params_map['nullable'].extend(['_request_timeout'])
+        self.params_map['nullable'].extend(['_request_timeout', '_host_index', '_content_type'])
         self.validations = root_map['validations']
         self.allowed_values = root_map['allowed_values']
         self.openapi_types = root_map['openapi_types']
@@ -689,7 +713,8 @@ class Endpoint(object):
             '_check_input_type': (bool,),
             '_check_return_type': (bool,),
             '_spec_property_naming': (bool,),
-            '_content_type': (none_type, str)
+            '_content_type': (none_type, str),
+            '_raw_response': (bool,)
         }
         self.openapi_types.update(extra_types)
         self.attribute_map = root_map['attribute_map']
@@ -783,6 +808,9 @@ class Endpoint(object):
         return self.callable(self, *args, **kwargs)
 
     def call_with_http_info(self, **kwargs):
+        if kwargs.get('_raw_response'):
+            # fast path: skip input type conversion as well as response models
+            kwargs['_check_input_type'] = False
         try:
             index = self.api_client.configuration.server_operation_index.get(
                 self.settings['operation_id'], self.api_client.configuration.server_index
@@ -861,4 +889,5 @@ class Endpoint(object):
             _preload_content=kwargs['_preload_content'],
             _request_timeout=kwargs['_request_timeout'],
             _host=_host,
-            collection_formats=params['collection_format'])
+            collection_formats=params['collection_format'],
+            _raw_response=kwargs.get('_raw_response', False))
@@ -196,6 +196,8 @@ class Configuration(object):
 
         # Options to pass down to the underlying urllib3 socket
         self.socket_options = None
+        # Local address to bind outgoing connections to, e.g. '192.168.1.10'
+        self.source_address = None
 
     def __deepcopy__(self, memo):
         cls = self.__class__
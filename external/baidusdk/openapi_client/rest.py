@@ -78,6 +78,10 @@ class RESTClientObject(object):
         if configuration.socket_options is not None:
             addition_pool_args['socket_options'] = configuration.socket_options
 
+        if configuration.source_address is not None:
+            # bind outgoing connections to one local address
+            addition_pool_args['source_address'] = (configuration.source_address, 0)
+
         if maxsize is None:
             if configuration.connection_pool_maxsize is not None:
                 maxsize = configuration.connection_pool_maxsize
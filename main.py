@@ -1,12 +1,16 @@
 import sys
+import argparse
 sys.path.append('src')
 
 import status_manager,configer
-from queue import Queue
+from work_queue import PendingQueue
 import storage_auth
 
 from file_checker import FileChecker
 from upload_monitor import UploadMonitor
+from reconciler import Reconciler
+from downloader import Downloader
+from cloud_cleanup import CloudCleanup
 import logging
 from utils import logging_with_terminal_and_file, set_shutdown
 
@@ -19,14 +23,23 @@ def main():
     mainlog.info(f'加载配置文件')
     config = configer.Config()
 
-    # Global upload task queue.
+    # Global upload task queue. 内存里只保留一个窗口，其余待上传文件留在状态库里
     mainlog.info(f'初始化文件上传队列')
-    file_queue = Queue()
+    upload_config = config.get_upload_config()
+    file_queue = PendingQueue(upload_config.get('queue_window'), lease_seconds=upload_config.get('lease_seconds'))
 
     # Global status manager
     mainlog.info(f'初始化状态控制器')
     s_manager = status_manager.StatusManager(file_queue)
 
+    # 状态库丢失或者换了机器时，先和网盘对账，已经在网盘上的文件不再上传
+    if config.get_reconcile_config().get('on_startup'):
+        mainlog.info('和网盘目录对账')
+        try:
+            Reconciler(config, s_manager).reconcile()
+        except Exception as e:
+            mainlog.warning(f'对账失败，按本地状态继续: {e}')
+
     # 创建 FileChecker 实例
     mainlog.info('初始化文件夹更新监控')
     file_checker = FileChecker(file_queue, s_manager, config)
@@ -61,5 +74,64 @@ def main():
 
         mainlog.info('程序退出')
 
+def show_failed():
+    '''列出重试次数用完的文件'''
+    s_manager = status_manager.StatusManager(PendingQueue())
+    failed = s_manager.dead_letters()
+    for path, attempts, error in failed:
+        print(f'{path}\t失败 {attempts} 次\t{error or ""}')
+    print(f'共 {len(failed)} 个文件上传失败')
+
+def redrive(paths):
+    '''把上传失败的文件重新放回待上传，正在运行的程序会在下一轮扫描状态库时取到'''
+    s_manager = status_manager.StatusManager(PendingQueue())
+    count = s_manager.redrive(paths or None)
+    print(f'已重新放回 {count} 个文件')
+
+def reconcile(full):
+    '''和网盘目录对账，网盘上已有的本地文件直接标记为已上传'''
+    config = configer.Config()
+    s_manager = status_manager.StatusManager(PendingQueue())
+    count = Reconciler(config, s_manager).reconcile(full)
+    print(f'新标记 {count} 个文件为已上传')
+
+def download(full):
+    '''把网盘上的新文件下载到 [Download] localdirectory，中断后重新运行会接着下载'''
+    logging_with_terminal_and_file()
+    config = configer.Config()
+    count = Downloader(config).run(full)
+    print(f'下载了 {count} 个文件')
+
+def cleanup():
+    '''清理已经确认下载到 NAS 的网盘文件，按 [Cleanup] mode 删除或者归档'''
+    logging_with_terminal_and_file()
+    config = configer.Config()
+    count = CloudCleanup(config).run()
+    print(f'清理了 {count} 个网盘文件')
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='自动备份到百度网盘')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('run', help='启动备份（默认）')
+    commands.add_parser('failed', help='列出重试次数用完、上传失败的文件')
+    retry_parser = commands.add_parser('retry', help='重新上传失败的文件')
+    retry_parser.add_argument('paths', nargs='*', help='要重新上传的文件，留空表示全部')
+    reconcile_parser = commands.add_parser('reconcile', help='和网盘目录对账，已经在网盘上的文件不再上传')
+    reconcile_parser.add_argument('--full', action='store_true', help='忽略缓存，重新拉取整个网盘目录')
+    download_parser = commands.add_parser('download', help='把网盘上的新文件下载到本地（NAS）')
+    download_parser.add_argument('--full', action='store_true', help='重新拉取整个网盘目录，而不是只看新文件')
+    commands.add_parser('cleanup', help='删除或归档已经下载到 NAS 的网盘文件')
+    args = parser.parse_args()
+
+    if args.command == 'failed':
+        show_failed()
+    elif args.command == 'retry':
+        redrive(args.paths)
+    elif args.command == 'reconcile':
+        reconcile(args.full)
+    elif args.command == 'download':
+        download(args.full)
+    elif args.command == 'cleanup':
+        cleanup()
+    else:
+        main()
@@ -0,0 +1,108 @@
+import os
+import zlib
+import threading
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+
+class AccountPool:
+    '''
+    把文件分配到多个百度网盘账号
+
+    一个账号（应用）的分片上传会被限速，配置多个 `[BaiduCloud:<name>]` 区块后文件分散
+    到各个账号上传，每个账号有自己的 token 和并发额度（`concurrency`，0 表示不限）。
+
+    分配策略 `shard_by`：
+
+    - directory : 按本地目录名的 crc32 取模，同一个目录（同一晚的数据）固定在同一个账号
+    - size : 分给目前分到字节数最少的账号，各账号的上传量大致相同
+
+    上传过的文件按状态库里记录的账号分配，重新上传时覆盖原来的文件，不在另一个账号留副本。
+
+    Args:
+        config (Config) : 配置管理器
+        status_manager (StatusManager) : 任务状态管理器，查询文件上次所在的账号
+
+    Methods:
+        account_for(file_path) : 文件分配到的账号，forget 之前重复调用结果不变
+        assign(file_paths, account) : 把几个文件改分到同一个账号（打进同一个包的文件）
+        forget(file_path) : 文件处理结束，清掉分配记录
+        acquire(account) / release(account) : 占用 / 归还账号的一个并发额度，退出时 acquire 返回 False
+    '''
+    def __init__(self, config, status_manager=None):
+        self.accounts = config.get_accounts()
+        self.shard_by = config.get_accounts_config().get('shard_by')
+        if self.shard_by not in ('directory', 'size'):
+            mainlog.info(f'未知的账号分配策略 {self.shard_by}，按目录分配')
+            self.shard_by = 'directory'
+        self.status_manager = status_manager
+        self._budgets = {}
+        for account in self.accounts:
+            concurrency = config.get_baidu_config(account).get('concurrency')
+            if concurrency > 0:
+                self._budgets[account] = threading.BoundedSemaphore(concurrency)
+        self._assigned = {} # 文件 -> 账号，上传结束前不变
+        self._bytes = {account: 0 for account in self.accounts}
+        self._lock = threading.Lock()
+
+    def account_for(self, file_path):
+        if len(self.accounts) == 1:
+            return self.accounts[0]
+        with self._lock:
+            account = self._assigned.get(file_path)
+            if account is not None:
+                return account
+
+        account = self.status_manager.get_account(file_path) if self.status_manager else None
+        with self._lock:
+            if account not in self._bytes:
+                account = self._shard(file_path)
+            self._assigned[file_path] = account
+            self._bytes[account] += _size(file_path)
+        return account
+
+    def assign(self, file_paths, account):
+        with self._lock:
+            for file_path in file_paths:
+                previous = self._assigned.get(file_path)
+                if previous == account:
+                    continue
+                size = _size(file_path)
+                if previous in self._bytes:
+                    self._bytes[previous] -= size
+                self._bytes[account] += size
+                self._assigned[file_path] = account
+
+    def acquire(self, account):
+        budget = self._budgets.get(account)
+        if budget is None:
+            return True
+        while not budget.acquire(timeout=5):
+            if shutdown_event.is_set():
+                return False
+        return True
+
+    def release(self, account):
+        budget = self._budgets.get(account)
+        if budget is not None:
+            budget.release()
+
+    def forget(self, file_path):
+        with self._lock:
+            self._assigned.pop(file_path, None)
+
+    def _shard(self, file_path):
+        '''调用方持有 self._lock'''
+        if self.shard_by == 'size':
+            return min(self.accounts, key=lambda account: self._bytes[account])
+        directory = os.path.dirname(file_path).encode('utf-8')
+        return self.accounts[zlib.crc32(directory) % len(self.accounts)]
+
+
+def _size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import ssl
+import uuid
+from urllib.parse import urlsplit, urlencode
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+
+class HttpResponse:
+    '''
+    HTTP 响应
+
+    Attributes:
+        status : 状态码
+        headers : 响应头，key 统一小写
+        data : 响应体 bytes
+    '''
+    def __init__(self, status, headers, data):
+        self.status = status
+        self.headers = headers
+        self.data = data
+
+    def json(self):
+        return json.loads(self.data)
+
+
+def encode_form(fields):
+    '''
+    application/x-www-form-urlencoded 请求体
+
+    Returns:
+        (bytes, str) : 请求体和 Content-Type
+    '''
+    return urlencode(fields).encode('utf-8'), 'application/x-www-form-urlencoded'
+
+
+def encode_multipart(fields, files):
+    '''
+    multipart/form-data 请求体
+
+    Args:
+        fields (dict) : 普通字段
+        files (dict) : 字段名 -> (文件名, bytes)
+
+    Returns:
+        (bytes, str) : 请求体和 Content-Type
+    '''
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8'))
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode('utf-8'))
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class AsyncHttpClient:
+    '''
+    基于 asyncio streams 的最小 HTTP/1.1 客户端
+
+    只实现上传需要的部分：keep-alive 连接池、Content-Length 和 chunked 响应。
+    一个事件循环上可以同时挂几百个请求，而不是每个请求占一个线程。
+    必须在事件循环内创建和使用。
+
+    Args:
+        max_connections (int) : 同时打开的连接数上限
+        ssl_context (ssl.SSLContext) : https 使用的 SSL 上下文
+    '''
+    def __init__(self, max_connections=100, ssl_context=None):
+        self._sem = asyncio.Semaphore(max_connections)
+        self._idle = {} # (scheme, host, port) -> [(reader, writer)]
+        self._ssl = ssl_context or ssl.create_default_context()
+        self.user_agent = 'autoback-asyncio'
+
+    async def request(self, method, url, body=b'', headers=None, timeout=None):
+        '''
+        发送一个请求
+
+        Args:
+            method (str) : GET / POST ...
+            url (str) : 完整 url
+            body (bytes) : 请求体
+            headers (dict) : 额外请求头
+            timeout (float | tuple) : 整个请求的超时（秒），也可以是 (连接超时, 读超时)，和 SDK 的 `_request_timeout` 一样
+
+        Returns:
+            HttpResponse
+        '''
+        parts = urlsplit(url)
+        https = parts.scheme == 'https'
+        port = parts.port or (443 if https else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = parts.path or '/'
+        if parts.query:
+            target += '?' + parts.query
+
+        send_headers = {
+            'Host': parts.netloc,
+            'User-Agent': self.user_agent,
+            'Content-Length': str(len(body)),
+            'Connection': 'keep-alive',
+        }
+        send_headers.update(headers or {})
+        connect_timeout = timeout
+        if isinstance(timeout, tuple):
+            connect_timeout, timeout = timeout
+
+        async with self._sem:
+            # 复用的连接可能已经被服务端关掉，换新连接重试一次
+            for attempt in range(2):
+                reader, writer, reused = await asyncio.wait_for(self._acquire(key, https), connect_timeout)
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self._exchange(reader, writer, method, target, send_headers, body), timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    writer.close()
+                    if reused and attempt == 0:
+                        mainlog.debug(f'复用连接失效，重新连接: {e}')
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+
+                if keep_alive:
+                    self._idle.setdefault(key, []).append((reader, writer))
+                else:
+                    writer.close()
+                return response
+
+    async def close(self):
+        '''关闭所有空闲连接'''
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+    async def _acquire(self, key, https):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer, True
+
+        scheme, host, port = key
+        reader, writer = await asyncio.open_connection(host, port, ssl=self._ssl if https else None)
+        return reader, writer, False
+
+    async def _exchange(self, reader, writer, method, target, headers, body):
+        head = f'{method} {target} HTTP/1.1\r\n'
+        head += ''.join(f'{k}: {v}\r\n' for k, v in headers.items())
+        writer.write(head.encode('latin-1') + b'\r\n')
+        if body:
+            writer.write(body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError('服务端关闭了连接')
+        version, status, _ = (status_line.decode('latin-1').rstrip('\r\n') + ' ').split(' ', 2)
+        status = int(status)
+
+        resp_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            k, _, v = line.decode('latin-1').partition(':')
+            resp_headers[k.strip().lower()] = v.strip()
+
+        keep_alive = version == 'HTTP/1.1' and resp_headers.get('connection', '').lower() != 'close'
+
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            data = b''
+        elif resp_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self._read_chunked(reader)
+        elif 'content-length' in resp_headers:
+            data = await reader.readexactly(int(resp_headers['content-length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+
+        return HttpResponse(status, resp_headers, data), keep_alive
+
+    async def _read_chunked(self, reader):
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';')[0].strip(), 16)
+            if size == 0:
+                # 跳过 trailer
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from file_uploader import BaiduCloudUploader, RTYPE_RENAME
+from async_http import AsyncHttpClient, encode_form, encode_multipart
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+
+class AsyncUploadEngine:
+    '''
+    asyncio 上传引擎
+
+    在一个后台线程里跑事件循环，所有文件的 precreate / 分片 / create 请求都挂在
+    这一个循环上；读分片文件交给一个小线程池，避免阻塞事件循环。
+
+    Args:
+        max_connections (int) : 同时打开的 HTTP 连接数上限
+        read_workers (int) : 读文件线程数
+
+    Methods:
+        submit(coro) : 把协程提交到事件循环，返回 concurrent.futures.Future
+        run(coro) : 提交并等待结果
+        read_file(path) : 在线程池里读文件的协程
+    '''
+    def __init__(self, max_connections=200, read_workers=4):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='async-read')
+        self._thread = threading.Thread(target=self._run_loop, name='async-engine', daemon=True)
+        self._thread.start()
+        self.client = self.run(self._make_client(max_connections))
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    async def read_file(self, path):
+        return await self.loop.run_in_executor(self.executor, _read_file, path)
+
+    async def call_blocking(self, func, *args):
+        '''在线程池里调用阻塞函数（比如刷新 token）'''
+        return await self.loop.run_in_executor(None, func, *args)
+
+    def close(self):
+        self.run(self.client.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+
+    async def _make_client(self, max_connections):
+        return AsyncHttpClient(max_connections=max_connections)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_async_engine(config):
+    '''进程内共享的 asyncio 上传引擎，第一次调用时创建'''
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            upload_config = config.get_upload_config()
+            _engine = AsyncUploadEngine(
+                max_connections=upload_config.get('max_connections'),
+                read_workers=upload_config.get('read_workers'))
+        return _engine
+
+
+class AsyncBaiduCloudUploader(BaiduCloudUploader):
+    '''
+    基于 asyncio 引擎的百度云盘上传实现
+
+    准备阶段（切片、block_list）沿用 `BaiduCloudUploader`，三个 API 请求都走共享的
+    事件循环。`submit_transfer()` 不阻塞调用线程，监控线程可以同时挂多个文件。
+
+    Args:
+        file_name (str) : 本地文件路径
+        config (Config) : 配置管理器
+        upload_relpath (str) : 网盘上相对应用目录的路径
+        account (str) : 上传到哪个百度网盘账号
+    '''
+    def __init__(self, file_name, config, upload_relpath=None, account=None):
+        super().__init__(file_name, config, upload_relpath, account)
+        self.name = '百度云盘(asyncio)'
+        self.engine = get_async_engine(config)
+        self.part_concurrency = config.get_upload_config().get('part_concurrency')
+
+    def transfer(self):
+        return self.submit_transfer().result()
+
+    def submit_transfer(self):
+        '''
+        把传输阶段提交到事件循环
+
+        Returns:
+            concurrent.futures.Future : 结果为上传成功与否
+        '''
+        return self.engine.submit(self._transfer_async())
+
+    def _api_precreate(self, access_token, file, block_list, isdir=0, autoinit=1, rtype=RTYPE_RENAME, redo=[]):
+        '''预上传，在准备线程里同步等待事件循环的结果'''
+        return self.engine.run(self._precreate_async(access_token, file, block_list, isdir, autoinit, rtype))
+
+    async def _precreate_async(self, access_token, file, block_list, isdir, autoinit, rtype):
+        fields = {
+            'path': self.upload_path,
+            'isdir': isdir,
+            'size': file.upload_size,
+            'autoinit': autoinit,
+            'block_list': block_list,
+            'rtype': rtype,
+        }
+        for attempt in range(2):
+            api_response = await self._post_form('precreate', access_token, fields)
+            if api_response.get('errno') in [111, -6] and attempt == 0:
+                access_token = await self.engine.call_blocking(self.auth.renew_token, access_token)
+                self.access_token = access_token
+                continue
+
+            uploadid = api_response.get('uploadid')
+            if not uploadid:
+                raise Exception(api_response)
+            mainlog.debug(f'获取uploadid：{uploadid}')
+            return uploadid
+
+    async def _transfer_async(self):
+        if self.uploaded_remotely:
+            return True
+
+        mainlog.info(f'正在上传{self.file.file_path}')
+        access_token = await self.engine.call_blocking(self.auth.get_token)
+        await self.engine.call_blocking(self.hosts.discover, access_token, self.upload_path, self.uploadid)
+        sem = asyncio.Semaphore(self.part_concurrency)
+        retries = [20] # 所有分片共享重试次数
+
+        async def upload_part(chunk):
+            async with sem:
+                while self.uploading:
+                    if self.breaker.is_open():
+                        await self.engine.call_blocking(self.breaker.wait)
+                    access_token = await self.engine.call_blocking(self.auth.get_token)
+                    try:
+                        if await self.hedger.run_async(lambda: self._chunk_upload_async(access_token, chunk)):
+                            return True
+                    except Exception as e:
+                        mainlog.debug(f"Error with {chunk.chunk_path}: {e}")
+
+                    if retries[0] <= 0:
+                        raise Exception(f'重试次数用完，分片上传失败')
+                    retries[0] -= 1
+                    mainlog.debug(f"Retrying {chunk.mother_file.file_path} part {chunk.chunk_index}...")
+                return False
+
+        tasks = [asyncio.ensure_future(upload_part(chunk)) for chunk in self.file.chunks]
+        try:
+            results = await asyncio.gather(*tasks)
+            if not all(results):
+                mainlog.debug(f"本次上传被停止")
+                return False
+        except Exception as e:
+            mainlog.debug(f'分片上传失败 {self.file.file_path}: {e}')
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            return False
+        finally:
+            await self.engine.call_blocking(self.file.remove_chunks)
+
+        access_token = await self.engine.call_blocking(self.auth.get_token)
+        fields = {
+            'path': self.upload_path,
+            'isdir': 0,
+            'size': self.file.upload_size,
+            'uploadid': self.uploadid,
+            'block_list': self.file.block_list,
+            'rtype': self.rtype,
+        }
+        try:
+            api_response = await self._post_form('create', access_token, fields)
+        except Exception as e:
+            mainlog.debug(f'创建文件失败 {self.file.file_path}: {e}')
+            return False
+
+        if api_response.get('errno'):
+            mainlog.info(f"创建{self.file.file_path}文件失败 错误码:{api_response.get('errno')}")
+            return False
+
+        self.fs_id = api_response.get('fs_id')
+        mainlog.info(f"成功上传 { self.file.file_path }")
+        await self.engine.call_blocking(self._remember_content)
+        return True
+
+    async def _chunk_upload_async(self, access_token, chunk):
+        data = await self.engine.read_file(chunk.chunk_path)
+        query = urlencode({
+            'method': 'upload',
+            'openapi': 'xpansdk',
+            'access_token': access_token,
+            'partseq': str(chunk.chunk_index),
+            'path': self.upload_path,
+            'uploadid': self.uploadid,
+            'type': 'tmpfile',
+        })
+        body, content_type = encode_multipart({}, {'file': (os.path.basename(chunk.chunk_path), data)})
+        host = self.hosts.pick()
+        ok = False
+        start = time.monotonic()
+        try:
+            response = await self.breaker.call_async(self.engine.client.request(
+                'POST', f'{host}/rest/2.0/pcs/superfile2?{query}', body, {'Content-Type': content_type},
+                timeout=self.timeouts['upload']))
+            api_response = json.loads(response.data)
+            ok = api_response.get('md5') == chunk.chunk_md5
+        finally:
+            self.hosts.report(host, len(data), time.monotonic() - start, ok)
+
+        if ok:
+            return True
+
+        if api_response.get('errno') in [111, -6]:
+            # token 失效，多个分片同时发现时只会刷新一次
+            await self.engine.call_blocking(self.auth.renew_token, access_token)
+        return False
+
+    async def _post_form(self, method, access_token, fields):
+        query = urlencode({'method': method, 'openapi': 'xpansdk', 'access_token': access_token})
+        body, content_type = encode_form(fields)
+        response = await self.breaker.call_async(self.engine.client.request(
+            'POST', f'{self.pan_host}/rest/2.0/xpan/file?{query}', body, {'Content-Type': content_type},
+            timeout=self.timeouts[method]))
+        if not 200 <= response.status <= 299:
+            raise Exception(f'{method} 请求失败 HTTP {response.status}: {response.data[:200]}')
+        return json.loads(response.data)
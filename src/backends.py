@@ -0,0 +1,127 @@
+import os
+import threading
+
+from file_uploader import BaseUploader, BaiduCloudUploader
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+COPY_BLOCK_SIZE = 1024 * 1024 # 单独写入时每次读多少字节
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def register_backend(name, factory):
+    '''
+    登记一种上传目的地
+
+    Args:
+        name (str) : 配置里 `backend = ` 使用的名字
+        factory (callable) : (file_path, config, options) -> BaseUploader，options 是
+            `Config.get_destination_config()` 的结果
+    '''
+    with _backends_lock:
+        _backends[name] = factory
+
+
+def get_backend(name):
+    '''
+    Returns:
+        callable : 登记过的上传器工厂
+
+    Raises:
+        ValueError : 没有登记这种目的地
+    '''
+    with _backends_lock:
+        factory = _backends.get(name)
+    if factory is None:
+        raise ValueError(f"未知的上传目的地类型 {name}，可用的有 {', '.join(sorted(_backends))}")
+    return factory
+
+
+class LocalDirectoryUploader(BaseUploader):
+    '''
+    把文件写到本地目录（USB 归档盘、挂载的 NAS），目录结构和本地检测目录相同
+
+    除了 `start_upload()` 自己读文件写入之外，还支持流式写入：`open_stream()` 之后
+    `write()` 由调用方按顺序写入文件内容，`commit()` 落盘并改名。多目的地上传时文件
+    只读一遍，读到的数据同时写给所有支持流式写入的目的地。
+
+    数据先写到 `<目标>.part`，fsync 之后再改名，写到一半断电不会留下不完整的文件。
+
+    Args:
+        file_name (str) : 本地文件路径
+        config (Config) : 配置管理器
+        directory (str) : 目标根目录
+    '''
+    def __init__(self, file_name, config, directory):
+        super().__init__(file_name, config)
+        if not directory:
+            raise ValueError('本地目录目的地没有配置 directory')
+        self.name = '本地目录'
+        self.directory = directory
+        local_directory = config.get_local_config().get('local_directory')
+        self.target = os.path.join(directory, os.path.relpath(self.file.file_path, local_directory))
+        self.uploading = True
+        self.written = 0
+        self._out = None
+
+    def start_upload(self):
+        self.open_stream()
+        try:
+            with open(self.file.file_path, 'rb') as f:
+                for block in iter(lambda: f.read(COPY_BLOCK_SIZE), b''):
+                    if not self.uploading:
+                        mainlog.debug(f'本次写入被停止')
+                        self.abort()
+                        return False
+                    self.write(block)
+        except Exception:
+            self.abort()
+            raise
+        return self.commit()
+
+    def open_stream(self):
+        os.makedirs(os.path.dirname(self.target), exist_ok=True)
+        self.written = 0
+        self._out = open(self.target + '.part', 'wb')
+
+    def write(self, block):
+        self._out.write(block)
+        self.written += len(block)
+
+    def commit(self):
+        '''落盘并改名，写入的大小和源文件对不上时返回 False'''
+        out, self._out = self._out, None
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+        if self.written != self.file.file_size:
+            mainlog.info(f'{self.target} 写入 {self.written} 字节，源文件 {self.file.file_size} 字节，放弃')
+            os.remove(out.name)
+            return False
+        os.replace(out.name, self.target)
+        mainlog.debug(f'已写入 {self.target}')
+        return True
+
+    def abort(self):
+        '''放弃写了一半的文件'''
+        out, self._out = self._out, None
+        if out is not None:
+            out.close()
+            if os.path.exists(out.name):
+                os.remove(out.name)
+
+    def stop_upload(self):
+        self.uploading = False
+
+    def upload_status(self):
+        return {'target': self.target, 'written': self.written, 'size': self.file.file_size}
+
+
+register_backend('baidu', lambda file_path, config, options: BaiduCloudUploader(
+    file_path, config, account=options.get('account')))
+register_backend('local', lambda file_path, config, options: LocalDirectoryUploader(
+    file_path, config, options.get('directory')))
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import sqlite3
+import tarfile
+import threading
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+
+class Bundle:
+    '''
+    一个待上传的小文件包
+
+    Args:
+        bundle_path (str) : 本地 tar 包路径
+        upload_relpath (str) : 上传到网盘时相对于应用目录的路径
+        members (list) : 包内的原始文件路径
+
+    Attributes:
+        offsets : 原始文件路径 -> (包内名称, 数据偏移, 大小)
+        failed : 没能打进包里的文件，需要交回正常流程
+    '''
+    def __init__(self, bundle_path, upload_relpath, members):
+        self.bundle_path = bundle_path
+        self.upload_relpath = upload_relpath
+        self.members = members
+        self.offsets = {}
+        self.failed = []
+
+    def __repr__(self):
+        return f'Bundle({self.upload_relpath}, {len(self.members)} files)'
+
+
+class SmallFileBundler:
+    '''
+    小文件打包器
+
+    小于阈值的文件不单独上传，而是按所在目录和时间窗口攒成 tar 包一起上传，
+    省掉每个文件的 precreate / superfile2 / create 三次 API 往返。包上传成功后
+    在索引库（SQLite）里记录每个原始文件落在哪个包、包内偏移多少。
+
+    打包出错（磁盘满、文件读到一半被删）时删掉写了一半的包，所有文件放进 `failed`
+    交回正常流程。
+
+    Args:
+        config (Config) : 配置管理器
+
+    Methods:
+        accepts(file_path) : 文件是否应该走打包
+        add(file_path) : 把文件加入所在目录的待打包分组
+        pop_due(force) : 取出一个到期（时间窗口到了或者包够大）的分组并打包
+        commit(bundle, remote_path) : 包上传成功后写入索引
+        lookup(file_path) : 查询文件所在的包
+    '''
+    def __init__(self, config):
+        bundle_config = config.get_bundle_config()
+        self.enabled = bundle_config.get('enabled')
+        self.threshold = bundle_config.get('threshold_kb') * 1024
+        self.window = bundle_config.get('window')
+        self.max_bundle_size = bundle_config.get('max_bundle_mb') * 1024 * 1024
+        self.bundle_dir = bundle_config.get('bundle_dir')
+        self.index_file = bundle_config.get('index_file')
+        self.local_directory = config.get_local_config().get('local_directory')
+
+        self.lock = threading.Lock()
+        self.groups = {} # 目录 -> {'files': [], 'size': 0, 'opened': 时间}
+        self._seq = 0
+        self.db = None # 第一次写入或者查询索引时才打开
+
+    def accepts(self, file_path):
+        '''文件是否应该走打包'''
+        if not self.enabled:
+            return False
+        try:
+            return os.path.getsize(file_path) < self.threshold
+        except OSError:
+            return False
+
+    def add(self, file_path):
+        '''把文件加入所在目录的待打包分组'''
+        dirpath = os.path.dirname(file_path)
+        size = os.path.getsize(file_path)
+        with self.lock:
+            group = self.groups.setdefault(dirpath, {'files': [], 'size': 0, 'opened': time.monotonic()})
+            if file_path not in group['files']:
+                group['files'].append(file_path)
+                group['size'] += size
+        mainlog.debug(f'{file_path} 加入 {dirpath} 的打包分组')
+
+    def pending_count(self):
+        with self.lock:
+            return sum(len(g['files']) for g in self.groups.values())
+
+    def pop_due(self, force=False):
+        '''
+        取出一个到期的分组并打成 tar 包
+
+        Args:
+            force (bool) : 忽略时间窗口，有就打包
+
+        Returns:
+            Bundle : 没有到期分组时返回 None
+        '''
+        now = time.monotonic()
+        with self.lock:
+            for dirpath, group in self.groups.items():
+                if force or now - group['opened'] >= self.window or group['size'] >= self.max_bundle_size:
+                    del self.groups[dirpath]
+                    self._seq += 1
+                    seq = self._seq
+                    break
+            else:
+                return None
+
+        return self._build(dirpath, group['files'], seq)
+
+    def commit(self, bundle, remote_path):
+        '''
+        包上传成功后写入索引
+
+        Args:
+            bundle (Bundle) : 已上传的包
+            remote_path (str) : 包在网盘上的路径
+        '''
+        rows = [(member, remote_path) + bundle.offsets[member] for member in bundle.members]
+        with self.lock:
+            db = self._index()
+            with db:
+                db.executemany(
+                    'INSERT OR REPLACE INTO bundle_index (file_path, bundle, member, offset, size) VALUES (?, ?, ?, ?, ?)',
+                    rows)
+        mainlog.info(f'{bundle} 已记录到打包索引')
+
+    def remove(self, bundle):
+        '''删除本地的 tar 包'''
+        if os.path.exists(bundle.bundle_path):
+            os.remove(bundle.bundle_path)
+
+    def lookup(self, file_path):
+        '''查询文件所在的包，不在任何包里返回 None'''
+        with self.lock:
+            row = self._index().execute(
+                'SELECT bundle, member, offset, size FROM bundle_index WHERE file_path = ?', (file_path,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('bundle', 'member', 'offset', 'size'), row))
+
+    def _build(self, dirpath, files, seq):
+        stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime())
+        bundle_name = f'_bundle_{stamp}_{seq}.tar'
+        bundle_path = os.path.join(self.bundle_dir, bundle_name)
+
+        reldir = os.path.relpath(dirpath, self.local_directory)
+        upload_relpath = bundle_name if reldir == '.' else f'{reldir}/{bundle_name}'
+
+        try:
+            return self._write_tar(bundle_path, upload_relpath, files)
+        except (OSError, tarfile.TarError) as e:
+            mainlog.warning(f'打包 {dirpath} 失败，{len(files)} 个文件交回正常流程: {e}')
+            bundle = Bundle(bundle_path, upload_relpath, [])
+            bundle.failed = list(files)
+            try:
+                self.remove(bundle)
+            except OSError:
+                pass
+            return bundle
+
+    def _write_tar(self, bundle_path, upload_relpath, files):
+        os.makedirs(self.bundle_dir, exist_ok=True)
+        members = []
+        failed = []
+        with tarfile.open(bundle_path, 'w') as tf:
+            for file_path in files:
+                try:
+                    tf.add(file_path, arcname=os.path.basename(file_path), recursive=False)
+                    members.append(file_path)
+                except OSError as e:
+                    # 打包前被删掉之类的情况，交回给正常流程处理
+                    mainlog.info(f'打包 {file_path} 失败: {e}')
+                    failed.append(file_path)
+
+        bundle = Bundle(bundle_path, upload_relpath, members)
+        bundle.failed = failed
+
+        # 重新读一遍拿到每个成员的数据偏移（长文件名会多占头部块，不能自己算）
+        by_name = {os.path.basename(m): m for m in members}
+        with tarfile.open(bundle_path, 'r') as tf:
+            for info in tf.getmembers():
+                bundle.offsets[by_name[info.name]] = (info.name, info.offset_data, info.size)
+
+        mainlog.debug(f'打包完成 {bundle}')
+        return bundle
+
+    def _index(self):
+        '''打开索引库，需要持有 self.lock；旧版本的 JSON 索引第一次打开时导入'''
+        if self.db is None:
+            self.db = sqlite3.connect(self.index_file, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            with self.db:
+                self.db.execute('CREATE TABLE IF NOT EXISTS bundle_index ('
+                                'file_path TEXT PRIMARY KEY, bundle TEXT NOT NULL, member TEXT NOT NULL, '
+                                'offset INTEGER NOT NULL, size INTEGER NOT NULL)')
+                self._import_json(os.path.splitext(self.index_file)[0] + '.json')
+        return self.db
+
+    def _import_json(self, legacy_file):
+        if legacy_file == self.index_file or not os.path.exists(legacy_file):
+            return
+        if self.db.execute('SELECT 1 FROM bundle_index LIMIT 1').fetchone():
+            return
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        self.db.executemany(
+            'INSERT OR REPLACE INTO bundle_index (file_path, bundle, member, offset, size) VALUES (?, ?, ?, ?, ?)',
+            ((path, e['bundle'], e['member'], e['offset'], e['size']) for path, e in index.items()))
+        mainlog.info(f'已从 {legacy_file} 导入 {len(index)} 条打包索引')
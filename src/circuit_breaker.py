@@ -0,0 +1,167 @@
+import time
+import threading
+from collections import deque
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+THROTTLE_ERRNOS = {31034, -55} # 接口频控、服务繁忙，算作服务端故障
+
+
+def is_service_failure(result=None, error=None):
+    '''
+    判断一次接口调用是不是服务端的问题
+
+    网络错误、HTTP 5xx / 429、频控错误码算服务端故障；HTTP 4xx、token 失效、
+    文件名非法这类和单个请求有关的错误不算，不应该让整个上传暂停。
+
+    Args:
+        result : 接口返回，json dict 或者带 status 的 HTTP 响应
+        error (Exception) : 调用抛出的异常
+    '''
+    if error is not None:
+        status = getattr(error, 'status', None)
+        return status is None or status >= 500 or status == 429
+    if isinstance(result, dict):
+        return result.get('errno') in THROTTLE_ERRNOS
+    status = getattr(result, 'status', None)
+    return status is not None and (status >= 500 or status == 429)
+
+
+class CircuitBreaker:
+    '''
+    百度网盘接口的熔断器
+
+    统计最近 `window` 秒内的接口调用，调用数不少于 `min_calls` 且服务端故障占比达到
+    `error_rate` 时断开：所有上传在 `wait()` 处暂停，不再哈希、切片和请求接口。
+    断开期间每隔 `probe_interval` 秒调用一次 `probe`（一个很便宜的接口），成功后恢复。
+
+    Args:
+        window (float) : 统计窗口（秒）
+        error_rate (float) : 断开的故障占比
+        min_calls (int) : 窗口内至少多少次调用才判断
+        probe_interval (float) : 断开后探测的间隔（秒）
+        probe (callable) : 探测函数，抛出异常或返回服务端故障表示还没恢复
+        enabled (bool) : 关闭时只透传调用，不统计
+
+    Methods:
+        call(func, *args, **kwargs) : 调用接口并记录结果
+        call_async(awaitable) : 协程版本的 call
+        record(ok) : 手动记录一次调用结果
+        is_open() : 是否处于断开状态
+        wait(timeout) : 断开时阻塞到恢复，返回是否已恢复
+    '''
+    def __init__(self, window=60, error_rate=0.5, min_calls=20, probe_interval=30, probe=None, enabled=True):
+        self.window = window
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.probe_interval = probe_interval
+        self.probe = probe
+        self.enabled = enabled
+        self._outcomes = deque() # (时间, 是否成功)
+        self._failures = 0
+        self._open = False
+        self._cond = threading.Condition()
+
+    def call(self, func, *args, **kwargs):
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.record(not is_service_failure(error=e))
+            raise
+        self.record(not is_service_failure(result))
+        return result
+
+    async def call_async(self, awaitable):
+        try:
+            result = await awaitable
+        except Exception as e:
+            self.record(not is_service_failure(error=e))
+            raise
+        self.record(not is_service_failure(result))
+        return result
+
+    def record(self, ok):
+        if not self.enabled:
+            return
+        with self._cond:
+            now = time.monotonic()
+            self._outcomes.append((now, ok))
+            if not ok:
+                self._failures += 1
+            while self._outcomes and self._outcomes[0][0] < now - self.window:
+                if not self._outcomes.popleft()[1]:
+                    self._failures -= 1
+
+            total = len(self._outcomes)
+            if not self._open and total >= self.min_calls and self._failures / total >= self.error_rate:
+                self._trip(total)
+
+    def is_open(self):
+        with self._cond:
+            return self._open
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._open and not shutdown_event.is_set():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(1 if remaining is None else min(1, remaining))
+            return not self._open
+
+    def _trip(self, total):
+        '''断开并启动探测线程，调用方持有 self._cond'''
+        mainlog.warning(
+            f'百度网盘接口最近 {total} 次调用中 {self._failures} 次失败，暂停上传，每 {self.probe_interval} 秒探测一次')
+        self._open = True
+        threading.Thread(target=self._probe_until_recovered, name='breaker-probe', daemon=True).start()
+
+    def _probe_until_recovered(self):
+        while not shutdown_event.wait(self.probe_interval):
+            try:
+                if self.probe is not None and is_service_failure(self.probe()):
+                    continue
+            except Exception as e:
+                mainlog.debug(f'接口探测失败: {e}')
+                continue
+
+            with self._cond:
+                self._open = False
+                self._outcomes.clear()
+                self._failures = 0
+                self._cond.notify_all()
+            mainlog.warning('百度网盘接口已恢复，继续上传')
+            return
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(config, probe=None):
+    '''
+    获取配置文件对应的熔断器，同一个进程内的所有上传器共享
+
+    Args:
+        config (Config) : 配置管理器
+        probe (callable) : 第一次创建时使用的探测函数
+
+    Returns:
+        CircuitBreaker
+    '''
+    with _breakers_lock:
+        breaker = _breakers.get(config.filename)
+        if breaker is None:
+            breaker_config = config.get_circuit_breaker_config()
+            breaker = CircuitBreaker(
+                window=breaker_config.get('window'),
+                error_rate=breaker_config.get('error_rate'),
+                min_calls=breaker_config.get('min_calls'),
+                probe_interval=breaker_config.get('probe_interval'),
+                probe=probe,
+                enabled=breaker_config.get('enabled'),
+            )
+            _breakers[config.filename] = breaker
+        return breaker
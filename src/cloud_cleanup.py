@@ -0,0 +1,207 @@
+import os
+import json
+import time
+import posixpath
+import threading
+
+from file_uploader import _sdk, SDK_FAST_PATH
+from downloader import Downloader, DownloadJournal, archive_directory_for, STATE_DELETED, STATE_ARCHIVED
+from upload_verifier import FILEMETAS_MAX_FSIDS
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+ASYNC_TASK = 2 # filemanager 的 async 参数：0 同步，1 自适应，2 异步
+
+
+class RateLimiter:
+    '''
+    限制接口调用频率，两次调用之间至少间隔 1 / rate 秒
+
+    Args:
+        rate (float) : 每秒最多调用几次，小于等于 0 表示不限制
+    '''
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class CleanupTask:
+    '''
+    一个已经提交的异步删除 / 移动任务
+
+    Attributes:
+        taskid : 网盘返回的任务 id
+        remaining : 还没确认完成的文件 fs_id -> 网盘路径
+        started : 提交时间
+    '''
+    def __init__(self, taskid, batch):
+        self.taskid = taskid
+        self.remaining = {fs_id: path for path, fs_id, _ in batch}
+        self.started = time.monotonic()
+
+
+class CloudCleanup:
+    '''
+    文件确认下载到 NAS 后，清理网盘上的副本
+
+    只处理下载日志里已经完成（md5 校验通过）并且 NAS 上的文件还在、大小一致的文件。
+    `mode = delete` 用 `FilemanagerApi.filemanagerdelete` 删除，`mode = archive` 用
+    `filemanagermove` 移到归档目录（下载时跳过这个目录）。每批 `batch_size` 个文件，
+    以异步任务提交，最多同时挂 `max_inflight` 个任务。
+
+    SDK 里没有查询异步任务的接口，任务进度用 filemetas 按 fs_id 查：删除的文件查不到、
+    移动的文件路径已经在归档目录下，就算完成。超过 `task_timeout` 还没完成的文件留在
+    下载日志里，下次运行再处理。提交和查询共用一个限速器，不超过 `requests_per_second`。
+
+    Args:
+        config (Config) : 配置管理器
+        journal (DownloadJournal) : 下载日志，默认按配置创建
+
+    Methods:
+        confirmed() : 可以清理的文件 (path, fs_id, size)
+        run() : 清理所有可以清理的文件，返回完成的个数
+    '''
+    def __init__(self, config, journal=None):
+        cleanup_config = config.get_cleanup_config()
+        self.mode = cleanup_config.get('mode')
+        if self.mode not in ('delete', 'archive'):
+            raise ValueError(f'未知的清理方式 Cleanup.mode = {self.mode}，只支持 delete / archive')
+        self.archive_directory = archive_directory_for(config)
+        self.batch_size = max(1, cleanup_config.get('batch_size'))
+        self.max_inflight = max(1, cleanup_config.get('max_inflight'))
+        self.poll_interval = cleanup_config.get('poll_interval')
+        self.task_timeout = cleanup_config.get('task_timeout')
+        self.limiter = RateLimiter(cleanup_config.get('requests_per_second'))
+        self.journal = journal or DownloadJournal(config.get_download_config().get('journal'))
+        self.downloader = Downloader(config, self.journal)
+        self.auth = self.downloader.auth
+        self.pan_host = self.downloader.pan_host
+
+    def confirmed(self):
+        result = []
+        for path, fs_id, size in self.journal.downloaded():
+            local_path = self.downloader.local_path_for(path)
+            if os.path.isfile(local_path) and os.path.getsize(local_path) == size:
+                result.append((path, fs_id, size))
+            else:
+                mainlog.warning(f'{path} 在 NAS 上的副本 {local_path} 不见了或者大小不对，不清理')
+        return result
+
+    def run(self):
+        candidates = self.confirmed()
+        inflight = []
+        cleaned = 0
+        for i in range(0, len(candidates), self.batch_size):
+            if shutdown_event.is_set():
+                break
+            task = self._submit(candidates[i:i + self.batch_size])
+            if task is not None:
+                inflight.append(task)
+            while len(inflight) >= self.max_inflight:
+                cleaned += self._poll(inflight)
+        while inflight and not shutdown_event.is_set():
+            cleaned += self._poll(inflight)
+
+        mainlog.info(f'网盘清理完成 {cleaned} / {len(candidates)} 个文件（{self.mode}）')
+        return cleaned
+
+    def _submit(self, batch):
+        '''提交一批文件，失败时返回 None'''
+        if self.mode == 'delete':
+            filelist = [path for path, _, _ in batch]
+        else:
+            filelist = [{
+                'path': path,
+                'dest': self._archive_path(path, dirname=True),
+                'newname': posixpath.basename(path),
+                'ondup': 'overwrite',
+            } for path, _, _ in batch]
+
+        self.limiter.wait()
+        try:
+            api_response = self._api_filemanager(filelist)
+        except Exception as e:
+            mainlog.warning(f'提交 {len(batch)} 个文件的清理任务失败: {e}')
+            return None
+        if api_response.get('errno'):
+            mainlog.warning(f"提交 {len(batch)} 个文件的清理任务失败 错误码:{api_response.get('errno')}")
+            return None
+
+        mainlog.debug(f"已提交清理任务 {api_response.get('taskid')}，{len(batch)} 个文件")
+        return CleanupTask(api_response.get('taskid'), batch)
+
+    def _poll(self, inflight):
+        '''查询一轮所有进行中的任务，返回本轮确认完成的文件数'''
+        time.sleep(self.poll_interval)
+        finished = 0
+        for task in list(inflight):
+            finished += self._check(task)
+            if not task.remaining:
+                inflight.remove(task)
+            elif time.monotonic() - task.started > self.task_timeout:
+                mainlog.warning(f'清理任务 {task.taskid} 超时，{len(task.remaining)} 个文件下次再处理')
+                inflight.remove(task)
+        return finished
+
+    def _check(self, task):
+        fs_ids = list(task.remaining)
+        done = []
+        for i in range(0, len(fs_ids), FILEMETAS_MAX_FSIDS):
+            chunk = fs_ids[i:i + FILEMETAS_MAX_FSIDS]
+            self.limiter.wait()
+            try:
+                api_response = self._api_filemetas(chunk)
+            except Exception as e:
+                mainlog.debug(f'查询清理任务 {task.taskid} 失败: {e}')
+                continue
+            if api_response.get('errno'):
+                continue
+            metas = {meta.get('fs_id'): meta for meta in api_response.get('list') or []}
+            for fs_id in chunk:
+                if self._finished(metas.get(fs_id), task.remaining[fs_id]):
+                    done.append(task.remaining.pop(fs_id))
+
+        if done:
+            self.journal.mark(done, STATE_DELETED if self.mode == 'delete' else STATE_ARCHIVED)
+        return len(done)
+
+    def _finished(self, meta, path):
+        '''删除的文件查不到，移动的文件路径已经在归档目录下'''
+        if self.mode == 'delete':
+            return meta is None
+        return meta is not None and meta.get('path') == self._archive_path(path)
+
+    def _archive_path(self, path, dirname=False):
+        relpath = posixpath.relpath(path, self.downloader.root)
+        target = posixpath.join(self.archive_directory, relpath)
+        return posixpath.dirname(target) if dirname else target
+
+    def _api_filemanager(self, filelist):
+        '''删除 / 移动 api 封装，异步执行，返回 taskid'''
+        openapi_client = _sdk()[0]
+        from openapi_client.api import filemanager_api
+        filelist = json.dumps(filelist, ensure_ascii=False)
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
+            api_instance = filemanager_api.FilemanagerApi(api_client)
+            if self.mode == 'delete':
+                return api_instance.filemanagerdelete(self.auth.get_token(), ASYNC_TASK, filelist, **SDK_FAST_PATH)
+            return api_instance.filemanagermove(
+                self.auth.get_token(), ASYNC_TASK, filelist, ondup='overwrite', **SDK_FAST_PATH)
+
+    def _api_filemetas(self, fs_ids):
+        openapi_client = _sdk()[0]
+        from openapi_client.api import multimediafile_api
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
+            api_instance = multimediafile_api.MultimediafileApi(api_client)
+            return api_instance.xpanmultimediafilemetas(self.auth.get_token(), json.dumps(fs_ids), **SDK_FAST_PATH)
@@ -0,0 +1,144 @@
+import os
+import zlib
+import threading
+
+try:
+    import zstandard
+except ImportError: # zstd 是可选依赖，没装时退回 gzip
+    zstandard = None
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+READ_BLOCK = 1024 * 1024 # 每次从源文件读取的字节数
+
+SUFFIXES = {
+    'zstd': '.zst',
+    'gzip': '.gz',
+}
+
+DEFAULT_LEVELS = {
+    'zstd': 3,
+    'gzip': 6,
+}
+
+
+def _make_compressobj(codec, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if codec == 'gzip':
+        return zlib.compressobj(level, zlib.DEFLATED, 31) # wbits=31 输出 gzip 格式
+    raise ValueError(f'不支持的压缩格式 {codec}')
+
+
+class CompressedReader:
+    '''
+    边读边压缩的只读文件对象
+
+    `read(n)` 返回压缩后的数据，切片时直接替换原始文件对象，不会在磁盘上生成完整的压缩文件。
+
+    Args:
+        file_path (str) : 源文件路径
+        codec (str) : zstd / gzip
+        level (int) : 压缩级别
+
+    Attributes:
+        raw_bytes : 已读取的原始字节数
+        compressed_bytes : 已输出的压缩字节数
+    '''
+    def __init__(self, file_path, codec, level=None):
+        self._src = open(file_path, 'rb')
+        self._compressor = _make_compressobj(codec, level if level is not None else DEFAULT_LEVELS[codec])
+        self._buffer = bytearray()
+        self._eof = False
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+
+    def read(self, size=-1):
+        while not self._eof and (size < 0 or len(self._buffer) < size):
+            block = self._src.read(READ_BLOCK)
+            if block:
+                self.raw_bytes += len(block)
+                self._buffer += self._compressor.compress(block)
+            else:
+                self._buffer += self._compressor.flush()
+                self._eof = True
+
+        if size < 0:
+            size = len(self._buffer)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.compressed_bytes += len(data)
+        return data
+
+    def close(self):
+        self._src.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class CompressionPolicy:
+    '''
+    按扩展名决定是否压缩、用哪种格式
+
+    Args:
+        compression_config (dict) : `Config.get_compression_config()` 的结果
+
+    Methods:
+        codec_for(file_path) : 返回 (codec, level)，不压缩时返回 (None, None)
+        suffix(codec) : 远端文件名追加的后缀
+    '''
+    def __init__(self, compression_config):
+        self.enabled = compression_config.get('enabled')
+        self.min_size = compression_config.get('min_size_kb') * 1024
+        self.levels = {
+            'zstd': compression_config.get('zstd_level'),
+            'gzip': compression_config.get('gzip_level'),
+        }
+        self.extensions = {}
+        for codec, key in (('gzip', 'gzip_extensions'), ('zstd', 'zstd_extensions')):
+            for ext in compression_config.get(key).split(','):
+                ext = ext.strip().lower()
+                if ext:
+                    self.extensions[ext if ext.startswith('.') else f'.{ext}'] = codec
+
+        if zstandard is None and 'zstd' in self.extensions.values():
+            mainlog.warning('未安装 zstandard，zstd 压缩的文件改用 gzip')
+            self.extensions = {ext: 'gzip' for ext in self.extensions}
+
+    def codec_for(self, file_path):
+        if not self.enabled:
+            return None, None
+        codec = self.extensions.get(os.path.splitext(file_path)[1].lower())
+        if codec is None or os.path.getsize(file_path) < self.min_size:
+            return None, None
+        return codec, self.levels.get(codec)
+
+    def suffix(self, codec):
+        return SUFFIXES.get(codec, '') if codec else ''
+
+
+_policies = {}
+_policies_lock = threading.Lock()
+
+def get_compression_policy(config):
+    '''
+    获取配置文件对应的压缩策略，同一个进程内共享，没装 zstandard 的警告只打一次
+
+    Args:
+        config (Config) : 配置管理器
+
+    Returns:
+        CompressionPolicy
+    '''
+    with _policies_lock:
+        policy = _policies.get(config.filename)
+        if policy is None:
+            policy = CompressionPolicy(config.get_compression_config())
+            _policies[config.filename] = policy
+        return policy
@@ -2,9 +2,14 @@ import configparser
 import threading
 import logging
 import os
+import socket
 from utils import MAIN_LOG
 mainlog = logging.getLogger(MAIN_LOG)
 
+DEFAULT_ACCOUNT = 'default' # [BaiduCloud] 区块对应的账号
+ACCOUNT_SECTION_PREFIX = 'BaiduCloud:' # 其他账号的区块名，如 [BaiduCloud:second]
+DESTINATION_SECTION_PREFIX = 'Destination:' # 额外目的地的区块名，如 [Destination:usb]
+
 class Config:
     def __init__(self, filename='config.ini'):
         self.filename = filename
@@ -36,19 +41,238 @@ class Config:
                 'check_interval': self.config.getint(section, 'checkinterval', fallback=30)
             }
 
-    def get_baidu_config(self):
-        section = 'BaiduCloud'
+    def get_baidu_config(self, account=None):
+        '''
+        百度网盘账号的配置
+
+        Args:
+            account (str) : 账号名，默认是 [BaiduCloud]；其他账号的应用信息没写时沿用 [BaiduCloud] 的
+        '''
+        section = self.account_section(account)
         with self.lock:
+            app = lambda key, fallback: self.config.get(
+                section, key, fallback=self.config.get('BaiduCloud', key, fallback=fallback))
             return {
-                'app_name': self.config.get(section, 'appname', fallback='摄影素材自动备份'),
-                'app_id': self.config.get(section, 'appid', fallback='47097507'),
-                'app_key': self.config.get(section, 'appkey', fallback='H794OU88Q5KXH89ahoPGVCFNMxVBb1Sb'),
-                'secret_key': self.config.get(section, 'secretkey', fallback='pWjzs8MIBw2fxutAXsxVpN0Pxa0OqRT6'),
-                'sign_key' : self.config.get(section, 'signkey', fallback='X3JHR8D=5g0!EP%RF1FzGDrMQFPQkn1V'),
+                'app_name': app('appname', '摄影素材自动备份'),
+                'app_id': app('appid', '47097507'),
+                'app_key': app('appkey', 'H794OU88Q5KXH89ahoPGVCFNMxVBb1Sb'),
+                'secret_key': app('secretkey', 'pWjzs8MIBw2fxutAXsxVpN0Pxa0OqRT6'),
+                'sign_key' : app('signkey', 'X3JHR8D=5g0!EP%RF1FzGDrMQFPQkn1V'),
                 'access_token': self.config.get(section, 'accesstoken', fallback=''),
                 'refresh_token': self.config.get(section, 'refreshtoken', fallback=''),
+                'token_expires_at': self.config.getfloat(section, 'tokenexpiresat', fallback=0),
+                'concurrency': self.config.getint(section, 'concurrency', fallback=0),
             }
-    
+
+    def get_accounts(self):
+        '''所有百度网盘账号，第一个是 [BaiduCloud]'''
+        with self.lock:
+            return [DEFAULT_ACCOUNT] + [section[len(ACCOUNT_SECTION_PREFIX):] for section in self.config.sections()
+                                        if section.startswith(ACCOUNT_SECTION_PREFIX)]
+
+    def account_section(self, account=None):
+        '''账号对应的配置区块名'''
+        if account is None or account == DEFAULT_ACCOUNT:
+            return 'BaiduCloud'
+        return ACCOUNT_SECTION_PREFIX + account
+
+    def get_accounts_config(self):
+        '''多个账号之间分配文件的配置'''
+        section = 'Accounts'
+        with self.lock:
+            return {
+                'shard_by': self.config.get(section, 'shardby', fallback='directory'),
+            }
+
+    def get_upload_config(self):
+        '''上传流程相关的可选配置，整个区块都可以省略'''
+        section = 'Upload'
+        with self.lock:
+            return {
+                'pipeline_depth': self.config.getint(section, 'pipelinedepth', fallback=2),
+                'stage_report_interval': self.config.getint(section, 'stagereportinterval', fallback=60),
+                'engine': self.config.get(section, 'engine', fallback='thread'),
+                'concurrent_files': self.config.getint(section, 'concurrentfiles', fallback=8),
+                'part_concurrency': self.config.getint(section, 'partconcurrency', fallback=5),
+                'max_connections': self.config.getint(section, 'maxconnections', fallback=200),
+                'read_workers': self.config.getint(section, 'readworkers', fallback=4),
+                'processes': self.config.getint(section, 'processes', fallback=0),
+                'host_discovery': self.config.getboolean(section, 'hostdiscovery', fallback=True),
+                'max_upload_hosts': self.config.getint(section, 'maxuploadhosts', fallback=3),
+                'host_refresh_interval': self.config.getint(section, 'hostrefreshinterval', fallback=1800),
+                'upload_hosts': self.config.get(section, 'uploadhosts', fallback=''),
+                'source_addresses': self.config.get(section, 'sourceaddresses', fallback=''),
+                'queue_window': self.config.getint(section, 'queuewindow', fallback=1000),
+                'lease_seconds': self.config.getint(section, 'leaseseconds', fallback=21600),
+                'rapid_upload': self.config.getboolean(section, 'rapidupload', fallback=True),
+                'rapid_upload_url': self.config.get(section, 'rapiduploadurl', fallback=''),
+                'dedup': self.config.getboolean(section, 'dedup', fallback=True),
+                'content_index': self.config.get(section, 'contentindex', fallback='content_index.db'),
+            }
+
+    def get_retry_config(self):
+        '''上传失败后的重试退避配置'''
+        section = 'Retry'
+        with self.lock:
+            return {
+                'max_attempts': self.config.getint(section, 'maxattempts', fallback=8),
+                'base_delay': self.config.getfloat(section, 'basedelay', fallback=60),
+                'max_delay': self.config.getfloat(section, 'maxdelay', fallback=3600),
+            }
+
+    def get_reconcile_config(self):
+        '''和网盘目录对账的配置'''
+        section = 'Reconcile'
+        with self.lock:
+            return {
+                'on_startup': self.config.getboolean(section, 'onstartup', fallback=False),
+                'ttl': self.config.getfloat(section, 'ttl', fallback=86400),
+                'index_file': self.config.get(section, 'indexfile', fallback='remote_index.db'),
+            }
+
+    def get_download_config(self):
+        '''从网盘下载到本地（NAS）的配置'''
+        section = 'Download'
+        with self.lock:
+            return {
+                'local_directory': self.config.get(section, 'localdirectory', fallback=''),
+                'remote_directory': self.config.get(section, 'remotedirectory', fallback=''),
+                'concurrent_files': self.config.getint(section, 'concurrentfiles', fallback=4),
+                'connections': self.config.getint(section, 'connections', fallback=4),
+                'chunk_mb': self.config.getfloat(section, 'chunkmb', fallback=16),
+                'journal': self.config.get(section, 'journal', fallback='download_journal.db'),
+                'check_md5': self.config.getboolean(section, 'checkmd5', fallback=True),
+            }
+
+    def get_cleanup_config(self):
+        '''下载到 NAS 后清理网盘的配置'''
+        section = 'Cleanup'
+        with self.lock:
+            return {
+                'mode': self.config.get(section, 'mode', fallback='delete'),
+                'archive_directory': self.config.get(section, 'archivedirectory', fallback=''),
+                'batch_size': self.config.getint(section, 'batchsize', fallback=500),
+                'max_inflight': self.config.getint(section, 'maxinflight', fallback=4),
+                'requests_per_second': self.config.getfloat(section, 'requestspersecond', fallback=2),
+                'poll_interval': self.config.getfloat(section, 'pollinterval', fallback=5),
+                'task_timeout': self.config.getfloat(section, 'tasktimeout', fallback=600),
+            }
+
+    def get_quota_config(self):
+        '''按网盘剩余空间放行上传的配置'''
+        section = 'Quota'
+        with self.lock:
+            return {
+                'enabled': self.config.getboolean(section, 'enabled', fallback=True),
+                'refresh_interval': self.config.getfloat(section, 'refreshinterval', fallback=600),
+                'reserve_mb': self.config.getfloat(section, 'reservemb', fallback=1024),
+            }
+
+    def get_fanout_config(self):
+        '''除了百度网盘之外还要写入的目的地'''
+        section = 'FanOut'
+        with self.lock:
+            destinations = self.config.get(section, 'destinations', fallback='')
+            return {
+                'destinations': [name.strip() for name in destinations.split(',') if name.strip()],
+                'queue_depth': self.config.getint(section, 'queuedepth', fallback=8),
+            }
+
+    def get_destination_config(self, name):
+        '''
+        一个额外目的地的配置，区块名是 [Destination:<name>]
+
+        Args:
+            name (str) : 目的地名称
+        '''
+        section = DESTINATION_SECTION_PREFIX + name
+        with self.lock:
+            return {
+                'backend': self.config.get(section, 'backend', fallback='local'),
+                'directory': self.config.get(section, 'directory', fallback=''),
+                'account': self.config.get(section, 'account', fallback=DEFAULT_ACCOUNT),
+                'status_file': self.config.get(section, 'statusfile', fallback=f'upload_status.{name}.db'),
+            }
+
+    def get_coordination_config(self):
+        '''多台机器共用一个待上传目录时的协调配置'''
+        section = 'Coordination'
+        local_config = self.get_local_config()
+        with self.lock:
+            return {
+                'enabled': self.config.getboolean(section, 'enabled', fallback=False),
+                'store': self.config.get(section, 'store', fallback=os.path.join(
+                    local_config.get('local_directory'), '.autoback_leases.db')),
+                'node_name': self.config.get(section, 'nodename', fallback=
+                                             f"{local_config.get('device_name')}@{socket.gethostname()}"),
+                'batch_size': self.config.getint(section, 'batchsize', fallback=20),
+                'lease_seconds': self.config.getint(section, 'leaseseconds', fallback=300),
+                'heartbeat_interval': self.config.getint(section, 'heartbeatinterval', fallback=60),
+            }
+
+    def get_verify_config(self):
+        '''上传完成后批量核对网盘文件的配置'''
+        section = 'Verify'
+        with self.lock:
+            return {
+                'enabled': self.config.getboolean(section, 'enabled', fallback=True),
+                'batch_size': self.config.getint(section, 'batchsize', fallback=100),
+                'interval': self.config.getfloat(section, 'interval', fallback=30),
+                'check_md5': self.config.getboolean(section, 'checkmd5', fallback=True),
+            }
+
+    def get_timeout_config(self):
+        '''各阶段接口请求的超时和分片对冲配置'''
+        section = 'Timeouts'
+        with self.lock:
+            return {
+                'connect': self.config.getfloat(section, 'connect', fallback=10),
+                'precreate': self.config.getfloat(section, 'precreate', fallback=60),
+                'upload': self.config.getfloat(section, 'upload', fallback=120),
+                'create': self.config.getfloat(section, 'create', fallback=60),
+                'hedge': self.config.getboolean(section, 'hedge', fallback=True),
+                'hedge_percentile': self.config.getfloat(section, 'hedgepercentile', fallback=95),
+                'hedge_min_samples': self.config.getint(section, 'hedgeminsamples', fallback=20),
+            }
+
+    def get_circuit_breaker_config(self):
+        '''百度网盘接口熔断的配置'''
+        section = 'CircuitBreaker'
+        with self.lock:
+            return {
+                'enabled': self.config.getboolean(section, 'enabled', fallback=True),
+                'window': self.config.getfloat(section, 'window', fallback=60),
+                'error_rate': self.config.getfloat(section, 'errorrate', fallback=0.5),
+                'min_calls': self.config.getint(section, 'mincalls', fallback=20),
+                'probe_interval': self.config.getfloat(section, 'probeinterval', fallback=30),
+            }
+
+    def get_bundle_config(self):
+        '''小文件打包上传的配置，默认关闭'''
+        section = 'Bundle'
+        with self.lock:
+            return {
+                'enabled': self.config.getboolean(section, 'enabled', fallback=False),
+                'threshold_kb': self.config.getint(section, 'thresholdkb', fallback=1024),
+                'window': self.config.getint(section, 'window', fallback=300),
+                'max_bundle_mb': self.config.getint(section, 'maxbundlemb', fallback=256),
+                'bundle_dir': self.config.get(section, 'bundledir', fallback='bundles'),
+                'index_file': self.config.get(section, 'indexfile', fallback='bundle_index.db'),
+            }
+
+    def get_compression_config(self):
+        '''上传前按扩展名边读边压缩的配置，默认关闭'''
+        section = 'Compression'
+        with self.lock:
+            return {
+                'enabled': self.config.getboolean(section, 'enabled', fallback=False),
+                'zstd_extensions': self.config.get(section, 'zstdextensions', fallback='.fits,.fit,.fts'),
+                'gzip_extensions': self.config.get(section, 'gzipextensions', fallback=''),
+                'zstd_level': self.config.getint(section, 'zstdlevel', fallback=3),
+                'gzip_level': self.config.getint(section, 'gziplevel', fallback=6),
+                'min_size_kb': self.config.getint(section, 'minsizekb', fallback=64),
+            }
+
     def update_save(self, section, updates):
         '''
         更新配置文件
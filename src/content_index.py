@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+BUSY_TIMEOUT = 30 # 多个上传子进程同时写索引时等锁的时间（秒）
+
+
+class ContentIndex:
+    '''
+    已上传内容的索引，用来在网盘上直接复制重复的文件
+
+    记录两张表：
+
+    - content : (md5, 大小, 压缩格式) -> 网盘路径，每次上传成功后写入
+    - inodes : (设备号, inode) -> md5，连同大小和修改时间，硬链接不用重新哈希就能知道内容
+
+    `process` 引擎下每个子进程各自打开同一个库，写入时按 `timeout` 等别的进程释放锁。
+
+    Args:
+        filename (str) : 索引数据库文件
+        timeout (float) : 数据库被锁住时最多等多久（秒）
+
+    Methods:
+        md5_for(stat) : 按 inode 查已知的 md5，大小或修改时间变了返回 None
+        find(md5, size, codec) : 相同内容在网盘上的路径
+        add(md5, size, codec, remote_path, stat) : 记录一次成功上传
+        forget(remote_path) : 网盘上的文件已经不在时删除记录
+    '''
+    def __init__(self, filename='content_index.db', timeout=BUSY_TIMEOUT):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=timeout, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS content ('
+                        'md5 TEXT NOT NULL, size INTEGER NOT NULL, codec TEXT NOT NULL, remote_path TEXT NOT NULL, '
+                        'PRIMARY KEY (md5, size, codec))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS inodes ('
+                        'dev INTEGER NOT NULL, ino INTEGER NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+                        'md5 TEXT NOT NULL, PRIMARY KEY (dev, ino))')
+        self.db.commit()
+
+    def md5_for(self, stat):
+        with self.lock:
+            row = self.db.execute('SELECT md5 FROM inodes WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?',
+                                  (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)).fetchone()
+        return row[0] if row else None
+
+    def find(self, md5, size, codec=None):
+        with self.lock:
+            row = self.db.execute('SELECT remote_path FROM content WHERE md5 = ? AND size = ? AND codec = ?',
+                                  (md5, size, codec or '')).fetchone()
+        return row[0] if row else None
+
+    def add(self, md5, size, codec, remote_path, stat=None):
+        with self.lock:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO content (md5, size, codec, remote_path) VALUES (?, ?, ?, ?)',
+                                (md5, size, codec or '', remote_path))
+                if stat is not None:
+                    self.db.execute('INSERT OR REPLACE INTO inodes (dev, ino, size, mtime_ns, md5) VALUES (?, ?, ?, ?, ?)',
+                                    (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, md5))
+
+    def forget(self, remote_path):
+        with self.lock:
+            with self.db:
+                self.db.execute('DELETE FROM content WHERE remote_path = ?', (remote_path,))
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_content_index(config, account=None):
+    '''
+    获取配置文件对应的内容索引，同一个进程内共享，关闭去重时返回 None
+
+    网盘内复制只能在同一个账号里进行，其他账号的索引存在 `<contentindex>.<账号>` 文件里。
+
+    Args:
+        config (Config) : 配置管理器
+        account (str) : 百度网盘账号，默认是 [BaiduCloud]
+
+    Returns:
+        ContentIndex or None
+    '''
+    upload_config = config.get_upload_config()
+    if not upload_config.get('dedup'):
+        return None
+    filename = upload_config.get('content_index')
+    if config.account_section(account) != config.account_section():
+        filename = f'{filename}.{account}'
+    with _indexes_lock:
+        index = _indexes.get((config.filename, filename))
+        if index is None:
+            index = ContentIndex(filename)
+            _indexes[(config.filename, filename)] = index
+        return index
@@ -0,0 +1,288 @@
+import os
+import json
+import posixpath
+import time
+import sqlite3
+import threading
+import concurrent.futures
+import urllib.request
+from urllib.parse import quote
+
+from file_uploader import _sdk, SDK_FAST_PATH, PAN_HOST, remote_md5_is_content
+from storage_auth import get_token_provider
+from reconciler import list_remote_files
+from upload_verifier import FILEMETAS_MAX_FSIDS
+from utils import cal_file_hashes
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+DLINK_USER_AGENT = 'pan.baidu.com' # dlink 下载要求的 User-Agent，否则返回 403
+PART_SUFFIX = '.part' # 下载中的文件后缀，校验通过后改名
+READ_BUFFER = 1024 * 1024
+
+STATE_PENDING = 'pending'
+STATE_DONE = 'done'
+STATE_DELETED = 'deleted' # 下载完成后已经从网盘删除
+STATE_ARCHIVED = 'archived' # 下载完成后已经移到网盘归档目录
+
+
+def archive_directory_for(config):
+    '''网盘上的归档目录，下载时跳过'''
+    return (config.get_cleanup_config().get('archive_directory')
+            or f"/apps/{config.get_baidu_config().get('app_name')}/archive").rstrip('/')
+
+
+class DownloadJournal:
+    '''
+    下载日志，记录要下载的网盘文件和每个文件已经下载完成的区间
+
+    Args:
+        filename (str) : 日志数据库
+
+    Methods:
+        listed_at(root) / touch(root, listed_at) : 上次拉取网盘目录的时间
+        add(entries) : 登记网盘文件，新文件或者大小、md5 变了的文件重新进入待下载
+        pending() : 待下载的文件 (path, fs_id, size, md5, server_mtime)
+        done_parts(path) / add_part(path, offset) / reset(path) : 已完成的区间
+        finish(path) : 文件下载完成
+        downloaded() : 已经下载完成、还在网盘上的文件 (path, fs_id, size)
+        mark(paths, state) : 批量修改文件状态
+    '''
+    def __init__(self, filename='download_journal.db'):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS files ('
+                        'path TEXT PRIMARY KEY, fs_id INTEGER NOT NULL, size INTEGER NOT NULL, md5 TEXT, '
+                        'server_mtime INTEGER, state TEXT NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS parts (path TEXT NOT NULL, offset INTEGER NOT NULL, '
+                        'PRIMARY KEY (path, offset))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS listing (root TEXT PRIMARY KEY, listed_at REAL NOT NULL)')
+        self.db.commit()
+
+    def listed_at(self, root):
+        with self.lock:
+            row = self.db.execute('SELECT listed_at FROM listing WHERE root = ?', (root,)).fetchone()
+        return row[0] if row else None
+
+    def touch(self, root, listed_at):
+        with self.lock:
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO listing (root, listed_at) VALUES (?, ?)', (root, listed_at))
+
+    def add(self, entries):
+        with self.lock:
+            with self.db:
+                rows = [(e.get('fs_id'), e.get('size', 0), e.get('md5'), e.get('server_mtime'), STATE_PENDING, e['path'])
+                        for e in entries]
+                # 大小或 md5 变了的重新下载，没登记过的插入；3.24 之前的 SQLite 没有 upsert
+                changed = self.db.executemany(
+                    'UPDATE files SET fs_id = ?, size = ?, md5 = ?, server_mtime = ?, state = ? '
+                    'WHERE path = ? AND (size != ? OR md5 IS NOT ?)',
+                    [row + row[1:3] for row in rows]).rowcount
+                return changed + self.db.executemany(
+                    'INSERT OR IGNORE INTO files (fs_id, size, md5, server_mtime, state, path) VALUES (?, ?, ?, ?, ?, ?)',
+                    rows).rowcount
+
+    def pending(self):
+        with self.lock:
+            return self.db.execute('SELECT path, fs_id, size, md5, server_mtime FROM files WHERE state = ? '
+                                   'ORDER BY path', (STATE_PENDING,)).fetchall()
+
+    def done_parts(self, path):
+        with self.lock:
+            return {row[0] for row in self.db.execute('SELECT offset FROM parts WHERE path = ?', (path,))}
+
+    def add_part(self, path, offset):
+        with self.lock:
+            with self.db:
+                self.db.execute('INSERT OR IGNORE INTO parts (path, offset) VALUES (?, ?)', (path, offset))
+
+    def reset(self, path):
+        with self.lock:
+            with self.db:
+                self.db.execute('DELETE FROM parts WHERE path = ?', (path,))
+
+    def finish(self, path):
+        with self.lock:
+            with self.db:
+                self.db.execute('DELETE FROM parts WHERE path = ?', (path,))
+                self.db.execute('UPDATE files SET state = ? WHERE path = ?', (STATE_DONE, path))
+
+    def downloaded(self):
+        with self.lock:
+            return self.db.execute('SELECT path, fs_id, size FROM files WHERE state = ? ORDER BY path',
+                                   (STATE_DONE,)).fetchall()
+
+    def mark(self, paths, state):
+        with self.lock:
+            with self.db:
+                self.db.executemany('UPDATE files SET state = ? WHERE path = ?', [(state, path) for path in paths])
+
+
+class Downloader:
+    '''
+    把网盘上的新文件下载到本地（NAS）
+
+    和上传方向对称的一条链路：用 listall 增量发现远端目录下新增或者变化的文件，
+    按 100 个一批调用 filemetas 拿到 dlink，同时下载 `concurrent_files` 个文件，
+    每个文件按 `chunk_mb` 切成区间，用 `connections` 个 Range 请求并发下载，
+    直接写进预先分配好大小的 `.part` 文件。
+
+    每个区间写完就记进下载日志，中断后重新运行只下载还没完成的区间。全部完成后
+    计算整个文件的 md5 和网盘返回的比较，一致才改成正式文件名并标记完成；不一致时
+    清掉已完成的区间，下次重新下载。分片上传的文件网盘上的 md5 不是内容的 md5
+    （`remote_md5_is_content`），只要求大小一致。一批下载链接没拿到时跳过这一批，下次再下载。
+
+    Args:
+        config (Config) : 配置管理器
+        journal (DownloadJournal) : 下载日志，默认按配置创建
+
+    Methods:
+        discover(full) : 拉取远端目录，登记新文件，返回新登记的文件数
+        download_pending() : 下载所有待下载的文件，返回成功的个数
+        run(full) : discover 之后 download_pending
+    '''
+    def __init__(self, config, journal=None):
+        download_config = config.get_download_config()
+        self.local_directory = download_config.get('local_directory')
+        if not self.local_directory:
+            raise ValueError('配置项 Download.localdirectory 是必需的，但目前为空。')
+        self.root = (download_config.get('remote_directory')
+                     or f"/apps/{config.get_baidu_config().get('app_name')}").rstrip('/')
+        self.concurrent_files = max(1, download_config.get('concurrent_files'))
+        self.connections = max(1, download_config.get('connections'))
+        self.chunk_size = max(1, int(download_config.get('chunk_mb') * 1024 * 1024))
+        self.check_md5 = download_config.get('check_md5')
+        self.archive_directory = archive_directory_for(config)
+        self.journal = journal or DownloadJournal(download_config.get('journal'))
+        timeout_config = config.get_timeout_config()
+        self.timeout = timeout_config.get('upload')
+        self.auth = get_token_provider(config)
+        self.pan_host = PAN_HOST
+
+    def run(self, full=False):
+        self.discover(full)
+        return self.download_pending()
+
+    def discover(self, full=False):
+        started = time.time()
+        since = None if full else self.journal.listed_at(self.root)
+        archived = self.archive_directory + '/'
+        entries = [entry for entry in list_remote_files(self.auth, self.pan_host, self.root, since)
+                   if not entry['path'].startswith(archived)]
+        added = self.journal.add(entries)
+        self.journal.touch(self.root, started)
+        mainlog.info(f'{self.root} 下拉取到 {len(entries)} 个文件，{added} 个需要下载')
+        return added
+
+    def download_pending(self):
+        pending = self.journal.pending()
+        downloaded = 0
+        # dlink 有效期有限，按批获取、按批下载
+        for i in range(0, len(pending), FILEMETAS_MAX_FSIDS):
+            if shutdown_event.is_set():
+                break
+            batch = pending[i:i + FILEMETAS_MAX_FSIDS]
+            try:
+                dlinks = self._dlinks([row[1] for row in batch])
+            except Exception as e:
+                mainlog.warning(f'获取 {len(batch)} 个文件的下载链接失败，下次再下载: {e}')
+                continue
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrent_files,
+                                                       thread_name_prefix='download') as executor:
+                futures = {executor.submit(self._download_file, row, dlinks.get(row[1])): row[0] for row in batch}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        downloaded += bool(future.result())
+                    except Exception as e:
+                        mainlog.warning(f'下载 {futures[future]} 失败: {e}')
+        mainlog.info(f'下载完成 {downloaded} / {len(pending)} 个文件')
+        return downloaded
+
+    def local_path_for(self, remote_path):
+        relpath = posixpath.relpath(remote_path, self.root)
+        return os.path.join(self.local_directory, *relpath.split('/'))
+
+    def _download_file(self, row, dlink):
+        path, fs_id, size, md5, server_mtime = row
+        if dlink is None:
+            mainlog.warning(f'{path} 没有拿到下载链接，可能已经被删除')
+            return False
+
+        local_path = self.local_path_for(path)
+        part_path = local_path + PART_SUFFIX
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        if not os.path.exists(part_path) or os.path.getsize(part_path) != size:
+            self.journal.reset(path)
+            with open(part_path, 'wb') as f:
+                f.truncate(size)
+
+        done = self.journal.done_parts(path)
+        offsets = [offset for offset in range(0, size, self.chunk_size) if offset not in done]
+        if done:
+            mainlog.info(f'继续下载 {path}，剩余 {len(offsets)} 个区间')
+        url = f'{dlink}&access_token={quote(self.auth.get_token())}'
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.connections) as executor:
+            for offset in offsets:
+                executor.submit(self._fetch_range, url, part_path, path, offset, min(self.chunk_size, size - offset))
+
+        if len(self.journal.done_parts(path)) < len(range(0, size, self.chunk_size)):
+            mainlog.warning(f'{path} 还有区间没有下载完成，下次继续')
+            return False
+
+        if self.check_md5 and md5 and remote_md5_is_content(size) and cal_file_hashes(part_path)[0] != md5:
+            mainlog.warning(f'{path} 下载后 md5 不一致，下次重新下载')
+            self.journal.reset(path)
+            os.remove(part_path)
+            return False
+
+        os.replace(part_path, local_path)
+        if server_mtime:
+            os.utime(local_path, (server_mtime, server_mtime))
+        self.journal.finish(path)
+        mainlog.info(f'成功下载 {path} -> {local_path}')
+        return True
+
+    def _fetch_range(self, url, part_path, path, offset, length):
+        '''下载一个区间并写进 .part 文件，失败时只记日志，由调用方按日志判断是否完成'''
+        if shutdown_event.is_set():
+            return
+        request = urllib.request.Request(url, headers={
+            'User-Agent': DLINK_USER_AGENT,
+            'Range': f'bytes={offset}-{offset + length - 1}',
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as resp:
+                if resp.status != 206 and not (resp.status == 200 and offset == 0):
+                    raise Exception(f'HTTP {resp.status}')
+                with open(part_path, 'r+b') as f:
+                    f.seek(offset)
+                    remaining = length
+                    while remaining > 0:
+                        data = resp.read(min(READ_BUFFER, remaining))
+                        if not data:
+                            raise Exception(f'连接提前关闭，还差 {remaining} 字节')
+                        f.write(data)
+                        remaining -= len(data)
+        except Exception as e:
+            mainlog.debug(f'下载 {path} 区间 {offset}+{length} 失败: {e}')
+            return
+        self.journal.add_part(path, offset)
+
+    def _dlinks(self, fs_ids):
+        '''批量获取下载链接，返回 fs_id -> dlink'''
+        openapi_client = _sdk()[0]
+        from openapi_client.api import multimediafile_api
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
+            api_instance = multimediafile_api.MultimediafileApi(api_client)
+            api_response = api_instance.xpanmultimediafilemetas(
+                self.auth.get_token(), json.dumps(fs_ids), dlink='1', **SDK_FAST_PATH)
+        if api_response.get('errno'):
+            raise Exception(f"获取下载链接失败 错误码:{api_response.get('errno')}")
+        return {meta.get('fs_id'): meta.get('dlink') for meta in api_response.get('list') or []}
+
@@ -0,0 +1,210 @@
+import threading
+from queue import Queue, Empty
+
+from backends import get_backend
+from status_manager import StatusManager, STATUS_UPLOADED
+from retry_scheduler import RetryPolicy, RetryScheduler
+from work_queue import PendingQueue
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+
+class Destination:
+    '''
+    百度网盘之外的一个上传目的地
+
+    每个目的地有自己的状态库（默认 `upload_status.<名称>.db`）、任务队列和重试调度，
+    一个目的地写入失败只在它自己的状态库里记一次失败、退避后单独重试，不影响百度网盘
+    和其他目的地。
+
+    Args:
+        name (str) : 目的地名称，对应 [Destination:<name>] 区块
+        config (Config) : 配置管理器
+
+    Methods:
+        uploader(file_path) : 为文件创建这个目的地的上传器
+        enqueue(file_path) : 登记文件，由后台线程单独读文件写入
+        succeeded(file_path) / failed(file_path, error) : 记录一次写入结果
+    '''
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.options = config.get_destination_config(name)
+        self.factory = get_backend(self.options.get('backend'))
+        upload_config = config.get_upload_config()
+        self.queue = PendingQueue(upload_config.get('queue_window'), lease_seconds=upload_config.get('lease_seconds'))
+        self.status = StatusManager(self.queue, self.options.get('status_file'), None)
+        self.retry = RetryScheduler(self.queue, self.status, RetryPolicy(config.get_retry_config()))
+
+    def __repr__(self):
+        return f"<Destination {self.name} ({self.options.get('backend')})>"
+
+    def uploader(self, file_path):
+        return self.factory(file_path, self.config, self.options)
+
+    def enqueue(self, file_path):
+        self.status.add_if_absent(file_path)
+        self.queue.put(file_path)
+
+    def succeeded(self, file_path):
+        self.status.import_uploaded([file_path])
+
+    def failed(self, file_path, error):
+        mainlog.info(f'{file_path} 写入 {self.name} 失败: {error}')
+        self.status.add_if_absent(file_path)
+        self.retry.failed(file_path, error)
+
+
+class _StreamSink:
+    '''
+    一个目的地的写入线程
+
+    读文件的线程只往有界队列里放数据，慢的目的地最多落后 `depth` 段；写入出错的目的地
+    继续取走数据但不再写，不会拖住读文件的线程和其他目的地。
+    '''
+    def __init__(self, destination, uploader, depth):
+        self.destination = destination
+        self.uploader = uploader
+        self.error = None
+        self._blocks = Queue(maxsize=max(1, depth))
+        self._thread = threading.Thread(target=self._run, name=f'fanout-{destination.name}', daemon=True)
+
+    def start(self):
+        self.uploader.open_stream()
+        self._thread.start()
+
+    def feed(self, block):
+        if self.error is None:
+            self._blocks.put(block)
+
+    def finish(self, read_error=None):
+        '''等写完剩下的数据，返回 (是否成功, 出错原因)'''
+        self._blocks.put(None)
+        self._thread.join()
+        error = read_error or self.error
+        if error is None:
+            try:
+                if self.uploader.commit():
+                    return True, None
+                error = '写入的大小不对'
+            except Exception as e:
+                error = e
+        self.uploader.abort()
+        return False, error
+
+    def _run(self):
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.uploader.write(block)
+            except Exception as e:
+                self.error = e
+
+
+class FanOut:
+    '''
+    把每个文件同时写到百度网盘之外的几个目的地（USB 归档盘、S3 兼容存储等）
+
+    目的地的类型在 `backends` 里登记。上传器创建时调用 `tee()`：对支持流式写入的目的地，
+    计算秒传需要的 md5 时读到的数据同时交给每个目的地的写入线程，文件只读一遍、只算一遍
+    md5，百度网盘的上传器直接用算好的 md5。不支持流式写入的目的地、打包上传的小文件，
+    以及写入失败后到了重试时间的文件，由每个目的地自己的后台线程单独读文件写入。
+
+    已经写入某个目的地的文件不会再写一次，百度网盘上传失败重试时也一样。
+
+    Args:
+        config (Config) : 配置管理器
+
+    Methods:
+        start() : 启动各个目的地的重试调度和后台写入线程
+        tee(file) : 读一遍文件算出 md5，同时写给所有还没有这个文件的目的地
+        enqueue(file_paths) : 登记文件，由后台线程单独写入各个目的地
+        pending() : 各个目的地还没写入（排队、等待重试）的文件数
+    '''
+    def __init__(self, config):
+        fanout_config = config.get_fanout_config()
+        self.queue_depth = fanout_config.get('queue_depth')
+        self.destinations = [Destination(name, config) for name in fanout_config.get('destinations')]
+
+    def start(self):
+        for destination in self.destinations:
+            destination.retry.start()
+            threading.Thread(target=self._drain, args=(destination,), name=f'destination-{destination.name}',
+                             daemon=True).start()
+        if self.destinations:
+            mainlog.info(f"同时写入 {', '.join(d.name for d in self.destinations)}")
+
+    def tee(self, file):
+        if not self.destinations:
+            return
+        file_path = file.file_path
+        sinks = []
+        for destination in self.destinations:
+            if destination.status.get_status(file_path) == STATUS_UPLOADED:
+                continue
+            try:
+                uploader = destination.uploader(file_path)
+                if not hasattr(uploader, 'open_stream'):
+                    destination.enqueue(file_path)
+                    continue
+                sink = _StreamSink(destination, uploader, self.queue_depth)
+                sink.start()
+            except Exception as e:
+                destination.failed(file_path, e)
+                continue
+            sinks.append(sink)
+        if not sinks:
+            return
+
+        read_error = None
+        try:
+            file.compute_hashes([sink.feed for sink in sinks])
+        except Exception as e:
+            read_error = e # 文件本身读不了，上传器随后也会失败
+        for sink in sinks:
+            ok, error = sink.finish(read_error)
+            if ok:
+                sink.destination.succeeded(file_path)
+            else:
+                sink.destination.failed(file_path, error)
+
+    def enqueue(self, file_paths):
+        for destination in self.destinations:
+            for file_path in file_paths:
+                if destination.status.get_status(file_path) != STATUS_UPLOADED:
+                    destination.enqueue(file_path)
+
+    def pending(self):
+        return sum(d.queue.qsize() + d.queue.inflight() + d.retry.pending() for d in self.destinations)
+
+    def _drain(self, destination):
+        while not shutdown_event.is_set():
+            try:
+                file_path = destination.queue.get(timeout=5)
+            except Empty:
+                continue
+            try:
+                self._write(destination, file_path)
+            finally:
+                destination.queue.done(file_path)
+
+    def _write(self, destination, file_path):
+        '''单独读文件写入一个目的地'''
+        if destination.status.get_status(file_path) == STATUS_UPLOADED:
+            return
+        destination.status.set_uploading(file_path)
+        error = None
+        try:
+            uploaded = destination.uploader(file_path).start_upload()
+        except Exception as e:
+            uploaded, error = False, e
+        if uploaded:
+            destination.succeeded(file_path)
+        else:
+            destination.failed(file_path, error or '写入失败')
@@ -20,6 +20,11 @@ class FileChecker:
 
         self.local_config = config.get_local_config()
 
+        # 多机协调的租约库默认放在检测目录里，不能当成待上传文件
+        coordination_config = config.get_coordination_config()
+        store = os.path.abspath(coordination_config.get('store'))
+        self.ignored = {store, store + '-journal'} if coordination_config.get('enabled') else set()
+
     def star_check(self):
         '''创建线程，启动检测'''
         self.check_new_file_thread = Thread(target=self._check_new_file_with_loop)
@@ -51,21 +56,21 @@ class FileChecker:
                     mainlog.debug(f"正在处理 {file} 文件")
 
                     # 只处理文件
+                    if os.path.abspath(file) in self.ignored:
+                        continue
                     if os.path.isfile(file):
                         # 检查文件的上次修改时间
                         last_modified = os.path.getmtime(file)
                         mainlog.debug(f"{file} 文件的最后修改时间为 {last_modified}")
 
-                        if not self.s_manager.is_exsit(file):
-                            # 如果不存在状态表里，说明是新增的
-                            if self.s_manager.get_status(file) == 'NOT_EXIST':
-                                mainlog.debug(f"正在添加 {file} 文件")
-                                self.queue.put(file)
-                                self.s_manager.add(file)
-                                add_count += 1
-                                mainlog.info(f" {file} 添加完毕")
-                            else:
-                                mainlog.debug(f" {file} 文件已存在")
+                        # 先登记再入队，上传线程取到时状态一定已经存在；已经登记过的文件不会重复入队
+                        if self.s_manager.add_if_absent(file):
+                            mainlog.debug(f"正在添加 {file} 文件")
+                            self.queue.put(file)
+                            add_count += 1
+                            mainlog.info(f" {file} 添加完毕")
+                        else:
+                            mainlog.debug(f" {file} 文件已存在")
             
             except Exception as e:
                 # 日志记录异常
@@ -10,20 +10,178 @@ src_path = os.path.join(project_path, 'src')
 sys.path.append(external_path)
 
 from abc import ABC, abstractmethod
-from storage_auth import BaiduAuth
+from storage_auth import get_token_provider
+from upload_hosts import get_upload_host_selector, get_source_address_selector
+from circuit_breaker import get_circuit_breaker
+from content_index import get_content_index
+from hedging import get_hedger
+from compressor import get_compression_policy
 
 from utils import File, FilePreprocessor, MAIN_LOG
 
-# 百度网盘SDK
-from openapi_client.api import fileupload_api
-import openapi_client
-
 import json
+import time
 import concurrent.futures
 import threading
+import urllib.request
+import urllib.error
+from urllib.parse import urlencode
 import logging
 mainlog = logging.getLogger(MAIN_LOG)
 
+
+def _sdk():
+    '''
+    百度网盘SDK 在第一次调用接口时才导入
+
+    SDK 会连带加载所有 model 和 model_utils，放在模块顶部会拖慢启动。
+    '''
+    import openapi_client
+    from openapi_client.api import fileupload_api
+    return openapi_client, fileupload_api
+
+# 上传相关接口只读返回里的几个字段，跳过 SDK 的 model 校验，直接返回 json 解析结果
+SDK_FAST_PATH = {'_raw_response': True}
+
+PAN_HOST = 'https://pan.baidu.com'
+RAPID_UPLOAD_URL = 'https://d.pcs.baidu.com/rest/2.0/pcs/file' # SDK 里没有秒传接口
+RAPID_UPLOAD_MIN_SIZE = 256 * 1024 # 秒传只支持大于 256KB 的文件
+RTYPE_RENAME = 2 # 网盘路径已存在且内容不同时自动改名
+RTYPE_OVERWRITE = 3 # 网盘路径已存在时覆盖
+UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024 # FilePreprocessor 默认的切片大小
+
+
+class UploadSavings:
+    '''
+    秒传、网盘内复制省下的上传量，进程内所有上传器共用
+
+    Attributes:
+        files : 没有实际上传的文件数
+        bytes : 没有实际上传的字节数
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, nbytes):
+        with self.lock:
+            self.files += 1
+            self.bytes += nbytes
+
+    def snapshot(self):
+        with self.lock:
+            return {'files': self.files, 'bytes': self.bytes}
+
+rapid_upload_savings = UploadSavings()
+server_copy_savings = UploadSavings()
+
+
+class OverwriteMarks:
+    '''
+    核对失败、下次上传要覆盖的网盘路径
+
+    平时上传用 `RTYPE_RENAME`，不覆盖网盘上已有的不同文件；但核对失败后重新上传时，原路径上
+    就是那个坏掉的文件，改名会让新文件落到 `name(1).ext`，核对又因为路径对不上失败，每一轮
+    都在网盘里多留一份。`UploadVerifier` 核对失败时在这里记下路径，重新上传用 `RTYPE_OVERWRITE`
+    覆盖，核对通过后清掉。
+
+    Methods:
+        mark(account, remote_path) : 记下要覆盖的路径
+        clear(account, remote_path) : 核对通过后清掉
+        marked(account, remote_path) : 是否要覆盖
+        paths(account) : 某个账号要覆盖的所有路径
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._paths = set() # (账号, 网盘路径)
+
+    def mark(self, account, remote_path):
+        with self.lock:
+            self._paths.add((account, remote_path))
+
+    def clear(self, account, remote_path):
+        with self.lock:
+            self._paths.discard((account, remote_path))
+
+    def marked(self, account, remote_path):
+        with self.lock:
+            return (account, remote_path) in self._paths
+
+    def paths(self, account):
+        with self.lock:
+            return [path for a, path in self._paths if a == account]
+
+
+_overwrite_marks = {}
+_overwrite_marks_lock = threading.Lock()
+
+def get_overwrite_marks(config):
+    '''获取配置文件对应的 `OverwriteMarks`，同一个进程内共享'''
+    with _overwrite_marks_lock:
+        marks = _overwrite_marks.get(config.filename)
+        if marks is None:
+            marks = _overwrite_marks[config.filename] = OverwriteMarks()
+        return marks
+
+
+def _api_quota(auth, pan_host=PAN_HOST):
+    '''查询网盘容量，熔断器断开后用这个最便宜的接口探测服务是否恢复'''
+    import openapi_client
+    from openapi_client.api import userinfo_api
+    with openapi_client.ApiClient(openapi_client.Configuration(host=pan_host)) as api_client:
+        return userinfo_api.UserinfoApi(api_client).apiquota(auth.get_token(), **SDK_FAST_PATH)
+
+
+def remote_path_for(config, file_path, upload_relpath=None, account=None):
+    '''
+    本地文件在网盘上的路径（不含压缩后缀）
+
+    Args:
+        config (Config) : 配置管理器
+        file_path (str) : 本地文件路径
+        upload_relpath (str) : 网盘上相对应用目录的路径，默认按本地检测目录的相对路径
+        account (str) : 百度网盘账号，不同账号可以用不同的应用
+
+    Returns:
+        str : /apps/<appname>/<相对路径>
+    '''
+    app_name = config.get_baidu_config(account).get('app_name')
+    local_file_path = config.get_local_config().get('local_directory')
+    file_upload_path = upload_relpath or os.path.relpath(file_path, local_file_path)
+    return f'/apps/{app_name}/{file_upload_path}'
+
+
+def remote_md5_is_content(size):
+    '''
+    网盘返回的 md5 能不能当作文件内容的 md5 比较
+
+    分片上传的文件，网盘记下的 md5 由各分片的 md5 算出来，和整个文件的 md5 不同；只有一个
+    分片（不超过 4MB）时它就是这个分片的 md5，也就是内容的 md5。listall、filemetas 返回的
+    md5 都按这个规则判断，对账、上传后核对和下载校验共用。
+
+    Args:
+        size (int) : 网盘上的文件大小
+
+    Returns:
+        bool
+    '''
+    return size is not None and 0 < size <= UPLOAD_CHUNK_SIZE
+
+
+def get_api_breaker(config, auth=None):
+    '''
+    上传器共用的百度网盘接口熔断器，断开后用 apiquota 探测
+
+    Args:
+        config (Config) : 配置管理器
+        auth : 探测用的 token 提供者，默认是 [BaiduCloud] 账号的，第一次探测时才取
+
+    Returns:
+        CircuitBreaker
+    '''
+    return get_circuit_breaker(config, probe=lambda: _api_quota(auth or get_token_provider(config)))
+
 class BaseUploader(ABC):
     '''
     上传模块的抽象基类
@@ -65,55 +223,118 @@ class BaseUploader(ABC):
 class BaiduCloudUploader(BaseUploader):
     '''
     百度云盘上传实现
+
+    Args:
+        file_name (str) : 本地文件路径
+        config (Config) : 配置管理器
+        upload_relpath (str) : 网盘上相对应用目录的路径，默认按本地检测目录的相对路径
+        account (str) : 上传到哪个百度网盘账号，默认是 [BaiduCloud]
+        auth : token 提供者，默认是账号对应的 `TokenProvider`；多进程上传的子进程传入主进程给的 token
     '''
 
-    def __init__(self, file_name, config):
+    def __init__(self, file_name, config, upload_relpath=None, account=None, auth=None):
         super().__init__(file_name, config)
         self.name = '百度云盘'
-        self.auth = BaiduAuth(config)
+        self.account = account
+        self.auth = auth or get_token_provider(config, account) # 同一个账号进程内共享，不再每个文件新建 BaiduAuth
+        self.hosts = get_upload_host_selector(config) # 分片分散到测速最快的几台上传服务器
+        self.interfaces = get_source_address_selector(config) # 多条上行线路时分片分散到各个本地地址
+        self.breaker = get_api_breaker(config, auth) # 接口大面积失败时暂停所有上传
+        self.hedger = get_hedger(config) # 分片慢于最近 p95 时再发一个相同的请求
+        timeout_config = config.get_timeout_config()
+        # 各阶段 (连接超时, 读超时)，卡住的连接不会让整个文件一直挂着
+        self.timeouts = {stage: (timeout_config.get('connect'), timeout_config.get(stage))
+                         for stage in ('precreate', 'upload', 'create')}
+        upload_config = config.get_upload_config()
+        self.rapid_upload = upload_config.get('rapid_upload')
+        self.rapid_upload_url = upload_config.get('rapid_upload_url') or RAPID_UPLOAD_URL
+        self.content_index = get_content_index(config, account) # 已上传内容 md5 -> 网盘路径，关闭去重时为 None
+        self.pan_host = PAN_HOST
+        self.codec = None
+        self.uploaded_remotely = False # 秒传或者网盘内复制成功，不需要切片和传输
+        self.fs_id = None # create 或秒传返回的网盘文件 id，交给后台核对
+        self.rtype = RTYPE_RENAME # 网盘路径已存在时的处理方式，核对失败后重新上传时覆盖
+        self.prepared = False
+        self.upload_relpath = upload_relpath
 
     def start_upload(self):
         # 百度云盘的上传逻辑
+        if not self.prepared:
+            self.prepare()
+        return self.transfer()
+
+    def prepare(self):
+        '''
+        上传前的准备阶段：切片、计算 block_list、预上传拿到 uploadid
+
+        流水线模式下这一步在后台线程提前完成，当前文件传分片时下一个文件已经准备好。
+        失败时会清理已经生成的切片再抛出异常。
+        '''
         self.uploading = True
         self.progress = 0 # 进度
 
         # 百度上传路径 上传路径有限制
-        app_name = self.config.get_baidu_config().get('app_name')
-        device_name = self.config.get_local_config().get('device_name')
-        logging.debug(f'应用名称：{app_name}    望远镜设备名称：{device_name}')
+        self.upload_path = remote_path_for(self.config, self.file.file_path, self.upload_relpath, self.account)
+
+        # 按扩展名决定是否边读边压缩，远端文件名带上压缩后缀
+        policy = get_compression_policy(self.config)
+        codec, level = policy.codec_for(self.file.file_path)
+        self.upload_path += policy.suffix(codec)
+        self.codec = codec
+        if get_overwrite_marks(self.config).marked(self.account, self.upload_path):
+            self.rtype = RTYPE_OVERWRITE
+
+        # 之前上传过相同内容时在网盘里直接复制；网盘里已经有相同内容的文件时直接秒传，都不切片也不传输。
+        # 压缩后的内容要切片时才知道 md5，不尝试秒传
+        if self._try_server_copy() or (codec is None and self._try_rapid_upload()):
+            self.prepared = True
+            return
+
+        # 预处理
+        mainlog.debug(f'预处理 {self.file.file_path} ')
+        file_preprocessor = FilePreprocessor(self.file, codec=codec, level=level)
+        try:
+            file_preprocessor.preprocess()
 
-        baidu_path_prefix = f'/apps/{app_name}'
-        local_file_path = self.config.get_local_config().get('local_directory')
-        file_upload_path = os.path.relpath(self.file.file_path, local_file_path)
-        self.upload_path = f'{baidu_path_prefix}/{file_upload_path}'
+            # 获取token
+            self.access_token = self.auth.get_token()
+            mainlog.debug(f'uploader 向 auth 获取 token:{self.access_token}')
 
+            # 预上传
+            mainlog.debug(f'预上传 {self.file.file_path} ')
+            self.uploadid = self._api_precreate(self.access_token, self.file, self.file.block_list, rtype=self.rtype)
+        except Exception:
+            self.file.remove_chunks()
+            raise
+
+        self.prepared = True
+
+    def transfer(self):
+        '''
+        传输阶段：并发上传分片并创建文件，需要先完成 `prepare()`
+
+        Returns:
+            bool : 上传成功与否
+        '''
+        if self.uploaded_remotely:
+            return True
 
         mainlog.info(f'正在上传{self.file.file_path}')
-        
-        # 预处理
-        mainlog.debug(f'预处理 {self.file.file_path} ')
-        file_preprocessor = FilePreprocessor(self.file)
-        file_preprocessor.preprocess()
+        access_token = self.auth.get_token() # 流水线里准备好的任务可能已经放了一段时间
+        uploadid = self.uploadid
+        self.hosts.discover(access_token, self.upload_path, uploadid)
 
         # 计算进度
         completed_chunks = 0
         total_chunks = len(self.file.chunks)
         lock = threading.Lock()
 
-        # 获取token
-        access_token = self.auth.get_token()
-        mainlog.debug(f'uploader 向 auth 获取 token:{access_token}')
-
-        # 预上传
-        mainlog.debug(f'预上传 {self.file.file_path} ')
-        uploadid = self._api_precreate(access_token, self.file, self.file.block_list)
-        
         # 并发上传分片 (用线程池实现，最大线程为5，暂时不可通过配置文件调节)
         mainlog.debug(f'分片上传 {self.file.file_path} ')
         retries = 20  # 所有分片共享重试次数
         try:
             with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                future_to_chunk = {executor.submit(self._api_chunk_upload, access_token, chunk, uploadid): chunk for chunk in self.file.chunks}
+                future_to_chunk = {executor.submit(self._upload_part, access_token, chunk, uploadid): chunk for chunk in self.file.chunks}
                 for future in concurrent.futures.as_completed(future_to_chunk):
                     chunk = future_to_chunk[future]
                     try:
@@ -125,9 +346,9 @@ class BaiduCloudUploader(BaseUploader):
                                 print(f"Progress: {progress:.2f}%")
 
                         elif retries > 0:
-                            # 重试逻辑
+                            # 重试逻辑，token 可能已经被刷新过，重新取一次
                             mainlog.debug(f"Retrying {chunk.mother_file.file_path} part {chunk.chunk_index}...")
-                            executor.submit(self._api_chunk_upload, access_token, chunk, uploadid)
+                            executor.submit(self._upload_part, self.auth.get_token(), chunk, uploadid)
                             retries -= 1
 
                         else:
@@ -144,12 +365,19 @@ class BaiduCloudUploader(BaseUploader):
             self.file.remove_chunks()
                 
         # 创建文件
-        if self._api_creatfile(access_token, self.file, self.file.block_list, uploadid): 
+        if self._api_creatfile(self.auth.get_token(), self.file, self.file.block_list, uploadid, rtype=self.rtype):
             # 上传成功
             mainlog.info(f"成功上传 { self.file.file_path }")
+            self._remember_content()
             return True
         return False
 
+    def discard(self):
+        '''放弃已经准备好但还没有传输的任务，清理本地切片'''
+        if self.prepared and not self.uploaded_remotely:
+            self.file.remove_chunks()
+            self.prepared = False
+
     def stop_upload(self):
         '''停止上传'''
         self.uploading = False
@@ -166,6 +394,125 @@ class BaiduCloudUploader(BaseUploader):
         pass
 
 
+    def _try_rapid_upload(self):
+        '''
+        用切片前已经算好的 md5、文件头 md5 和大小尝试秒传
+
+        Returns:
+            bool : 秒传成功与否，失败时走正常的预上传和分片上传
+        '''
+        if not self.rapid_upload or self.file.file_size < RAPID_UPLOAD_MIN_SIZE:
+            return False
+
+        try:
+            api_response = self.breaker.call(self._api_rapidupload, self.auth.get_token())
+        except Exception as e:
+            mainlog.debug(f'秒传 {self.file.file_path} 请求失败: {e}')
+            return False
+
+        if api_response.get('errno') != 0:
+            mainlog.debug(f"{self.file.file_path} 无法秒传 错误码:{api_response.get('errno')}")
+            return False
+
+        self.uploaded_remotely = True
+        self.fs_id = (api_response.get('info') or {}).get('fs_id')
+        self._remember_content()
+        rapid_upload_savings.add(self.file.file_size)
+        mainlog.info(f'秒传成功 {self.file.file_path}，省去上传 {self.file.file_size / 1024 / 1024:.1f}MB')
+        return True
+
+
+    def _try_server_copy(self):
+        '''
+        内容索引里有相同内容（md5、大小、压缩格式都一样）时，用网盘的复制接口生成文件
+
+        硬链接和之前上传过的文件 inode 相同，直接从索引拿 md5，不用重新读一遍文件。
+
+        Returns:
+            bool : 复制成功与否
+        '''
+        if self.content_index is None:
+            return False
+
+        known_md5 = self.content_index.md5_for(self.file.stat)
+        if known_md5:
+            self.file.file_md5 = known_md5
+        source = self.content_index.find(self.file.file_md5, self.file.file_size, self.codec)
+        if source is None or source == self.upload_path:
+            return False
+
+        try:
+            api_response = self.breaker.call(self._api_filemanagercopy, self.auth.get_token(), source)
+        except Exception as e:
+            mainlog.debug(f'网盘内复制 {source} 请求失败: {e}')
+            return False
+
+        results = api_response.get('info') or [{}]
+        if api_response.get('errno') != 0 or results[0].get('errno', 0) != 0:
+            # 源文件可能已经在网盘上被删掉了，之后不再用它
+            mainlog.debug(f"网盘内复制 {source} 失败 错误码:{api_response.get('errno')}")
+            self.content_index.forget(source)
+            return False
+
+        self.uploaded_remotely = True
+        self._remember_content()
+        server_copy_savings.add(self.file.file_size)
+        mainlog.info(f'{self.file.file_path} 与已上传的 {source} 内容相同，已在网盘内复制'
+                     f'{"（硬链接）" if known_md5 else ""}')
+        return True
+
+
+    def _remember_content(self):
+        '''
+        上传成功后记下内容和网盘路径，之后相同内容的文件直接在网盘内复制
+
+        文件已经在网盘上了，写索引失败（比如别的进程一直锁着库）只记日志，不算上传失败
+        '''
+        if self.content_index is None:
+            return
+        try:
+            self.content_index.add(self.file.file_md5, self.file.file_size, self.codec, self.upload_path, self.file.stat)
+        except Exception as e:
+            mainlog.warning(f'{self.file.file_path} 写入内容索引失败，不影响这次上传: {e}')
+
+
+    def _api_filemanagercopy(self, access_token, source):
+        '''网盘内复制 api 封装，同步执行，目标已存在时覆盖'''
+        openapi_client = _sdk()[0]
+        from openapi_client.api import filemanager_api
+        filelist = json.dumps([{
+            'path': source,
+            'dest': os.path.dirname(self.upload_path),
+            'newname': os.path.basename(self.upload_path),
+            'ondup': 'overwrite',
+        }], ensure_ascii=False)
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
+            api_instance = filemanager_api.FilemanagerApi(api_client)
+            return api_instance.filemanagercopy(
+                access_token, 0, filelist, ondup='overwrite',
+                _request_timeout=self.timeouts['create'], **SDK_FAST_PATH)
+
+
+    def _api_rapidupload(self, access_token):
+        '''秒传 api 封装，网盘里没有相同内容时返回错误码（HTTP 404 也照常解析返回体）'''
+        query = urlencode({'method': 'rapidupload', 'access_token': access_token})
+        form = urlencode({
+            'path': self.upload_path,
+            'content-length': self.file.file_size,
+            'content-md5': self.file.file_md5,
+            'slice-md5': self.file.slice_md5,
+            'rtype': self.rtype,
+        }).encode('utf-8')
+        request = urllib.request.Request(f'{self.rapid_upload_url}?{query}', data=form, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeouts['precreate'][1]) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            if e.code >= 500:
+                raise
+            return json.loads(e.read() or b'{}')
+
+
     def _api_precreate(
             self, 
             access_token,
@@ -173,22 +520,25 @@ class BaiduCloudUploader(BaseUploader):
             block_list,
             isdir = 0,
             autoinit = 1,
-            rtype = 2,
+            rtype = RTYPE_RENAME,
             redo=[]
             ):
         '''预上传 api 封装'''
         mainlog.debug(f'调用预上传api')
 
-        with openapi_client.ApiClient() as api_client:
+        openapi_client, fileupload_api = _sdk()
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
             api_instance = fileupload_api.FileuploadApi(api_client)
             path = self.upload_path
-            size = file.file_size
+            size = file.upload_size
             block_list = block_list
             mainlog.debug(f'预上传参数:\npath:{path}\nisdir:{isdir}\nsize:{size}\nautoinit:{autoinit}\nblock_list:{block_list}')
             try:
                 mainlog.debug(f'发起uploadid请求')
-                api_response = api_instance.xpanfileprecreate(
-                    access_token, path, isdir, size, autoinit, block_list, rtype=rtype)
+                api_response = self.breaker.call(
+                    api_instance.xpanfileprecreate,
+                    access_token, path, isdir, size, autoinit, block_list, rtype=rtype,
+                    _request_timeout=self.timeouts['precreate'], **SDK_FAST_PATH)
 
                 # data = json.load(api_response)
                 uploadid = api_response.get('uploadid')
@@ -198,9 +548,9 @@ class BaiduCloudUploader(BaseUploader):
                 healling = self._check_response(api_response)
                 if healling and len(redo)<1:
                     mainlog.info(f'重新进行预上传{file.file_path}')
-                    self.auth.renew_token()
-                    new_token = self.auth.get_token()
-                    return self._api_precreate(new_token,file,block_list)
+                    new_token = self.auth.renew_token(access_token)
+                    self.access_token = new_token
+                    return self._api_precreate(new_token, file, block_list, rtype=rtype, redo=[1])
                 
                 elif uploadid:
                     mainlog.debug(f'获取uploadid：{uploadid}')
@@ -215,6 +565,11 @@ class BaiduCloudUploader(BaseUploader):
                 raise Exception("Exception when calling FileuploadApi->xpanfileprecreate: %s\n" % e)
 
 
+    def _upload_part(self, access_token, chunk, uploadid):
+        '''上传一个分片，慢的时候由对冲器再发一个请求'''
+        return self.hedger.run(lambda: self._api_chunk_upload(access_token, chunk, uploadid))
+
+
     def _api_chunk_upload(
             self,
             access_token,
@@ -223,29 +578,59 @@ class BaiduCloudUploader(BaseUploader):
             ):
         '''分片上传 api 封装'''
         mainlog.debug(f'调用分片上传api')
+        self.breaker.wait() # 接口故障期间分片重试也停下来，不继续请求
         
-        with openapi_client.ApiClient() as api_client:
+        openapi_client, fileupload_api = _sdk()
+        try:
+            file = open(chunk.chunk_path, 'rb') # file_type | 要进行传送的本地文件分片
+        except Exception as e:
+            print("Exception when open file: %s\n" % e)
+            return False
+        # 对冲时慢的那个请求结束前切片可能已经被清理，大小要提前取
+        nbytes = os.fstat(file.fileno()).st_size
+
+        # 切片打开之后再选服务器和本地地址，选了就一定会 report，排队计数不会漏减
+        host = self.hosts.pick()
+        configuration = openapi_client.Configuration(host=host)
+        source = None
+        if self.interfaces is not None:
+            source = self.interfaces.pick()
+            configuration.source_address = source
+        with openapi_client.ApiClient(configuration) as api_client:
             api_instance = fileupload_api.FileuploadApi(api_client)
 
             path = self.upload_path
             partseq = str(chunk.chunk_index)
             type = "tmpfile"
 
+            ok = False
+            start = time.monotonic()
             try:
-                file = open(chunk.chunk_path, 'rb') # file_type | 要进行传送的本地文件分片
-            except Exception as e:
-                print("Exception when open file: %s\n" % e)
-
-            try:
-                api_response = api_instance.pcssuperfile2(
-                    access_token, partseq, path, uploadid, type, file=file)
+                api_response = self.breaker.call(
+                    api_instance.pcssuperfile2,
+                    access_token, partseq, path, uploadid, type, file=file,
+                    _request_timeout=self.timeouts['upload'], **SDK_FAST_PATH)
                 
                 # data = json.load(api_response)
                 if api_response.get('md5') == chunk.chunk_md5:
+                    ok = True
                     return True
+
+                if api_response.get('errno') in [111, -6]:
+                    # token 失效，多个分片线程同时发现时只会刷新一次
+                    self.auth.renew_token(access_token)
                 
             except openapi_client.ApiException as e:
                 print("Exception when calling FileuploadApi->pcssuperfile2: %s\n" % e)
+            except Exception as e:
+                # 连接、读超时等网络错误，这个分片交给外层重试
+                mainlog.debug(f'分片 {chunk.chunk_index} 上传出错: {e}')
+            finally:
+                file.close()
+                elapsed = time.monotonic() - start
+                self.hosts.report(host, nbytes, elapsed, ok)
+                if source is not None:
+                    self.interfaces.report(source, nbytes, elapsed, ok)
 
 
     def _api_creatfile(
@@ -255,33 +640,30 @@ class BaiduCloudUploader(BaseUploader):
             block_list,
             uploadid,
             isdir=0,
-            rtype=2
+            rtype=RTYPE_RENAME
             ):
         '''创建文件 api 封装'''
         mainlog.debug(f'调用创建文件api')
 
-        with openapi_client.ApiClient() as api_client:
+        openapi_client, fileupload_api = _sdk()
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
             # Create an instance of the API class
             api_instance = fileupload_api.FileuploadApi(api_client)
             path = self.upload_path
-            size = file.file_size
+            size = file.upload_size
             block_list = block_list
 
             try:
-                api_response = api_instance.xpanfilecreate(
-                    access_token, path, isdir, size, uploadid, block_list, rtype=rtype)
-                # data = json.load(api_response)
-                errno = api_response.get('error')
-                md5 = api_response.get('md5')
-                size = api_response.get('size')
-                re_path = api_response.get('path')
-
+                api_response = self.breaker.call(
+                    api_instance.xpanfilecreate,
+                    access_token, path, isdir, size, uploadid, block_list, rtype=rtype,
+                    _request_timeout=self.timeouts['create'], **SDK_FAST_PATH)
+                errno = api_response.get('errno')
                 if errno:
-                    raise f'创建{ file.file_path }文件失败 错误码:{errno}'
+                    raise Exception(f'创建{ file.file_path }文件失败 错误码:{errno}')
 
-                # mainlog.debug(f'文件上传对比：path:{re_path==path}  size:{file.file_size==size}  md5:{file.file_md5==md5}')
-                # mainlog.debug(f'\n本地文件{file.file_path}md5：{file.file_md5}\nAPI返回{re_path}md5：{md5}')
-                # if re_path==path and file.file_size==size and file.file_md5==md5:
+                # 路径、大小和 md5 不在这里核对，记下 fs_id 交给 UploadVerifier 在后台批量核对
+                self.fs_id = api_response.get('fs_id')
                 return True
 
             except openapi_client.ApiException as e:
@@ -307,7 +689,6 @@ class BaiduCloudUploader(BaseUploader):
             
             elif errno in [111,-6]: # token 失效
                 mainlog.debug(f'错误码为{errno}，需要获取新token')
-                self.auth.renew_token()
 
             elif False : # 另外一些可修复的情况，这里暂时留空
                 pass
@@ -0,0 +1,205 @@
+import time
+import asyncio
+import threading
+import concurrent.futures
+from collections import deque
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+LATENCY_SAMPLES = 200 # 计算分位数时保留的最近分片耗时个数
+
+
+class Hedger:
+    '''
+    分片上传的对冲请求
+
+    记录最近成功分片的耗时，一个分片超过第 `percentile` 百分位还没传完时，再发一个
+    相同的请求（会重新选上传服务器、走新的连接），哪个先成功用哪个。同一个分片重复上传
+    在服务端是幂等的，慢的那个请求结束后结果直接丢弃。样本不够 `min_samples` 时不对冲。
+
+    线程版本里 SDK 的同步请求没办法取消，输掉的请求只是被放弃：它继续占着对冲线程池的
+    一个线程（和所在上传服务器的排队计数），直到自己完成或者读超时。所以每次对冲前先在
+    线程池里预留主请求和对冲请求两个线程，预留不到（线程都被还没结束的慢请求占着）时
+    不对冲，直接在调用方的线程里上传，上传服务器整体变慢时不会把线程池耗尽、卡住所有分片。
+    协程版本会取消输掉的请求。
+
+    Args:
+        percentile (float) : 超过多少百分位的耗时触发对冲
+        min_samples (int) : 至少多少个样本才开始对冲
+        enabled (bool) : 关闭时直接调用
+        max_workers (int) : 对冲线程池的大小
+
+    Attributes:
+        hedged : 发出对冲请求的次数
+        hedge_won : 对冲请求先成功的次数，也就是对冲起了作用的次数
+        hedge_skipped : 对冲线程池没有空闲线程、直接上传的次数
+
+    Methods:
+        run(func) : 在线程里调用 func，必要时对冲
+        run_async(factory) : 协程版本，factory 每次调用返回一个新的协程
+        threshold() : 当前触发对冲的耗时
+        snapshot() : 计数器
+    '''
+    def __init__(self, percentile=95, min_samples=20, enabled=True, max_workers=32):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.enabled = enabled
+        self.max_workers = max_workers
+        self.hedged = 0
+        self.hedge_won = 0
+        self.hedge_skipped = 0
+        self._busy = 0 # 对冲线程池里预留或者正在运行的请求数
+        self._samples = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def threshold(self):
+        with self._lock:
+            if not self.enabled or len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def snapshot(self):
+        with self._lock:
+            return {'hedged': self.hedged, 'hedge_won': self.hedge_won}
+
+    def run(self, func):
+        '''
+        Args:
+            func (callable) : 上传一个分片，成功时返回真值
+
+        Returns:
+            先成功的那次调用的返回值；都失败时返回主请求的结果或者抛出它的异常
+        '''
+        delay = self.threshold()
+        if delay is None or not self._reserve(2):
+            return self._timed(func)
+
+        pool = self._get_pool()
+        primary = pool.submit(self._pooled, func)
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done:
+            self._release() # 没用上的对冲线程
+            return primary.result()
+
+        self._count_hedge()
+        backup = pool.submit(self._pooled, func)
+        pending = {primary, backup}
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result():
+                    if future is backup:
+                        self._count_win()
+                    return future.result()
+        return primary.result()
+
+    async def run_async(self, factory):
+        '''
+        Args:
+            factory (callable) : 返回上传一个分片的协程，成功时结果为真值
+        '''
+        delay = self.threshold()
+        if delay is None:
+            return await self._timed_async(factory())
+
+        primary = asyncio.ensure_future(self._timed_async(factory()))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self._count_hedge()
+        backup = asyncio.ensure_future(self._timed_async(factory()))
+        pending = {primary, backup}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None and task.result():
+                        if task is backup:
+                            self._count_win()
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _timed(self, func):
+        start = time.monotonic()
+        result = func()
+        if result:
+            self._record(time.monotonic() - start)
+        return result
+
+    def _pooled(self, func):
+        '''在对冲线程池里运行，结束时归还预留的线程'''
+        try:
+            return self._timed(func)
+        finally:
+            self._release()
+
+    def _reserve(self, n):
+        with self._lock:
+            if self._busy + n > self.max_workers:
+                self.hedge_skipped += 1
+                return False
+            self._busy += n
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._busy -= 1
+
+    async def _timed_async(self, coro):
+        start = time.monotonic()
+        result = await coro
+        if result:
+            self._record(time.monotonic() - start)
+        return result
+
+    def _record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def _count_hedge(self):
+        with self._lock:
+            self.hedged += 1
+
+    def _count_win(self):
+        with self._lock:
+            self.hedge_won += 1
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedge')
+            return self._pool
+
+
+_hedgers = {}
+_hedgers_lock = threading.Lock()
+
+def get_hedger(config):
+    '''
+    获取配置文件对应的对冲器，同一个进程内共享耗时样本和计数
+
+    Args:
+        config (Config) : 配置管理器
+
+    Returns:
+        Hedger
+    '''
+    with _hedgers_lock:
+        hedger = _hedgers.get(config.filename)
+        if hedger is None:
+            timeout_config = config.get_timeout_config()
+            hedger = Hedger(
+                percentile=timeout_config.get('hedge_percentile'),
+                min_samples=timeout_config.get('hedge_min_samples'),
+                enabled=timeout_config.get('hedge'),
+            )
+            _hedgers[config.filename] = hedger
+        return hedger
@@ -0,0 +1,232 @@
+import os
+import time
+import sqlite3
+import threading
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+CLAIM_CACHE_SECONDS = 60 # 被其他机器持有的文件，多久之内不再去共享库里问
+
+
+class LeaseStore:
+    '''
+    共享目录上的租约表
+
+    一行一个文件（相对本地检测目录的路径），记录哪台机器持有、租约到什么时候、是否已经
+    上传完。所有改动都在 `BEGIN IMMEDIATE` 事务里做，两台机器同时领取同一批文件时只有
+    一台能拿到。共享目录多半是 SMB / NFS，不能用 WAL，用默认的回滚日志。
+
+    Args:
+        filename (str) : 共享目录上的 SQLite 文件
+        timeout (float) : 等待对方释放数据库锁的秒数
+
+    Methods:
+        claim(node, keys, ttl) : 领取一批文件，返回 (领到的, {没领到的: (持有者, 到期时间, 是否完成)})
+        finish(node, key) : 标记上传完成，其他机器不会再领取
+        release(node, keys) : 放弃租约，其他机器可以马上领取
+        heartbeat(node, ttl) : 续期这台机器持有的所有租约
+        nodes() : 各机器最近一次心跳时间
+    '''
+    def __init__(self, filename, timeout=30):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=DELETE')
+        self.db.execute('CREATE TABLE IF NOT EXISTS leases ('
+                        'key TEXT PRIMARY KEY, node TEXT NOT NULL, expires_at REAL NOT NULL, done INTEGER NOT NULL DEFAULT 0)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS leases_node ON leases (node, done)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, heartbeat REAL NOT NULL)')
+
+    def claim(self, node, keys, ttl):
+        now = time.time()
+        claimed, taken = [], {}
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = {}
+                for i in range(0, len(keys), 500):
+                    chunk = keys[i:i + 500]
+                    rows.update((row[0], row[1:]) for row in self.db.execute(
+                        f"SELECT key, node, expires_at, done FROM leases WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk))
+                for key in keys:
+                    row = rows.get(key)
+                    # 自己完成过的文件又来领取，说明本地要重新上传（比如核对失败），重新打开
+                    if row is None or row[0] == node or (not row[2] and row[1] < now):
+                        claimed.append(key)
+                    else:
+                        taken[key] = row
+                # 先更新已有的租约再插入新的，3.24 之前的 SQLite 没有 upsert
+                self.db.executemany('UPDATE leases SET node = ?, expires_at = ?, done = 0 WHERE key = ?',
+                                    [(node, now + ttl, key) for key in claimed])
+                self.db.executemany('INSERT OR IGNORE INTO leases (key, node, expires_at, done) VALUES (?, ?, ?, 0)',
+                                    [(key, node, now + ttl) for key in claimed])
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return claimed, taken
+
+    def finish(self, node, key):
+        with self.lock:
+            self.db.execute('UPDATE leases SET done = 1, expires_at = ? WHERE key = ? AND node = ?',
+                            (time.time(), key, node))
+
+    def release(self, node, keys):
+        with self.lock:
+            self.db.executemany('DELETE FROM leases WHERE key = ? AND node = ? AND done = 0',
+                                [(key, node) for key in keys])
+
+    def heartbeat(self, node, ttl):
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                renewed = self.db.execute('UPDATE leases SET expires_at = ? WHERE node = ? AND done = 0',
+                                          (now + ttl, node)).rowcount
+                self.db.execute('INSERT OR REPLACE INTO nodes (node, heartbeat) VALUES (?, ?)', (node, now))
+                self.db.execute('COMMIT')
+            except Exception:
+                self.db.execute('ROLLBACK')
+                raise
+        return renewed
+
+    def nodes(self):
+        with self.lock:
+            return dict(self.db.execute('SELECT node, heartbeat FROM nodes').fetchall())
+
+
+class NodeCoordinator:
+    '''
+    多台机器共用一个待上传目录（同一个 NAS 共享）时，保证每个文件只由一台机器上传
+
+    每台机器照常扫描目录、维护自己的状态库，开始处理一个文件之前先在共享目录上的
+    `LeaseStore` 里领取租约。为了少访问共享库，一次领取 `batch_size` 个：当前文件加上
+    本地状态库里排在最前面的待上传文件，领到的记在内存里，之后直接放行。
+
+    没领到的文件：对方已经上传完的在本地标记为已上传；对方还持有的推迟到对方租约到期，
+    期间队列不会读出，也不算失败。后台线程每 `heartbeat_interval` 秒给自己持有的租约续期，
+    机器宕机后租约在 `lease_seconds` 内过期，其他机器接着上传。上传失败的文件放弃租约，
+    本地按重试调度再来领取，其他机器也可以先领走。
+
+    两台机器的本地检测目录可以挂载在不同位置，租约按相对路径记录；网盘上的路径也按相对
+    路径生成，两台机器的 appname 要一致。
+
+    Args:
+        config (Config) : 配置管理器
+        status_manager (StatusManager) : 本机的任务状态管理器
+        queue (PendingQueue) : 本机的上传任务队列
+        store (LeaseStore) : 租约表，默认按配置打开共享目录上的库
+
+    Methods:
+        start() : 启动心跳线程
+        admit(file_path) : 领取文件，没领到时推迟或者标记已上传并返回 False
+        finish(file_path, uploaded) : 上传结束，成功时标记完成，失败时放弃租约
+        release(file_path) : 领到了但不上传（比如网盘空间不够推迟），放弃租约
+    '''
+    def __init__(self, config, status_manager, queue, store=None):
+        coordination_config = config.get_coordination_config()
+        self.enabled = coordination_config.get('enabled')
+        self.status_manager = status_manager
+        self.queue = queue
+        self.node = coordination_config.get('node_name')
+        self.root = config.get_local_config().get('local_directory')
+        self.batch_size = max(1, coordination_config.get('batch_size'))
+        self.lease_seconds = coordination_config.get('lease_seconds')
+        self.heartbeat_interval = coordination_config.get('heartbeat_interval')
+        self.store = store
+        if self.enabled and self.store is None:
+            self.store = LeaseStore(coordination_config.get('store'))
+        self._claimed = set() # 本机持有租约的文件
+        self._foreign = {} # 其他机器持有的文件 -> 不再询问共享库的截止时间
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.store.heartbeat(self.node, self.lease_seconds)
+        others = [node for node in self.store.nodes() if node != self.node]
+        mainlog.info(f"多机协调已开启，本机 {self.node}，共享库里还有 {', '.join(others) or '无'}")
+        threading.Thread(target=self._heartbeat, name='node-heartbeat', daemon=True).start()
+
+    def admit(self, file_path):
+        if not self.enabled:
+            return True
+        now = time.time()
+        with self._lock:
+            if file_path in self._claimed:
+                return True
+            until = self._foreign.get(file_path)
+        if until is not None and until > now:
+            self._postpone(file_path, until)
+            return False
+
+        candidates = [file_path]
+        with self._lock:
+            for _, path in self.status_manager.pending_after(0, self.batch_size * 2):
+                if len(candidates) >= self.batch_size:
+                    break
+                if path != file_path and path not in self._claimed and self._foreign.get(path, 0) <= now:
+                    candidates.append(path)
+        keys = {self._key(path): path for path in candidates}
+        try:
+            claimed, taken = self.store.claim(self.node, list(keys), self.lease_seconds)
+        except sqlite3.Error as e:
+            # 共享库暂时访问不了时不上传，避免两台机器重复上传
+            mainlog.info(f'领取 {file_path} 失败，稍后再试: {e}')
+            self._postpone(file_path, now + self.heartbeat_interval)
+            return False
+
+        with self._lock:
+            self._claimed.update(keys[key] for key in claimed)
+            for key, (node, expires_at, done) in taken.items():
+                self._foreign[keys[key]] = now + CLAIM_CACHE_SECONDS if done else expires_at
+        mainlog.debug(f'领取 {len(candidates)} 个文件，领到 {len(claimed)} 个')
+
+        key = self._key(file_path)
+        if key not in taken:
+            return True
+        node, expires_at, done = taken[key]
+        if done:
+            mainlog.info(f'{file_path} 已经由 {node} 上传')
+            self.status_manager.set_uploaded(file_path)
+            self.queue.done(file_path)
+        else:
+            mainlog.debug(f'{file_path} 正在由 {node} 上传，推迟到它的租约到期')
+            self._postpone(file_path, expires_at)
+        return False
+
+    def finish(self, file_path, uploaded):
+        if not self.enabled:
+            return
+        with self._lock:
+            if file_path not in self._claimed:
+                return
+            self._claimed.discard(file_path)
+        try:
+            if uploaded:
+                self.store.finish(self.node, self._key(file_path))
+            else:
+                self.store.release(self.node, [self._key(file_path)])
+        except sqlite3.Error as e:
+            # 没写进去的租约会过期，其他机器最多晚一些再领取
+            mainlog.info(f'更新 {file_path} 的租约失败: {e}')
+
+    def release(self, file_path):
+        self.finish(file_path, False)
+
+    def _postpone(self, file_path, until):
+        self.status_manager.defer(file_path, until)
+        self.queue.done(file_path)
+
+    def _key(self, file_path):
+        return os.path.relpath(file_path, self.root).replace(os.sep, '/')
+
+    def _heartbeat(self):
+        while not shutdown_event.wait(self.heartbeat_interval):
+            try:
+                self.store.heartbeat(self.node, self.lease_seconds)
+            except sqlite3.Error as e:
+                mainlog.info(f'多机协调心跳失败: {e}')
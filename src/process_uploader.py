@@ -0,0 +1,234 @@
+import os
+import sys
+import threading
+import multiprocessing
+import concurrent.futures
+from concurrent.futures import ProcessPoolExecutor
+
+from file_uploader import (BaseUploader, BaiduCloudUploader, PAN_HOST, rapid_upload_savings, server_copy_savings,
+                           get_overwrite_marks)
+from storage_auth import get_token_provider
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+
+class ProcessUploadEngine:
+    '''
+    多进程上传引擎
+
+    一个进程里哈希、SSL 和 SDK 的反序列化都要抢 GIL，分片并发开得再大 CPU 也只用满一个核。
+    这个引擎起 `processes` 个子进程，每个子进程一次完整地上传一个文件（哈希、切片、
+    预上传、分片、创建），结果通过进程池的管道传回。状态库、任务队列、重试和 token 都留在
+    主进程：token 由主进程随任务一起发给子进程，子进程不刷新 token，token 失效的文件按一次
+    失败重试，避免多个进程同时刷新把对方的 refresh token 作废。
+
+    子进程用 spawn 方式启动，不继承主进程里的线程和锁。
+
+    Args:
+        config_file (str) : 配置文件路径，子进程自己读取
+        processes (int) : 子进程数
+
+    Methods:
+        submit(*args) : 提交一个文件，返回 concurrent.futures.Future，结果是 `_upload_in_worker` 的返回值
+        stop() : 让所有子进程里正在上传的文件尽快停下
+        close() : 等子进程退出
+    '''
+    def __init__(self, config_file, processes):
+        context = multiprocessing.get_context('spawn')
+        self.processes = processes
+        self.stop_event = context.Event()
+        src_path = os.path.dirname(os.path.abspath(__file__))
+        self.pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=context, initializer=_init_worker,
+            initargs=(src_path, config_file, self.stop_event, bool(mainlog.handlers)))
+
+    def submit(self, *args):
+        return self.pool.submit(_upload_in_worker, *args)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_process_engine(config):
+    '''进程内共享的多进程上传引擎，第一次调用时创建'''
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            processes = config.get_upload_config().get('processes') or os.cpu_count() or 1
+            _engine = ProcessUploadEngine(config.filename, processes)
+        return _engine
+
+
+class ProcessBaiduCloudUploader(BaseUploader):
+    '''
+    主进程里的上传器代理，实际上传在 `ProcessUploadEngine` 的子进程里进行
+
+    准备阶段什么都不做（哈希和切片也要放到子进程里），`submit_transfer()` 把文件交给
+    子进程，完成后把网盘路径、fs_id、压缩格式等结果填回来，后台核对和统计照常使用。
+
+    Args:
+        file_name (str) : 本地文件路径
+        config (Config) : 配置管理器
+        upload_relpath (str) : 网盘上相对应用目录的路径
+        account (str) : 上传到哪个百度网盘账号
+    '''
+    def __init__(self, file_name, config, upload_relpath=None, account=None):
+        super().__init__(file_name, config)
+        self.name = '百度云盘(多进程)'
+        self.account = account
+        self.upload_relpath = upload_relpath
+        self.auth = get_token_provider(config, account)
+        self.engine = get_process_engine(config)
+        self.pan_host = PAN_HOST
+        self.upload_path = None
+        self.codec = None
+        self.fs_id = None
+        self.prepared = False
+
+    def prepare(self):
+        self.prepared = True
+
+    def start_upload(self):
+        return self.submit_transfer().result()
+
+    def submit_transfer(self):
+        '''
+        把整个上传交给子进程
+
+        Returns:
+            concurrent.futures.Future : 结果为上传成功与否
+        '''
+        # 已经算过的 md5（比如多目的地上传时读过一遍）一起发过去，子进程不用再算
+        hashes = self.file.known_hashes()
+        # 核对失败要覆盖的路径记在主进程里，一起发过去
+        overwrites = get_overwrite_marks(self.config).paths(self.account)
+        future = self.engine.submit(self.file.file_path, self.upload_relpath, self.account,
+                                    self.auth.get_token(), hashes, self.pan_host, overwrites)
+        result = concurrent.futures.Future()
+        future.add_done_callback(lambda f: self._collect(f, result))
+        return result
+
+    def discard(self):
+        self.prepared = False
+
+    def stop_upload(self):
+        '''子进程收不到单个文件的停止信号，只在退出时调用，停下所有子进程里的上传'''
+        self.engine.stop()
+
+    def upload_status(self):
+        pass
+
+    def _collect(self, future, result):
+        '''把子进程的结果填回代理，再完成交给监控线程的 future'''
+        try:
+            outcome = future.result()
+        except Exception as e:
+            result.set_exception(e)
+            return
+        if outcome.get('error'):
+            result.set_exception(Exception(outcome['error']))
+            return
+
+        self.upload_path = outcome.get('upload_path')
+        self.codec = outcome.get('codec')
+        self.fs_id = outcome.get('fs_id')
+        self.file.codec = self.codec
+        self.file.upload_size = outcome.get('upload_size')
+        if outcome.get('file_md5'):
+            self.file.file_md5 = outcome['file_md5']
+        if outcome.get('saved') == 'rapid':
+            rapid_upload_savings.add(self.file.file_size)
+        elif outcome.get('saved') == 'copy':
+            server_copy_savings.add(self.file.file_size)
+        result.set_result(outcome.get('uploaded'))
+
+
+class _FixedToken:
+    '''
+    子进程里的 token，只用主进程发来的那一个，失效时不刷新
+
+    每个子进程只有一个实例，每个任务开始前换成主进程随任务发来的 token。上传器和熔断器的
+    探测都用它，子进程里不会创建 `TokenProvider`，也不会有后台刷新线程。
+    '''
+    def __init__(self, token):
+        self.token = token
+
+    def get_token(self):
+        return self.token
+
+    def renew_token(self, stale_token=None):
+        raise Exception('token 失效，子进程不刷新 token，交给主进程重试')
+
+
+_worker = {'config': None, 'current': None, 'token': None}
+
+def _init_worker(src_path, config_file, stop_event, log_enabled):
+    '''子进程启动时调用'''
+    if src_path not in sys.path:
+        sys.path.append(src_path)
+    from configer import Config
+    import utils
+    if log_enabled:
+        utils.logging_with_terminal_and_file()
+    _worker['config'] = Config(config_file)
+    _worker['token'] = _FixedToken(None)
+
+    def watch_stop():
+        stop_event.wait()
+        utils.shutdown_event.set()
+        uploader = _worker['current']
+        if uploader is not None:
+            uploader.stop_upload()
+    threading.Thread(target=watch_stop, name='worker-stop', daemon=True).start()
+
+
+def _upload_in_worker(file_path, upload_relpath, account, token, hashes, pan_host, overwrites=()):
+    '''
+    在子进程里上传一个文件
+
+    Returns:
+        dict : uploaded / upload_path / codec / fs_id / upload_size / file_md5 / saved，出错时只有 error
+    '''
+    rapid = rapid_upload_savings.snapshot()['files']
+    copied = server_copy_savings.snapshot()['files']
+    marks = get_overwrite_marks(_worker['config'])
+    for path in overwrites:
+        marks.mark(account, path)
+    try:
+        _worker['token'].token = token
+        uploader = BaiduCloudUploader(file_path, _worker['config'], upload_relpath, account, auth=_worker['token'])
+        uploader.pan_host = pan_host
+        file_md5, slice_md5 = hashes
+        if file_md5 and slice_md5:
+            uploader.file.file_md5, uploader.file.slice_md5 = file_md5, slice_md5
+        _worker['current'] = uploader
+        uploaded = uploader.start_upload()
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}'}
+    finally:
+        _worker['current'] = None
+        for path in overwrites:
+            marks.clear(account, path)
+
+    saved = None
+    if rapid_upload_savings.snapshot()['files'] > rapid:
+        saved = 'rapid'
+    elif server_copy_savings.snapshot()['files'] > copied:
+        saved = 'copy'
+    return {
+        'uploaded': uploaded,
+        'upload_path': uploader.upload_path,
+        'codec': uploader.codec,
+        'fs_id': uploader.fs_id,
+        'upload_size': uploader.file.upload_size,
+        'file_md5': uploader.file.known_hashes()[0],
+        'saved': saved,
+    }
@@ -0,0 +1,173 @@
+import os
+import time
+import heapq
+import threading
+
+from file_uploader import _api_quota, PAN_HOST
+from storage_auth import get_token_provider
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+MIN_REFRESH_INTERVAL = 30 # 上传失败触发的额外刷新，最短间隔（秒）
+
+
+class QuotaGate:
+    '''
+    按网盘剩余空间决定文件能不能开始上传
+
+    后台线程每 `refresh_interval` 秒调用一次 `UserinfoApi.apiquota` 拿到剩余空间，
+    之间按本地记账：文件开始准备前预留它的大小，上传成功后从剩余空间里扣掉，失败时
+    退回预留。剩余空间（减去 `reserve_bytes` 的余量）放不下的文件不进入哈希和切片，
+    直接推迟：状态库里记下推迟到什么时候，期间队列不会读出它，也不算一次失败。
+
+    每次刷新后按从小到大的顺序把还放得下的推迟文件放回队列，空间紧张时小文件先传。
+    上传失败时提前刷新一次，容量已满导致的失败下一轮会被推迟，而不是一直重试。
+    还没拿到过容量（接口失败、关闭）时所有文件都放行。
+
+    Args:
+        config (Config) : 配置管理器
+        status_manager (StatusManager) : 任务状态管理器
+        queue (PendingQueue) : 文件上传的任务队列
+        fetch (callable) : 返回 apiquota 结果的函数，默认调用百度网盘接口
+        account (str) : 统计哪个百度网盘账号的空间
+
+    Methods:
+        start() : 同步刷新一次容量并启动后台刷新线程
+        admit(file_path) : 预留空间，放不下时推迟文件并返回 False
+        settle(file_path, uploaded) : 上传结束，成功扣减剩余空间，失败退回预留
+        move(file_path, other) : 把文件的预留挪到另一个账号的 QuotaGate
+        refresh() : 立即刷新容量，返回剩余字节数（失败时为 None）
+        remaining() : 可以再预留的字节数，未知时为 None
+        deferred() : 因为空间不够推迟的文件数
+    '''
+    def __init__(self, config, status_manager, queue, fetch=None, account=None):
+        quota_config = config.get_quota_config()
+        self.enabled = quota_config.get('enabled')
+        self.refresh_interval = quota_config.get('refresh_interval')
+        self.reserve_bytes = int(quota_config.get('reserve_mb') * 1024 * 1024)
+        self.status_manager = status_manager
+        self.queue = queue
+        if fetch is None:
+            auth = get_token_provider(config, account)
+            fetch = lambda: _api_quota(auth, self.pan_host)
+        self.fetch = fetch
+        self.pan_host = PAN_HOST
+        self._free = None # 最近一次刷新的剩余空间，之后按成功上传扣减
+        self._reserved = {} # 已经放行、还没结束的文件 -> 预留字节数
+        self._deferred = [] # (大小, 路径)
+        self._deferred_paths = set()
+        self._next_refresh = 0
+        self._cond = threading.Condition()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.refresh()
+        threading.Thread(target=self._run, name='quota-refresh', daemon=True).start()
+
+    def admit(self, file_path):
+        if not self.enabled:
+            return True
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            return True # 文件已经不在了，交给上传器按失败处理
+
+        with self._cond:
+            available = self._available()
+            if available is None or size <= available:
+                self._reserved[file_path] = self._reserved.get(file_path, 0) + size
+                return True
+            if file_path not in self._deferred_paths:
+                heapq.heappush(self._deferred, (size, file_path))
+                self._deferred_paths.add(file_path)
+
+        # 推迟到下次刷新之后，期间队列扫描状态库不会读出它
+        mainlog.info(f'网盘剩余空间 {available / 1024 / 1024:.0f}MB 放不下 {file_path}（{size / 1024 / 1024:.0f}MB），推迟上传')
+        self.status_manager.defer(file_path, time.time() + self.refresh_interval)
+        self.queue.done(file_path)
+        return False
+
+    def settle(self, file_path, uploaded):
+        if not self.enabled:
+            return
+        with self._cond:
+            size = self._reserved.pop(file_path, 0)
+            if uploaded and self._free is not None:
+                self._free -= size
+            if not uploaded:
+                # 可能是容量满了，尽快核对一次
+                self._next_refresh = min(self._next_refresh, time.monotonic() + MIN_REFRESH_INTERVAL)
+                self._cond.notify()
+
+    def move(self, file_path, other):
+        if other is self:
+            return
+        with self._cond:
+            size = self._reserved.pop(file_path, None)
+        if size is None:
+            return
+        with other._cond:
+            other._reserved[file_path] = other._reserved.get(file_path, 0) + size
+
+    def remaining(self):
+        with self._cond:
+            return self._available()
+
+    def deferred(self):
+        with self._cond:
+            return len(self._deferred)
+
+    def refresh(self):
+        try:
+            api_response = self.fetch()
+        except Exception as e:
+            mainlog.debug(f'查询网盘容量失败: {e}')
+            return None
+        if api_response.get('errno'):
+            mainlog.debug(f"查询网盘容量失败 错误码:{api_response.get('errno')}")
+            return None
+
+        free = api_response.get('total', 0) - api_response.get('used', 0)
+        with self._cond:
+            self._free = free
+            self._next_refresh = time.monotonic() + self.refresh_interval
+            admitted = self._release_deferred()
+        mainlog.debug(f'网盘剩余空间 {free / 1024 / 1024 / 1024:.1f}GB')
+
+        # 从小到大放回队列
+        for size, file_path in admitted:
+            self.status_manager.defer(file_path, 0)
+            self.queue.put(file_path)
+        if admitted:
+            mainlog.info(f'网盘空间够了，{len(admitted)} 个推迟的文件重新排队')
+        return free
+
+    def _available(self):
+        '''调用方持有 self._cond'''
+        if self._free is None:
+            return None
+        return self._free - self.reserve_bytes - sum(self._reserved.values())
+
+    def _release_deferred(self):
+        '''取出所有放得下的推迟文件，调用方持有 self._cond'''
+        available = self._available()
+        admitted = []
+        while self._deferred and self._deferred[0][0] <= available:
+            size, file_path = heapq.heappop(self._deferred)
+            self._deferred_paths.discard(file_path)
+            admitted.append((size, file_path))
+            available -= size
+        return admitted
+
+    def _run(self):
+        while not shutdown_event.is_set():
+            with self._cond:
+                wait = self._next_refresh - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(min(wait, 5))
+                    continue
+                self._next_refresh = time.monotonic() + self.refresh_interval
+            self.refresh()
@@ -0,0 +1,200 @@
+import os
+import time
+import sqlite3
+import threading
+
+from file_uploader import _sdk, SDK_FAST_PATH, PAN_HOST, remote_path_for, remote_md5_is_content
+from storage_auth import get_token_provider
+from compressor import get_compression_policy
+from utils import get_all_files_in_directory, cal_file_hashes
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+LIST_PAGE_SIZE = 1000 # listall 每页最多返回 1000 条
+INCREMENTAL_MARGIN = 600 # 增量刷新时往前多看一段，避免时钟误差漏掉文件（秒）
+
+
+class RemoteIndex:
+    '''
+    网盘目录树的本地缓存
+
+    把 listall 翻页拿到的 (path, size, md5) 存进 SQLite，`ttl` 内重复对账不再请求网盘。
+    过期后按修改时间倒序增量拉取，遇到上次刷新之前的文件就停下；`full=True` 时整棵树重新拉。
+
+    Args:
+        filename (str) : 缓存数据库
+        ttl (float) : 缓存有效期（秒）
+
+    Methods:
+        get(path) : (size, md5)，不存在时返回 None
+        fresh(root) : root 的缓存是否还在有效期内
+        replace(root, entries) / merge(root, entries) : 整棵树替换 / 增量合并
+        refreshed_at(root) : 上次刷新的时间
+    '''
+    def __init__(self, filename='remote_index.db', ttl=86400):
+        self.filename = filename
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS remote ('
+                        'path TEXT PRIMARY KEY, size INTEGER NOT NULL, md5 TEXT, fs_id INTEGER, server_mtime INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS refresh (root TEXT PRIMARY KEY, refreshed_at REAL NOT NULL)')
+        self.db.commit()
+
+    def get(self, path):
+        with self.lock:
+            return self.db.execute('SELECT size, md5 FROM remote WHERE path = ?', (path,)).fetchone()
+
+    def refreshed_at(self, root):
+        with self.lock:
+            row = self.db.execute('SELECT refreshed_at FROM refresh WHERE root = ?', (root,)).fetchone()
+        return row[0] if row else None
+
+    def fresh(self, root):
+        refreshed_at = self.refreshed_at(root)
+        return refreshed_at is not None and time.time() - refreshed_at < self.ttl
+
+    def replace(self, root, entries, refreshed_at):
+        with self.lock:
+            with self.db:
+                self.db.execute("DELETE FROM remote WHERE path = ? OR path LIKE ? ESCAPE '\\'",
+                                (root, _like_prefix(root)))
+                self._insert(entries)
+                self._touch(root, refreshed_at)
+
+    def merge(self, root, entries, refreshed_at):
+        with self.lock:
+            with self.db:
+                self._insert(entries)
+                self._touch(root, refreshed_at)
+
+    def _insert(self, entries):
+        self.db.executemany(
+            'INSERT OR REPLACE INTO remote (path, size, md5, fs_id, server_mtime) VALUES (?, ?, ?, ?, ?)',
+            ((e['path'], e.get('size', 0), e.get('md5'), e.get('fs_id'), e.get('server_mtime')) for e in entries))
+
+    def _touch(self, root, refreshed_at):
+        self.db.execute('INSERT OR REPLACE INTO refresh (root, refreshed_at) VALUES (?, ?)', (root, refreshed_at))
+
+
+def _like_prefix(root):
+    escaped = root.rstrip('/').replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}/%'
+
+
+class Reconciler:
+    '''
+    和网盘上的文件对账
+
+    状态库丢失或者换了一台机器时，本地文件全部是“未登记”，会被重新上传一遍。对账先用
+    `MultimediafileApi.xpanfilelistall` 按游标翻页拉取 `/apps/<appname>` 下的整棵目录树，
+    再把网盘上路径相同、大小一致的本地文件直接登记为已上传，不传输任何数据。不超过一个分片的
+    文件网盘上的 md5 就是内容的 md5（`remote_md5_is_content`），还要求 md5 一致；分片上传的
+    大文件只比较路径和大小。
+
+    压缩上传的文件在网盘上带 `.zst` / `.gz` 后缀，大小是压缩后的，只要求文件存在。
+
+    Args:
+        config (Config) : 配置管理器
+        status_manager (StatusManager) : 任务状态管理器
+        remote_index (RemoteIndex) : 远端目录缓存，默认按配置创建
+
+    Methods:
+        refresh(full) : 刷新远端目录缓存，返回拉取的条目数（缓存有效时为 0）
+        reconcile(full) : 刷新缓存并标记本地文件，返回新标记为已上传的文件数
+    '''
+    def __init__(self, config, status_manager, remote_index=None):
+        self.config = config
+        self.status_manager = status_manager
+        reconcile_config = config.get_reconcile_config()
+        self.remote_index = remote_index or RemoteIndex(reconcile_config.get('index_file'), reconcile_config.get('ttl'))
+        self.root = f"/apps/{config.get_baidu_config().get('app_name')}"
+        self.pan_host = PAN_HOST
+        self.auth = get_token_provider(config)
+
+    def refresh(self, full=False):
+        last = self.remote_index.refreshed_at(self.root)
+        if not full and self.remote_index.fresh(self.root):
+            mainlog.info(f'{self.root} 的远端目录缓存仍然有效，跳过刷新')
+            return 0
+
+        started = time.time()
+        since = None if full else last
+        entries = list(list_remote_files(self.auth, self.pan_host, self.root, since))
+        if since is None:
+            self.remote_index.replace(self.root, entries, started)
+            mainlog.info(f'已拉取 {self.root} 下的 {len(entries)} 个文件')
+        else:
+            self.remote_index.merge(self.root, entries, started)
+            mainlog.info(f'增量拉取 {self.root} 下 {len(entries)} 个新文件')
+        return len(entries)
+
+    def reconcile(self, full=False):
+        self.refresh(full)
+
+        policy = get_compression_policy(self.config)
+        local_directory = self.config.get_local_config().get('local_directory')
+        matched = []
+        for file_path in get_all_files_in_directory(local_directory):
+            if os.path.isfile(file_path) and self._uploaded(file_path, policy):
+                matched.append(file_path)
+
+        changed = self.status_manager.import_uploaded(matched)
+        mainlog.info(f'对账完成：网盘上已有 {len(matched)} 个本地文件，其中 {changed} 个新标记为已上传')
+        return changed
+
+    def _uploaded(self, file_path, policy):
+        remote_path = remote_path_for(self.config, file_path)
+        remote = self.remote_index.get(remote_path)
+        if remote is not None and remote[0] == os.path.getsize(file_path):
+            size, md5 = remote
+            return not (md5 and remote_md5_is_content(size)) or cal_file_hashes(file_path)[0] == md5
+
+        codec, _ = policy.codec_for(file_path)
+        return codec is not None and self.remote_index.get(remote_path + policy.suffix(codec)) is not None
+
+
+def list_remote_files(auth, pan_host, root, since=None):
+    '''
+    用 listall 按游标翻页，逐条返回 root 下的文件（不含目录）
+
+    Args:
+        auth (TokenProvider) : 每页请求前取一次 token
+        pan_host (str) : 网盘接口地址
+        root (str) : 网盘目录
+        since (float) : 上次拉取的时间，给出时按修改时间倒序只拉这之后（往前多看一段）的文件
+    '''
+    for entry in _list_all(auth, pan_host, root, *(('time', 1) if since is not None else ())):
+        if since is not None and entry.get('server_mtime', 0) < since - INCREMENTAL_MARGIN:
+            return
+        yield entry
+
+
+def _list_all(auth, pan_host, root, order=None, desc=None):
+    openapi_client = _sdk()[0]
+    from openapi_client.api import multimediafile_api
+    options = {}
+    if order:
+        options = {'order': order, 'desc': desc}
+
+    cursor = 0
+    with openapi_client.ApiClient(openapi_client.Configuration(host=pan_host)) as api_client:
+        api_instance = multimediafile_api.MultimediafileApi(api_client)
+        while True:
+            api_response = api_instance.xpanfilelistall(
+                auth.get_token(), root, 1, start=cursor, limit=LIST_PAGE_SIZE,
+                **options, **SDK_FAST_PATH)
+            if api_response.get('errno'):
+                if api_response.get('errno') == -9: # 目录还不存在，说明什么都没上传过
+                    return
+                raise Exception(f"listall {root} 失败 错误码:{api_response.get('errno')}")
+
+            for entry in api_response.get('list', []):
+                if not entry.get('isdir'):
+                    yield entry
+            if not api_response.get('has_more'):
+                return
+            cursor = api_response.get('cursor')
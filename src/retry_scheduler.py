@@ -0,0 +1,105 @@
+import heapq
+import random
+import threading
+import time
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+IDLE_WAIT = 5 # 没有到期任务时最多等多久检查一次退出信号（秒）
+
+
+class RetryPolicy:
+    '''
+    失败重试的退避策略
+
+    第 n 次失败后等待 `base_delay * 2^(n-1)` 秒（不超过 `max_delay`），再乘上
+    0.8 ~ 1.0 的随机系数，避免同一批失败的文件同时重试。失败 `max_attempts` 次后放弃。
+
+    Args:
+        retry_config (dict) : `Config.get_retry_config()` 的结果
+
+    Methods:
+        delay(attempts) : 第 attempts 次失败后等待的秒数，放弃时返回 None
+    '''
+    def __init__(self, retry_config):
+        self.max_attempts = retry_config.get('max_attempts')
+        self.base_delay = retry_config.get('base_delay')
+        self.max_delay = retry_config.get('max_delay')
+
+    def delay(self, attempts):
+        if attempts >= self.max_attempts:
+            return None
+        backoff = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return backoff * random.uniform(0.8, 1.0)
+
+
+class RetryScheduler:
+    '''
+    上传失败文件的延迟重试
+
+    失败次数、下次重试时间记录在状态库里，重试时间没到之前队列不会从库里读出这个文件。
+    调度器用一个按重试时间排序的堆，到期后把文件放回队列，不用等队列下一轮扫描状态库；
+    重启后从状态库里恢复还没到期的重试。
+
+    Args:
+        queue (PendingQueue) : 文件上传的任务队列
+        status_manager (StatusManager) : 任务状态管理器
+        policy (RetryPolicy) : 退避策略
+
+    Methods:
+        start() : 恢复状态库里的待重试文件并启动调度线程
+        failed(file_path, error) : 记录一次失败，返回是否还会重试
+        pending() : 等待重试的文件数
+    '''
+    def __init__(self, queue, status_manager, policy):
+        self.queue = queue
+        self.status_manager = status_manager
+        self.policy = policy
+        self._heap = [] # (重试时间戳, 文件路径)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            for item in self.status_manager.scheduled_retries():
+                heapq.heappush(self._heap, item)
+        if self._heap:
+            mainlog.info(f'{len(self._heap)} 个上传失败的文件等待重试')
+        self._thread = threading.Thread(target=self._run, name='retry-scheduler', daemon=True)
+        self._thread.start()
+
+    def failed(self, file_path, error=None):
+        attempts, next_attempt = self.status_manager.record_failure(
+            file_path, self.policy.delay, None if error is None else str(error))
+        if next_attempt is None:
+            mainlog.error(f'{file_path} 已经失败 {attempts} 次，不再重试: {error}')
+            return False
+
+        mainlog.info(f'{file_path} 第 {attempts} 次上传失败，{next_attempt - time.time():.0f} 秒后重试')
+        with self._cond:
+            heapq.heappush(self._heap, (next_attempt, file_path))
+            self._cond.notify()
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _run(self):
+        while not shutdown_event.is_set():
+            due = []
+            with self._cond:
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+                if not due:
+                    wait = IDLE_WAIT if not self._heap else min(IDLE_WAIT, self._heap[0][0] - now)
+                    self._cond.wait(wait)
+                    continue
+
+            # 队列按路径去重，扫描状态库时已经读回去的文件这里再放一次也没关系
+            for file_path in due:
+                mainlog.debug(f'{file_path} 到达重试时间，放回上传队列')
+                self.queue.put(file_path)
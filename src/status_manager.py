@@ -1,49 +1,85 @@
 STATUS_NOT_UPLOADED = '未上传'
 STATUS_UPLOADED = '已上传'
 STATUS_UPLOADING = '正在上传'
+STATUS_FAILED = '上传失败' # 重试次数用完，等待人工处理
 from utils import MAIN_LOG
 
 import json
 import os
+import sqlite3
+import time
 import threading
 import logging
+from work_queue import PendingQueue
 mainlog = logging.getLogger(MAIN_LOG)
 
+RESTORE_BATCH = 1000 # 启动恢复时每批从库里读出的待上传记录数
+RETRY_COLUMNS = {
+    'attempts': 'INTEGER NOT NULL DEFAULT 0',
+    'next_attempt': 'REAL NOT NULL DEFAULT 0',
+    'last_error': 'TEXT',
+    'account': 'TEXT', # 文件上传到了哪个百度网盘账号
+}
+
 class StatusManager():
     """
     StatusManager 用于管理文件的上传状态。
 
     这个类提供了方法来加载、更新、保存和删除特定文件的上传状态。
-    状态信息被存储在一个 JSON 文件中。
+    状态信息存储在 SQLite 数据库中，每次修改只写一行，不再整表重写；
+    旧版的 JSON 状态文件会在第一次启动时自动迁移。
+
+    上传失败的文件记录失败次数、最后一次错误和下次重试时间，重试时间没到的不会被读出；
+    次数用完后进入“上传失败”状态，需要人工 `redrive()` 才会重新上传。
+
+    启动时不把整个状态表读进内存。队列是 `PendingQueue` 时由队列按需从库里补充，
+    否则由后台线程按批从库里读出放进队列，第一批文件很快就能开始上传。
 
     Args:
         queue (Queue) : 文件上传的任务队列
-        filename (str): 状态文件的名称。默认为 'upload_status.json'
+        filename (str): 状态数据库的名称。默认为 'upload_status.db'
+        legacy_file (str): 旧版 JSON 状态文件，存在且数据库为空时迁移。默认为 'upload_status.json'
+
+    Attributes:
+        restored (Event) : 启动时的队列恢复是否完成
 
     Methods:
         get_status(file_name) : 获取指定文件的上传状态
         add(file_name) : 增加文件到状态表
+        add_if_absent(file_name) : 文件未登记时增加到状态表
         set_uploaded(file_name) : 设置文件状态为 已经上传
+        set_uploaded_many(file_names) : 批量设置文件状态为 已经上传
+        import_uploaded(file_names) : 批量登记并标记为 已经上传（对账时用）
         set_uploading(file_name) : 设置文件状态为 正在上传
         set_not_uploaded(file_name) : 设置文件状态为 未上传
         reload_status() : 重新加载状态文件
         remove_status(file_name) : 从状态中删除指定文件的记录
+        count(status) : 某个状态的文件数
+        pending_after(rowid, limit, restore_upto) : 按 rowid 顺序读取待上传的文件
+        record_failure(file_name, retry_delay, error) : 记录一次上传失败，安排重试或者放弃
+        scheduled_retries() : 还没到重试时间的文件
+        dead_letters() : 重试次数用完的文件
+        redrive(file_names) : 把上传失败的文件重新放回待上传
     """
 
-    def __init__(self, queue, filename='upload_status.json'):
+    def __init__(self, queue, filename='upload_status.db', legacy_file='upload_status.json'):
         """
         初始化 StatusManager 类的新实例。
 
         Args:
-            filename (str): 状态文件的名称。默认为 'upload_status.json'。
+            filename (str): 状态数据库的名称。默认为 'upload_status.db'。
+            legacy_file (str): 旧版 JSON 状态文件。
         """
         mainlog.debug(f'正在初始化状态控制器')
         self.lock = threading.Lock()
         self.filename = filename
+        self.legacy_file = legacy_file
         self.queue = queue
-        self.status = self._load_status()
-        
-        # 初始化加载状态后同步到任务队列
+        self.restored = threading.Event()
+        self.db = self._open_db()
+        self._migrate_legacy()
+
+        # 初始化后在后台把待上传的文件同步到任务队列
         mainlog.debug(f'同步未上传状态到队列中')
         self._sync_queue()
 
@@ -60,15 +96,16 @@ class StatusManager():
             str: 文件的上传状态。
         """
         with self.lock:
-            return self.status.get(file_name, 'NOT_EXIST')
+            return self._get(file_name) or 'NOT_EXIST'
 
 
     def is_exsit(self, file_name):
         '''
         文件是否已经登记
         '''
-        return file_name in self.status
-    
+        with self.lock:
+            return self._get(file_name) is not None
+
 
     def add(self, file_name):
         """
@@ -78,26 +115,94 @@ class StatusManager():
             file_name (str): 增加的文件
         """
         with self.lock:
-            if file_name in self.status:
+            if self._get(file_name) is not None:
                 raise ValueError(f"文件 '{file_name}' 的状态已经存在。")
-            
-            self._set_status(file_name, STATUS_NOT_UPLOADED)
-            self._save_status()
 
+            with self.db:
+                self.db.execute('INSERT INTO status (path, status) VALUES (?, ?)', (file_name, STATUS_NOT_UPLOADED))
+
+
+    def add_if_absent(self, file_name):
+        """
+        文件未登记时增加到状态表，检查和写入在一条语句里完成
+
+        Args:
+            file_name (str): 增加的文件
+
+        Returns:
+            bool: 是否新登记了这个文件
+        """
+        with self.lock:
+            with self.db:
+                return self.db.execute('INSERT OR IGNORE INTO status (path, status) VALUES (?, ?)',
+                                       (file_name, STATUS_NOT_UPLOADED)).rowcount == 1
 
-    def set_uploaded(self, file_name):
+
+    def set_uploaded(self, file_name, account=None):
         """
         设置文件状态为已经上传
 
         Args:
             file_name (str): 需要修改状态的文件
+            account (str): 文件所在的百度网盘账号
+        """
+        self._update(file_name, STATUS_UPLOADED)
+        if account is not None:
+            self._set_account([file_name], account)
+
+
+    def set_uploaded_many(self, file_names, account=None):
+        """
+        批量设置文件状态为已经上传，在一个事务里提交
+
+        Args:
+            file_names (list): 需要修改状态的文件
+            account (str): 文件所在的百度网盘账号
         """
         with self.lock:
-            if file_name not in self.status:
-                raise ValueError(f"文件 '{file_name}' 的不存在。")
-            
-            self._set_status(file_name, STATUS_UPLOADED)
-            self._save_status()
+            for file_name in file_names:
+                if self._get(file_name) is None:
+                    raise ValueError(f"文件 '{file_name}' 的不存在。")
+
+            with self.db:
+                self.db.executemany('UPDATE status SET status = ? WHERE path = ?',
+                                    [(STATUS_UPLOADED, file_name) for file_name in file_names])
+        if account is not None:
+            self._set_account(file_names, account)
+
+
+    def get_account(self, file_name):
+        """
+        Returns:
+            str: 文件上次上传到的百度网盘账号，没上传过时为 None
+        """
+        with self.lock:
+            row = self.db.execute('SELECT account FROM status WHERE path = ?', (file_name,)).fetchone()
+        return row[0] if row else None
+
+
+    def import_uploaded(self, file_names):
+        """
+        批量登记文件并标记为已上传，已经登记的文件直接改状态，在一个事务里提交
+
+        网盘上已经有的文件（换机器、状态库丢失后对账）用这个一次性导入，不需要逐个上传。
+
+        Args:
+            file_names (list): 网盘上已经存在的本地文件
+
+        Returns:
+            int: 状态实际发生变化的文件数
+        """
+        with self.lock:
+            with self.db:
+                # 不用 ON CONFLICT DO UPDATE，Python 3.7 自带的 SQLite 可能早于 3.24
+                changed = self.db.executemany(
+                    'UPDATE status SET status = ?, attempts = 0, next_attempt = 0, last_error = NULL '
+                    'WHERE path = ? AND status != ?',
+                    [(STATUS_UPLOADED, file_name, STATUS_UPLOADED) for file_name in file_names]).rowcount
+                return changed + self.db.executemany(
+                    'INSERT OR IGNORE INTO status (path, status) VALUES (?, ?)',
+                    [(file_name, STATUS_UPLOADED) for file_name in file_names]).rowcount
 
 
     def set_uploading(self, file_name):
@@ -107,12 +212,7 @@ class StatusManager():
         Args:
             file_name (str): 需要修改状态的文件
         """
-        with self.lock:
-            if file_name not in self.status:
-                raise ValueError(f"文件 '{file_name}' 的不存在。")
-            
-            self._set_status(file_name, STATUS_UPLOADING)
-            self._save_status()
+        self._update(file_name, STATUS_UPLOADING)
 
 
     def set_not_uploaded(self, file_name):
@@ -122,87 +222,242 @@ class StatusManager():
         Args:
             file_name (str): 需要修改状态的文件
         """
-        with self.lock:
-            if file_name not in self.status:
-                raise ValueError(f"文件 '{file_name}' 的不存在。")
-            
-            self._set_status(file_name, STATUS_NOT_UPLOADED)
-            self._save_status()
+        self._update(file_name, STATUS_NOT_UPLOADED)
 
 
     def reload_status(self):
-        """ 重新加载状态文件 """
+        """ 重新加载状态文件，状态直接读写数据库，这里只是重新打开连接 """
         with self.lock:
-            self.status = self._load_status()
-            # self._sync_queue()
+            self.db.close()
+            self.db = self._open_db()
 
 
     def remove_status(self, file_name):
         """
         从状态中删除指定文件的记录。
 
-        如果文件在状态字典中存在，则删除它，并更新文件。
-
         Args:
             file_name (str): 需要删除状态的文件名。
         """
         with self.lock:
-            if file_name in self.status:
-                del self.status[file_name]
-                self._save_status()
+            with self.db:
+                self.db.execute('DELETE FROM status WHERE path = ?', (file_name,))
+
+
+    def count(self, status):
+        """
+        Args:
+            status (str): 上传状态
+
+        Returns:
+            int: 处于该状态的文件数
+        """
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM status WHERE status = ?', (status,)).fetchone()[0]
 
 
     def _sync_queue(self):
-        '''状态为未上传的文件都提交到任务列表，会覆盖原来的任务！'''
+        '''状态为未上传的文件都提交到任务列表，队列按路径去重，已经在队列里的文件不会重复'''
         with self.lock:  # 使用互斥锁确保线程安全
+            # 只恢复到当前最后一行，之后新登记的文件由 FileChecker 自己放进队列
+            last_rowid = self.db.execute('SELECT MAX(rowid) FROM status').fetchone()[0] or 0
 
-            # 通知其他线程这边即将要开始清空：
-            self.queue.put(None)
+        if isinstance(self.queue, PendingQueue):
+            # 有界队列清空窗口后自己从库里补充，不需要一次性放进去（队列补充时会反过来拿 self.lock，不能在锁里 bind）
+            self.queue.bind(self, last_rowid)
+            self.restored.set()
+            return
 
-            # 清空当前队列
-            while not self.queue.empty():
-                self.queue.get()
-                self.queue.task_done()
+        self.restored.clear()
+        threading.Thread(target=self._restore_pending, args=(last_rowid,), name='status-restore', daemon=True).start()
 
-            # 遍历状态，找到所有“未上传”的文件
-            for filename, file_status in self.status.items():
-                if file_status == STATUS_NOT_UPLOADED or file_status == STATUS_UPLOADING:
-                    self.queue.put(filename)
 
+    def pending_after(self, rowid, limit, restore_upto=0):
+        """
+        按 rowid 顺序读取待上传的文件
 
-    def _set_status(self, file_name, status):
+        Args:
+            rowid (int): 从这个 rowid 之后开始读
+            limit (int): 最多读多少条
+            restore_upto (int): 不超过这个 rowid 的“正在上传”记录也算待上传（上次运行中断留下的）
+
+        Returns:
+            list: [(rowid, path)]
         """
-        设置指定文件的上传状态，并保存更改。
+        with self.lock:
+            return self.db.execute(
+                'SELECT rowid, path FROM status WHERE rowid > ? AND (status = ? OR (status = ? AND rowid <= ?)) '
+                'AND next_attempt <= ? ORDER BY rowid LIMIT ?',
+                (rowid, STATUS_NOT_UPLOADED, STATUS_UPLOADING, restore_upto, time.time(), limit)).fetchall()
+
+
+    def record_failure(self, file_name, retry_delay, error=None):
+        """
+        记录一次上传失败
+
+        失败次数加一后交给 retry_delay 决定多久以后重试，返回 None 表示放弃，
+        文件进入“上传失败”状态。计数和状态在一个事务里修改，期间不会被队列读出。
 
         Args:
-            file_name (str): 文件名。
-            status (str): 要设置的状态。
+            file_name (str): 上传失败的文件
+            retry_delay (callable): 失败次数 -> 重试等待秒数或者 None
+            error (str): 失败原因
+
+        Returns:
+            tuple: (失败次数, 下次重试的时间戳)，放弃时时间戳为 None
+        """
+        with self.lock:
+            row = self.db.execute('SELECT attempts FROM status WHERE path = ?', (file_name,)).fetchone()
+            if row is None:
+                raise ValueError(f"文件 '{file_name}' 的不存在。")
+            attempts = row[0] + 1
+            delay = retry_delay(attempts)
+            next_attempt = None if delay is None else time.time() + delay
+            with self.db:
+                self.db.execute(
+                    'UPDATE status SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE path = ?',
+                    (STATUS_FAILED if next_attempt is None else STATUS_NOT_UPLOADED,
+                     attempts, next_attempt or 0, error, file_name))
+            return attempts, next_attempt
+
+
+    def defer(self, file_name, until):
+        """
+        推迟一个待上传的文件，不增加失败次数
+
+        Args:
+            file_name (str): 需要推迟的文件
+            until (float): 推迟到这个时间戳之后才会被队列读出，0 表示立即
+        """
+        with self.lock:
+            with self.db:
+                self.db.execute('UPDATE status SET status = ?, next_attempt = ? WHERE path = ? AND status != ?',
+                                (STATUS_NOT_UPLOADED, until, file_name, STATUS_UPLOADED))
+
+
+    def scheduled_retries(self):
         """
-        self.status[file_name] = status
-        self._save_status()
+        Returns:
+            list: [(下次重试的时间戳, path)]，还没到时间的待重试文件
+        """
+        with self.lock:
+            return self.db.execute('SELECT next_attempt, path FROM status WHERE status = ? AND next_attempt > ?',
+                                   (STATUS_NOT_UPLOADED, time.time())).fetchall()
 
 
-    def _save_status(self):
+    def dead_letters(self):
         """
-        将当前状态保存到文件。
+        Returns:
+            list: [(path, 失败次数, 最后一次错误)]
+        """
+        with self.lock:
+            return self.db.execute('SELECT path, attempts, last_error FROM status WHERE status = ? ORDER BY rowid',
+                                   (STATUS_FAILED,)).fetchall()
+
 
-        将 status 字典写入到 JSON 文件中。
+    def redrive(self, file_names=None):
         """
-        with open(self.filename, 'w', encoding='utf-8') as file:
-            json.dump(self.status, file, indent=4, ensure_ascii=False)
+        把上传失败的文件重新放回待上传，失败次数清零
+
+        Args:
+            file_names (list): 需要重新上传的文件，默认全部
+
+        Returns:
+            int: 重新放回的文件数
+        """
+        with self.lock:
+            with self.db:
+                reset = 'UPDATE status SET status = ?, attempts = 0, next_attempt = 0, last_error = NULL WHERE status = ?'
+                if file_names is None:
+                    return self.db.execute(reset, (STATUS_NOT_UPLOADED, STATUS_FAILED)).rowcount
+                return sum(self.db.execute(f'{reset} AND path = ?', (STATUS_NOT_UPLOADED, STATUS_FAILED, name)).rowcount
+                           for name in file_names)
+
+
+    def _restore_pending(self, last_rowid):
+        '''按 rowid 分批把“未上传”“正在上传”的文件放进队列，每批只短暂持锁'''
+        cursor = 0
+        restored = 0
+        try:
+            while True:
+                with self.lock:
+                    rows = self.db.execute(
+                        'SELECT rowid, path FROM status WHERE status IN (?, ?) AND rowid > ? AND rowid <= ? '
+                        'AND next_attempt <= ? ORDER BY rowid LIMIT ?',
+                        (STATUS_NOT_UPLOADED, STATUS_UPLOADING, cursor, last_rowid, time.time(), RESTORE_BATCH)).fetchall()
+                if not rows:
+                    break
+                for rowid, path in rows:
+                    self.queue.put(path)
+                cursor = rows[-1][0]
+                restored += len(rows)
+            mainlog.info(f'已恢复 {restored} 个待上传文件到队列')
+        finally:
+            self.restored.set()
+
+
+    def _get(self, file_name):
+        row = self.db.execute('SELECT status FROM status WHERE path = ?', (file_name,)).fetchone()
+        return row[0] if row else None
+
+
+    def _set_account(self, file_names, account):
+        with self.lock:
+            with self.db:
+                self.db.executemany('UPDATE status SET account = ? WHERE path = ?',
+                                    [(account, file_name) for file_name in file_names])
 
 
-    def _load_status(self):
+    def _update(self, file_name, status):
         """
-        加载状态文件。
+        设置指定文件的上传状态，文件必须已经登记。
 
-        从 JSON 文件中读取状态数据。如果文件不存在，则返回一个空字典。
+        Args:
+            file_name (str): 文件名。
+            status (str): 要设置的状态。
+        """
+        with self.lock:
+            with self.db:
+                updated = self.db.execute('UPDATE status SET status = ? WHERE path = ?', (status, file_name)).rowcount
+            if not updated:
+                raise ValueError(f"文件 '{file_name}' 的不存在。")
+
+
+    def _open_db(self):
+        """
+        打开状态数据库，不存在时创建。
 
         Returns:
-            dict: 包含文件状态的字典。
+            sqlite3.Connection: 多个线程共用，调用方持有 self.lock。
+        """
+        db = sqlite3.connect(self.filename, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('CREATE TABLE IF NOT EXISTS status (path TEXT PRIMARY KEY, status TEXT NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS status_by_state ON status (status)')
+        # 重试、账号相关的列是后加的，旧库在这里补上
+        columns = {row[1] for row in db.execute('PRAGMA table_info(status)')}
+        for column, definition in RETRY_COLUMNS.items():
+            if column not in columns:
+                db.execute(f'ALTER TABLE status ADD COLUMN {column} {definition}')
+        db.commit()
+        return db
+
+
+    def _migrate_legacy(self):
+        """
+        迁移旧版 JSON 状态文件。
+
+        只在数据库为空时进行，迁移完成后把 JSON 文件改名为 *.migrated，避免重复迁移。
         """
-        if os.path.exists(self.filename):
-            with open(self.filename, 'r', encoding='utf-8') as file:
-                return json.load(file)
-        else:
-            return {}
\ No newline at end of file
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        if self.db.execute('SELECT 1 FROM status LIMIT 1').fetchone():
+            return
+
+        with open(self.legacy_file, 'r', encoding='utf-8') as file:
+            status = json.load(file)
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO status (path, status) VALUES (?, ?)', status.items())
+        os.replace(self.legacy_file, f'{self.legacy_file}.migrated')
+        mainlog.info(f'已把 {len(status)} 条状态从 {self.legacy_file} 迁移到 {self.filename}')
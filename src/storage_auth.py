@@ -11,12 +11,6 @@ external_path = os.path.join(project_path, 'external/baidusdk')
 src_path = os.path.join(project_path, 'src')
 sys.path.append(external_path)
 
-# 百度网盘SDK
-from openapi_client.api import auth_api
-import openapi_client
-
-
-import requests
 from urllib.parse import urlencode
 import webbrowser
 import time
@@ -24,16 +18,25 @@ import logging
 from utils import MAIN_LOG
 mainlog = logging.getLogger(MAIN_LOG)
 
-from threading import Lock
+from threading import Lock, Condition, Thread, Event
 
 MAX_REDO_FOR_ASK = 60 # 轮询的最大重复次数
 MAX_REDO = 5 # 其他API接口最大的重试次数
+TOKEN_REFRESH_MARGIN = 24 * 3600 # 距离过期还剩多少秒时提前刷新
+TOKEN_CHECK_INTERVAL = 600 # 后台线程检查 token 有效期的周期（秒）
+
+def _sdk():
+    '''需要请求授权接口时再导入百度网盘SDK'''
+    import openapi_client
+    from openapi_client.api import auth_api
+    return openapi_client, auth_api
 
 class BaiduAuth:
-    def __init__(self, cg):
+    def __init__(self, cg, account=None):
         self._update_save = cg.update_save
+        self.section = cg.account_section(account) # token 写回这个账号的区块
 
-        baidu_cloud_config = cg.get_baidu_config()
+        baidu_cloud_config = cg.get_baidu_config(account)
 
         self.app_id = baidu_cloud_config.get('app_id')
         self.app_key = baidu_cloud_config.get('app_key')
@@ -41,6 +44,7 @@ class BaiduAuth:
         self.sign_key = baidu_cloud_config.get('sign_key')
         self.access_token = baidu_cloud_config.get('access_token')
         self.refresh_token = baidu_cloud_config.get('refresh_token')
+        self.expires_at = baidu_cloud_config.get('token_expires_at') # 0 表示不知道什么时候过期
         self.auth_moded = baidu_cloud_config.get('auth_mode')
 
         self.auth_lock = Lock()
@@ -111,6 +115,7 @@ class BaiduAuth:
             interval (int) : 轮询间隔（秒）
         '''
         mainlog.debug(f'执行_get_device_code')
+        openapi_client, auth_api = _sdk()
         with openapi_client.ApiClient() as api_client:
             # Create an instance of the API class
             api_instance = auth_api.AuthApi(api_client)
@@ -162,6 +167,7 @@ class BaiduAuth:
         '''
         mainlog.debug(f'开始轮询获取Access Token')
 
+        openapi_client, auth_api = _sdk()
         with openapi_client.ApiClient() as api_client:
             # Create an instance of the API class
             api_instance = auth_api.AuthApi(api_client)
@@ -179,6 +185,7 @@ class BaiduAuth:
                 if 'access_token' in api_response:
                     self.access_token = api_response.get('access_token')
                     self.refresh_token = api_response.get('refresh_token')
+                    self._set_expires(api_response.get('expires_in'))
                     mainlog.info(f'成功获取 Access Token ')
                     return
                 
@@ -207,6 +214,7 @@ class BaiduAuth:
         
         '''
         mainlog.debug(f'执行_refresh_token')
+        openapi_client, auth_api = _sdk()
         with openapi_client.ApiClient() as api_client:
             # Create an instance of the API class
             api_instance = auth_api.AuthApi(api_client)
@@ -220,6 +228,7 @@ class BaiduAuth:
 
                 self.access_token = api_response.get('access_token')
                 self.refresh_token = api_response.get('refresh_token')
+                self._set_expires(api_response.get('expires_in'))
 
                 mainlog.info(f'第{len(redo)}次 device token 请求成功{self.access_token}')
                 self._update_key()
@@ -239,12 +248,20 @@ class BaiduAuth:
 
 
 
+    def _set_expires(self, expires_in):
+        '''根据接口返回的 expires_in（秒）记录过期时间'''
+        if expires_in:
+            self.expires_at = time.time() + int(expires_in)
+        else:
+            self.expires_at = 0
+
     def _update_key(self):
         mainlog.debug(f'正在更新 Tokens')
-        section = 'BaiduCloud'
+        section = self.section
         updates = {
             'accesstoken' : self.access_token,
             'refreshtoken' : self.refresh_token,
+            'tokenexpiresat' : str(int(self.expires_at)),
         }
 
         return self._update_save(section, updates)
@@ -284,4 +301,156 @@ class BaiduAuth:
         
         except:
             mainlog.debug('Auth 无法自我修复')
-            raise Exception(f'error:{error}\nerrmsg:{errmsg}\nrequest_id:{request_id}')
\ No newline at end of file
+            raise Exception(f'error:{error}\nerrmsg:{errmsg}\nrequest_id:{request_id}')
+
+
+class TokenProvider:
+    '''
+    进程内共享的 token 提供者
+
+    所有上传器共用同一个 `BaiduAuth`，不再每个文件新建一次。记录 token 的过期时间，
+    后台线程在过期前 `TOKEN_REFRESH_MARGIN` 秒主动刷新；多个线程同时发现 token
+    失效时只有一个真正去刷新，其他线程等它的结果（single-flight）。
+
+    Args:
+        cg (Config) : 配置管理器
+        auth (BaiduAuth) : 授权实现，默认按配置创建
+        account (str) : 百度网盘账号，默认是 [BaiduCloud]
+
+    Methods:
+        get_token() : 给出一个当前可用的 token，已经过期时等待刷新完成
+        renew_token(stale_token) : 刷新 token，返回新 token
+        start() : 启动后台的提前刷新线程
+        stop() : 停止后台线程
+    '''
+    def __init__(self, cg, auth=None, account=None):
+        self.auth = auth or BaiduAuth(cg, account)
+        self._cond = Condition()
+        self._refreshing = False
+        self._last_error = None
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def expires_at(self):
+        return self.auth.expires_at
+
+    def get_token(self):
+        '''给出一个当前可用的 token'''
+        token = self.auth.access_token
+        if token == '' or self._expired():
+            mainlog.debug('token 为空或已经过期，等待刷新')
+            return self.renew_token(token)
+
+        if self._expiring():
+            # 快过期了但还能用，交给后台刷新，本次调用不等待
+            self._refresh_in_background(token)
+        return token
+
+    def renew_token(self, stale_token=None):
+        '''
+        刷新 token，并发调用只会真正刷新一次
+
+        Args:
+            stale_token (str) : 调用方手上已经失效的 token。如果当前 token 已经不是它，
+                说明别的线程刷新过了，直接返回当前 token
+
+        Returns:
+            str : 新的 token
+        '''
+        with self._cond:
+            if stale_token is not None and stale_token != self.auth.access_token and self.auth.access_token != '':
+                return self.auth.access_token
+
+            if self._refreshing:
+                mainlog.debug('已有线程在刷新 token，等待结果')
+                while self._refreshing:
+                    self._cond.wait()
+                if self._last_error:
+                    raise Exception(f'获取新token失败{self._last_error}')
+                return self.auth.access_token
+
+            self._refreshing = True
+
+        error = None
+        try:
+            if self.auth.access_token == '':
+                self.auth.get_token() # 没有 token，走完整授权流程
+            else:
+                self.auth.renew_token()
+        except Exception as e:
+            error = e
+        finally:
+            with self._cond:
+                self._refreshing = False
+                self._last_error = error
+                self._cond.notify_all()
+
+        if error:
+            raise error
+        mainlog.info('token 已刷新')
+        return self.auth.access_token
+
+    def start(self):
+        '''启动后台的提前刷新线程'''
+        if self._thread is None:
+            self._thread = Thread(target=self._refresh_loop, name='token-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _expired(self):
+        return self.auth.expires_at and time.time() >= self.auth.expires_at
+
+    def _expiring(self):
+        return self.auth.expires_at and time.time() >= self.auth.expires_at - TOKEN_REFRESH_MARGIN
+
+    def _refresh_in_background(self, stale_token):
+        with self._cond:
+            if self._refreshing:
+                return
+        Thread(target=self._safe_renew, args=(stale_token,), name='token-renew', daemon=True).start()
+
+    def _safe_renew(self, stale_token):
+        '''
+        提前刷新发现快过期时的那个 token
+
+        同一时间发现快过期的线程会起好几个后台刷新，后面的开始时前面的可能已经刷新完了，
+        这时 token 已经换过或者不再快过期，直接返回，不再刷新一次把 refresh token 作废
+        '''
+        with self._cond:
+            if self.auth.access_token != stale_token or not self._expiring():
+                return
+        try:
+            self.renew_token(stale_token)
+        except Exception as e:
+            mainlog.info(f'后台刷新 token 失败，稍后重试: {e}')
+
+    def _refresh_loop(self):
+        while not self._stop.wait(TOKEN_CHECK_INTERVAL):
+            token = self.auth.access_token
+            if self._expiring():
+                mainlog.debug('token 即将过期，后台提前刷新')
+                self._safe_renew(token)
+
+
+_providers = {}
+_providers_lock = Lock()
+
+def get_token_provider(cg, account=None):
+    '''
+    按配置文件和账号取进程内共享的 `TokenProvider`，第一次调用时创建并启动后台刷新
+
+    Args:
+        cg (Config) : 配置管理器
+        account (str) : 百度网盘账号，默认是 [BaiduCloud]
+    '''
+    key = (cg.filename, cg.account_section(account))
+    with _providers_lock:
+        provider = _providers.get(key)
+        if provider is None:
+            provider = TokenProvider(cg, account=account)
+            provider.start()
+            _providers[key] = provider
+        return provider
@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import threading
+import concurrent.futures
+import urllib.request
+import urllib.error
+from urllib.parse import urlencode
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+DEFAULT_UPLOAD_HOST = 'https://d.pcs.baidu.com'
+LOCATE_UPLOAD_URL = 'https://d.pcs.baidu.com/rest/2.0/pcs/file'
+LOCATE_UPLOAD_APPID = 250528
+
+PROBE_BYTES = 64 * 1024 # 测速时上传的字节数
+PART_BYTES = 4 * 1024 * 1024 # 排名时按一个分片的大小估算耗时
+EWMA_ALPHA = 0.3 # 实际上传速度的平滑系数
+
+
+class ScoredTarget:
+    '''
+    按实测速度打分的分片上传目标（上传服务器或者本机出口地址）
+
+    Attributes:
+        latency : 往返延迟（秒）
+        throughput : 上传速度（字节/秒），之后按实际分片上传平滑更新
+        failures : 连续失败次数，成功一次减一
+        inflight : 正在上传的分片数
+    '''
+    def __init__(self, latency=None, throughput=None):
+        self.latency = latency
+        self.throughput = throughput
+        self.failures = 0
+        self.inflight = 0
+
+    def expected_seconds(self, nbytes=PART_BYTES, default_throughput=1.0):
+        '''估算上传 nbytes 需要的时间，还没测到速度的按 default_throughput 算，失败越多估得越慢'''
+        latency = self.latency if self.latency is not None else 1.0
+        throughput = self.throughput or default_throughput
+        return (latency + nbytes / throughput) * (1 + self.failures)
+
+    def record(self, nbytes, seconds, ok):
+        '''记下一次分片上传的结果'''
+        self.inflight = max(0, self.inflight - 1)
+        if not ok:
+            self.failures += 1
+            return
+        self.failures = max(0, self.failures - 1)
+        if seconds > 0 and nbytes > 0:
+            measured = nbytes / seconds
+            if self.throughput is None:
+                self.throughput = measured
+            else:
+                self.throughput = EWMA_ALPHA * measured + (1 - EWMA_ALPHA) * self.throughput
+
+
+class UploadHost(ScoredTarget):
+    '''
+    一个上传服务器的测速结果，速度先用测速结果
+
+    Attributes:
+        url : 服务器地址，如 https://c3.pcs.baidu.com
+    '''
+    def __init__(self, url, latency=None, throughput=None):
+        super().__init__(latency, throughput)
+        self.url = url
+
+
+class SourceAddress(ScoredTarget):
+    '''
+    一个本机出口地址，不测延迟，速度全部来自实际分片上传
+
+    Attributes:
+        address : 本地 IP 地址
+    '''
+    def __init__(self, address):
+        super().__init__(latency=0)
+        self.address = address
+
+
+class ScoredSelector:
+    '''
+    按「排队分片数 × 预计耗时」最小分配分片的选择器
+
+    每个分片上传前 `pick()` 一个目标，上传完用 `report()` 回报实际速度，快的目标分到更多分片。
+    还没测到速度的目标按当前最快的估算，保证每个目标都会被试到。子类实现 `_targets()`，
+    返回 key -> `ScoredTarget`，没有目标时 `pick()` 返回 `_fallback()`。
+
+    Methods:
+        pick() : 选一个目标，调用方上传结束后必须 `report()`
+        report(key, nbytes, seconds, ok) : 回报一次分片上传的结果
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def pick(self):
+        with self.lock:
+            targets = self._targets()
+            if not targets:
+                return self._fallback()
+            best = max((t.throughput for t in targets.values() if t.throughput), default=1.0)
+            key, target = min(targets.items(),
+                              key=lambda item: (item[1].inflight + 1) * item[1].expected_seconds(default_throughput=best))
+            target.inflight += 1
+            return key
+
+    def report(self, key, nbytes, seconds, ok):
+        '''
+        回报一次分片上传
+
+        Args:
+            key : `pick()` 返回的目标
+            nbytes (int) : 上传字节数
+            seconds (float) : 耗时
+            ok (bool) : 是否成功
+        '''
+        with self.lock:
+            target = self._targets().get(key)
+            if target is not None:
+                target.record(nbytes, seconds, ok)
+
+    def _targets(self):
+        raise NotImplementedError
+
+    def _fallback(self):
+        return None
+
+
+class UploadHostSelector(ScoredSelector):
+    '''
+    上传服务器选择器
+
+    通过 locateupload 接口拿到候选上传服务器，测延迟和速度后保留最快的几台。
+    分片按 `ScoredSelector` 的规则分配，快的服务器自然分到更多分片，排名随实际速度更新。
+    发现或测速失败时退回默认的 d.pcs.baidu.com。
+
+    Args:
+        default_host (str) : 默认上传服务器
+        locate_url (str) : locateupload 接口地址
+        static_hosts (list) : 手动指定的服务器，设置后不再请求 locateupload
+        discovery (bool) : 是否启用服务器发现
+        max_hosts (int) : 最多同时使用几台服务器
+        refresh_interval (int) : 重新发现、测速的间隔（秒）
+        probe_timeout (float) : 测速请求的超时（秒）
+
+    Methods:
+        discover(access_token, path, uploadid) : 按需发现、测速（已发现且未过期时直接返回）
+        pick() : 选一台服务器上传分片
+        report(url, nbytes, seconds, ok) : 回报一次分片上传的结果
+        ranking() : 当前排名
+    '''
+    def __init__(self, default_host=DEFAULT_UPLOAD_HOST, locate_url=LOCATE_UPLOAD_URL, static_hosts=None,
+                 discovery=True, max_hosts=3, refresh_interval=1800, probe_timeout=5):
+        self.default_host = default_host
+        self.locate_url = locate_url
+        self.static_hosts = list(static_hosts or [])
+        self.discovery = discovery
+        self.max_hosts = max(1, max_hosts)
+        self.refresh_interval = refresh_interval
+        self.probe_timeout = probe_timeout
+
+        super().__init__()
+        self.hosts = {} # url -> UploadHost
+        self.discovered_at = 0
+        self._discover_lock = threading.Lock()
+
+    def discover(self, access_token, path, uploadid, force=False):
+        '''
+        发现并测速上传服务器，同一时间只有一个线程在做，其他线程直接用当前结果
+
+        Args:
+            access_token (str) : 用户 token
+            path (str) : 本次上传的网盘路径
+            uploadid (str) : 预上传拿到的 uploadid
+            force (bool) : 忽略刷新间隔
+        '''
+        if not (self.discovery or self.static_hosts):
+            return
+        # 上次发现失败（discovered_at 已设置但没有服务器）时也不重复测速，刷新间隔内用默认服务器
+        if not force and self.discovered_at and time.time() - self.discovered_at < self.refresh_interval:
+            return
+        if not self._discover_lock.acquire(blocking=not self.discovered_at):
+            return # 已经有线程在刷新，先用旧的排名
+        try:
+            if not force and self.discovered_at and time.time() - self.discovered_at < self.refresh_interval:
+                return
+
+            urls = self.static_hosts
+            if not urls:
+                try:
+                    urls = self.locate(access_token, path, uploadid)
+                except Exception as e:
+                    mainlog.warning(f'获取上传服务器列表失败，使用默认服务器: {e}')
+                    urls = []
+            if self.default_host not in urls:
+                urls = urls + [self.default_host]
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(urls))) as executor:
+                probed = [h for h in executor.map(self.probe, urls) if h is not None]
+            probed.sort(key=lambda h: h.expected_seconds())
+            best = probed[:self.max_hosts]
+            if not best:
+                with self.lock:
+                    self.hosts = {}
+                    self.discovered_at = time.time()
+                mainlog.warning(f'上传服务器全部测速失败，{self.refresh_interval} 秒内使用默认服务器 {self.default_host}')
+                return
+
+            with self.lock:
+                for host in best:
+                    old = self.hosts.get(host.url)
+                    if old is not None:
+                        host.inflight = old.inflight
+                self.hosts = {host.url: host for host in best}
+                self.discovered_at = time.time()
+
+            mainlog.info('上传服务器排名: ' + ', '.join(
+                f'{url}({seconds:.2f}s/分片)' for url, seconds in self.ranking()))
+        finally:
+            self._discover_lock.release()
+
+    def locate(self, access_token, path, uploadid):
+        '''
+        请求 locateupload 接口
+
+        Returns:
+            list : 上传服务器地址，servers 在前、bak_servers 在后
+        '''
+        query = urlencode({
+            'method': 'locateupload',
+            'appid': LOCATE_UPLOAD_APPID,
+            'access_token': access_token,
+            'path': path,
+            'uploadid': uploadid,
+            'upload_version': '2.0',
+        })
+        with urllib.request.urlopen(f'{self.locate_url}?{query}', timeout=self.probe_timeout) as resp:
+            data = json.loads(resp.read())
+        if data.get('error_code'):
+            raise Exception(data)
+
+        urls = []
+        for item in data.get('servers', []) + data.get('bak_servers', []):
+            server = item.get('server', '').rstrip('/')
+            if not server:
+                continue
+            if '://' not in server:
+                server = f'https://{server}'
+            if server not in urls:
+                urls.append(server)
+        mainlog.debug(f'locateupload 返回 {len(urls)} 个服务器')
+        return urls
+
+    def probe(self, url):
+        '''
+        测一台服务器的延迟和上传速度
+
+        先发一个空请求测延迟，再上传 PROBE_BYTES 字节测速度。接口返回错误码也算连通，
+        连接失败、超时的服务器不参与排名。
+
+        Returns:
+            UploadHost or None
+        '''
+        probe_url = f'{url}/rest/2.0/pcs/superfile2?method=upload'
+        try:
+            latency = self._timed_request(probe_url, None)
+            elapsed = self._timed_request(probe_url, os.urandom(PROBE_BYTES))
+        except Exception as e:
+            mainlog.debug(f'上传服务器 {url} 测速失败: {e}')
+            return None
+        throughput = PROBE_BYTES / max(elapsed - latency, 1e-3)
+        mainlog.debug(f'上传服务器 {url} 延迟 {latency * 1000:.0f}ms 速度 {throughput / 1024:.0f}KB/s')
+        return UploadHost(url, latency, throughput)
+
+    def ranking(self):
+        '''
+        Returns:
+            list : [(url, 预计每个分片耗时)]，快的在前
+        '''
+        with self.lock:
+            hosts = sorted(self.hosts.values(), key=lambda h: h.expected_seconds())
+            return [(h.url, h.expected_seconds()) for h in hosts]
+
+    def _targets(self):
+        return self.hosts
+
+    def _fallback(self):
+        return self.default_host
+
+    def _timed_request(self, url, data):
+        start = time.monotonic()
+        request = urllib.request.Request(url, data=data, method='POST' if data else 'GET')
+        if data:
+            request.add_header('Content-Type', 'application/octet-stream')
+        try:
+            with urllib.request.urlopen(request, timeout=self.probe_timeout) as resp:
+                resp.read()
+        except urllib.error.HTTPError as e:
+            e.read() # 服务器有回应，只是参数不对
+        return time.monotonic() - start
+
+
+class SourceAddressSelector(ScoredSelector):
+    '''
+    本机出口地址选择器
+
+    机器有多条上行线路（不同网卡、不同运营商）时，把分片上传的连接绑定到各自的本地地址，
+    让几条线路同时跑满。和 `UploadHostSelector` 一样按 `ScoredSelector` 的规则分配分片，
+    快的线路分到更多分片。
+
+    Args:
+        addresses (list) : 本地 IP 地址
+
+    Methods:
+        pick() : 选一个本地地址上传分片
+        report(address, nbytes, seconds, ok) : 回报一次分片上传的结果
+        ranking() : 当前各地址的速度
+    '''
+    def __init__(self, addresses):
+        super().__init__()
+        self.addresses = {address: SourceAddress(address) for address in addresses}
+
+    def ranking(self):
+        '''
+        Returns:
+            list : [(本地地址, 上传速度 字节/秒)]，没测到速度的为 None
+        '''
+        with self.lock:
+            return [(a.address, a.throughput) for a in self.addresses.values()]
+
+    def _targets(self):
+        return self.addresses
+
+
+_selectors = {}
+_selectors_lock = threading.Lock()
+_source_selectors = {}
+
+def get_upload_host_selector(config):
+    '''
+    获取配置文件对应的上传服务器选择器，同一个进程内共享
+
+    Args:
+        config (Config) : 配置管理器
+
+    Returns:
+        UploadHostSelector
+    '''
+    with _selectors_lock:
+        selector = _selectors.get(config.filename)
+        if selector is None:
+            upload_config = config.get_upload_config()
+            static_hosts = [h.strip().rstrip('/') for h in upload_config.get('upload_hosts').split(',') if h.strip()]
+            selector = UploadHostSelector(
+                static_hosts=static_hosts,
+                discovery=upload_config.get('host_discovery'),
+                max_hosts=upload_config.get('max_upload_hosts'),
+                refresh_interval=upload_config.get('host_refresh_interval'),
+            )
+            _selectors[config.filename] = selector
+        return selector
+
+
+def get_source_address_selector(config):
+    '''
+    获取配置文件对应的本机出口地址选择器，同一个进程内共享
+
+    Args:
+        config (Config) : 配置管理器
+
+    Returns:
+        SourceAddressSelector or None : 没有配置 sourceaddresses 时为 None，连接不绑定地址
+    '''
+    with _selectors_lock:
+        if config.filename not in _source_selectors:
+            addresses = config.get_upload_config().get('source_addresses')
+            addresses = [a.strip() for a in addresses.split(',') if a.strip()]
+            _source_selectors[config.filename] = SourceAddressSelector(addresses) if addresses else None
+        return _source_selectors[config.filename]
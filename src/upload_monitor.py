@@ -1,14 +1,75 @@
 import sys
 sys.path.append('src')
 from file_uploader import *
-from threading import Thread
-from queue import Empty
+from async_uploader import AsyncBaiduCloudUploader, get_async_engine
+from process_uploader import ProcessBaiduCloudUploader, get_process_engine
+from bundler import Bundle, SmallFileBundler
+from retry_scheduler import RetryPolicy, RetryScheduler
+from upload_verifier import UploadVerifier
+from quota import QuotaGate
+from accounts import AccountPool
+from fanout import FanOut
+from node_coordinator import NodeCoordinator
+from hedging import get_hedger
+from threading import Thread, Lock, Semaphore
+from queue import Queue, Empty
+import concurrent.futures
+import time
 
 import logging
 from utils import MAIN_LOG, shutdown_event
 mainlog = logging.getLogger(MAIN_LOG)
 
 
+class PipelineStats:
+    '''
+    流水线各阶段的计数器
+
+    用来回答“现在卡在哪一步”：排队多说明上传跟不上，就绪为 0 且准备中满了说明
+    哈希/预上传跟不上。
+
+    Attributes:
+        preparing : 正在计算哈希、切片、预上传的文件数
+        ready : 已经准备好、等待上传分片的文件数
+        uploading : 正在上传分片、创建文件的文件数
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.preparing = 0
+        self.ready = 0
+        self.uploading = 0
+        self.busy_seconds = {'prepare': 0.0, 'transfer': 0.0}
+
+    def move(self, from_stage=None, to_stage=None):
+        '''把一个文件从一个阶段挪到另一个阶段'''
+        with self.lock:
+            if from_stage:
+                setattr(self, from_stage, getattr(self, from_stage) - 1)
+            if to_stage:
+                setattr(self, to_stage, getattr(self, to_stage) + 1)
+
+    def add_busy(self, stage, seconds):
+        with self.lock:
+            self.busy_seconds[stage] += seconds
+
+    def snapshot(self, queued):
+        '''
+        各阶段队列深度
+
+        Args:
+            queued (int) : 上传任务队列中还在排队的数量
+        '''
+        with self.lock:
+            return {
+                'queued': queued,
+                'preparing': self.preparing,
+                'ready': self.ready,
+                'uploading': self.uploading,
+                'prepare_busy': round(self.busy_seconds['prepare'], 1),
+                'transfer_busy': round(self.busy_seconds['transfer'], 1),
+            }
+
+
 class UploadMonitor:
     '''
     用来监控管理上传任务队列的类
@@ -16,8 +77,40 @@ class UploadMonitor:
     持续监控上传任务队列里面的任务情况，从队列中提取出一个上传任务，然后
     顺便更新一下任务的状态，随后交给上传工具进行上传。
 
+    流水线模式（`pipelinedepth` > 0）下，后台线程会提前把后面的文件做完哈希、
+    切片和预上传，上传线程只负责传分片和创建文件，链路不会因为算哈希而空闲。
+
+    `engine = asyncio` 时使用 `AsyncBaiduCloudUploader`，传输阶段不再阻塞在单个文件上，
+    最多同时挂 `concurrentfiles` 个文件的分片请求在同一个事件循环上；其他取值使用
+    线程池版本的 `BaiduCloudUploader`。`engine = process` 时每个文件交给 `ProcessUploadEngine`
+    的子进程完整上传，状态库、队列和重试留在主进程，最多同时传 `processes` 个文件。
+
+    开启小文件打包（`[Bundle] enabled`）后，小于阈值的文件先进打包器，按目录攒够
+    时间窗口后打成一个 tar 包上传，包提交成功后包内文件一起标记为已上传。
+
+    从队列取出的文件一直持有租约，直到上传成功或者失败交给重试调度器，打进包里的文件
+    跟着包一起结束。进入传输阶段时续一次租约。失败的文件按指数退避延迟重试，次数用完后
+    标记为上传失败，不再自动重试。
+
+    百度网盘接口大面积失败时熔断器断开，准备和传输阶段都停在取任务之前，不再哈希、
+    切片和请求接口，直到探测到服务恢复。
+
+    配置了多个百度网盘账号时，`AccountPool` 按目录或者大小把文件分到各个账号，每个账号
+    有自己的 token 和并发额度，状态库记录文件上传到了哪个账号。
+
+    几台机器共用同一个待上传目录时，`NodeCoordinator` 在共享目录上按租约领取文件，
+    别的机器正在传或者已经传完的文件不会再传一遍。
+
+    网盘剩余空间放不下的文件在哈希之前就被 `QuotaGate` 推迟，空间够了以后小文件先回到队列。
+
+    配置了 `[FanOut] destinations` 时，`FanOut` 在计算 md5 时把读到的数据同时写给其他
+    目的地（USB 归档盘等），每个目的地有自己的状态库和重试，不影响百度网盘这边的上传。
+
+    上传成功的文件把 fs_id 交给 `UploadVerifier`，后台批量核对网盘上的大小和 md5，
+    对不上的文件按一次失败重新上传，上传线程不等核对结果。
+
     Args:
-        file_queue (Queue) : 需要监控的队列
+        file_queue (PendingQueue) : 需要监控的队列
         status_manager (StatusManager) : 任务状态管理器
         config (Config) : 配置管理器
         uploader (Uploader): 上传工具，默认是百度网盘`BaiduCloudUploader`
@@ -25,57 +118,406 @@ class UploadMonitor:
     Methods:
         start_monitor(): 启动监控线程，开始处理上传任务。
         stop_monitoring(): 发送停止信号，停止监控线程。
+        stage_depths(): 流水线各阶段的队列深度
     '''
     def __init__(self, file_queue, status_manager, config):
         self.file_queue = file_queue # 任务列表
         self.status_manager = status_manager # 状态管理器
         self.config = config # 配置文件管理器
-        self._stop_monitoring = False # 
+        self._stop_monitoring = False #
         # self.uploader = uploader
+        self.uploader = None # 正在上传的上传器
+
+        upload_config = config.get_upload_config()
+        self.pipeline_depth = max(0, upload_config.get('pipeline_depth'))
+        self.stage_report_interval = upload_config.get('stage_report_interval')
+
+        self.uploader_class = BaiduCloudUploader
+        self.concurrent_files = 1
+        if upload_config.get('engine') == 'asyncio':
+            try:
+                get_async_engine(config)
+                self.uploader_class = AsyncBaiduCloudUploader
+                self.concurrent_files = max(1, upload_config.get('concurrent_files'))
+            except Exception as e:
+                mainlog.info(f'asyncio 上传引擎启动失败，使用线程池上传: {e}')
+        elif upload_config.get('engine') == 'process':
+            try:
+                self.concurrent_files = get_process_engine(config).processes
+                self.uploader_class = ProcessBaiduCloudUploader
+            except Exception as e:
+                mainlog.info(f'多进程上传引擎启动失败，使用线程池上传: {e}')
+        elif upload_config.get('engine') != 'thread':
+            mainlog.info(f"未知的上传引擎 {upload_config.get('engine')}，使用线程池上传")
+
+        self.stats = PipelineStats()
+        self.ready_queue = Queue() # 已经完成预上传的上传器
+        # 准备中 + 就绪 的文件总数不超过流水线深度，避免提前切出大量分片占用磁盘
+        self._slots = Semaphore(max(1, self.pipeline_depth))
+        self._prepare_threads = []
+
+        self.bundler = SmallFileBundler(config)
+        self.retry = RetryScheduler(file_queue, status_manager, RetryPolicy(config.get_retry_config()))
+        self.verifier = UploadVerifier(config, self.retry)
+        self.accounts = AccountPool(config, status_manager)
+        self.quotas = {account: QuotaGate(config, status_manager, file_queue, account=account)
+                       for account in self.accounts.accounts}
+        self.fanout = FanOut(config)
+        self.coordinator = NodeCoordinator(config, status_manager, file_queue)
+        self.breaker = get_api_breaker(config)
+        self.hedger = get_hedger(config)
 
     def start_monitor(self):
-        self.upload_monitor_thread = Thread(target=self._upload_files)
+        self.retry.start()
+        self.verifier.start()
+        self.fanout.start()
+        self.coordinator.start()
+        for quota in self.quotas.values():
+            quota.start()
+        if self.pipeline_depth > 0:
+            for i in range(self.pipeline_depth):
+                t = Thread(target=self._prepare_files, name=f'prepare-{i}')
+                t.start()
+                self._prepare_threads.append(t)
+            target = self._transfer_files
+        else:
+            target = self._upload_files
+
+        self.upload_monitor_thread = Thread(target=target)
         self.upload_monitor_thread.start()
 
     def stop_monitoring(self):
         self._stop_monitor = True
 
+    def stage_depths(self):
+        '''
+        流水线各阶段的队列深度
+
+        Returns:
+            dict : queued / preparing / ready / uploading 以及两个阶段累计的忙碌秒数
+        '''
+        return self.stats.snapshot(self.file_queue.qsize())
+
+    def bottleneck(self):
+        '''根据当前各阶段深度粗略判断瓶颈阶段'''
+        depths = self.stage_depths()
+        if depths['ready'] > 0:
+            return 'transfer' # 有准备好的文件在等，说明传输跟不上
+        if depths['queued'] > 0 or depths['preparing'] > 0:
+            return 'prepare' # 传输线程在等准备阶段
+        return 'idle'
+
+    def _report_stages(self, last_report):
+        '''按周期输出各阶段深度，返回本次输出时间'''
+        now = time.monotonic()
+        if now - last_report < self.stage_report_interval:
+            return last_report
+
+        d = self.stage_depths()
+        h = self.hedger.snapshot()
+        r = rapid_upload_savings.snapshot()
+        c = server_copy_savings.snapshot()
+        v = self.verifier
+        mainlog.info(
+            f"流水线 排队:{d['queued']} 准备中:{d['preparing']} 就绪:{d['ready']} 上传中:{d['uploading']} "
+            f"瓶颈:{self.bottleneck()} 分片对冲:{h['hedged']} 对冲先完成:{h['hedge_won']} "
+            f"秒传:{r['files']}个/{r['bytes'] / 1024 / 1024:.1f}MB "
+            f"网盘内复制:{c['files']}个/{c['bytes'] / 1024 / 1024:.1f}MB "
+            f"待核对:{v.pending()} 核对失败:{v.mismatched} 等待网盘空间:{sum(q.deferred() for q in self.quotas.values())} "
+            f"其他目的地待写入:{self.fanout.pending()}")
+        return now
+
+    def _handle_result(self, task, uploaded, uploader=None, error=None):
+        '''处理上传结果'''
+        if isinstance(task, Bundle):
+            return self._handle_bundle_result(task, uploaded, uploader, error)
+
+        self._settle([task], uploaded, uploader)
+        if uploaded:
+            self.status_manager.set_uploaded(task, uploader.account)
+            self.file_queue.done(task)
+            self._verify_later([task], uploader)
+        else:
+            self._retry_later(task, error)
+
+    def _handle_bundle_result(self, bundle, uploaded, uploader, error=None):
+        '''处理打包上传的结果，包内文件一起成功或一起安排重试'''
+        self._settle(bundle.members, uploaded, uploader)
+        if uploaded:
+            self.bundler.commit(bundle, uploader.upload_path)
+            self.status_manager.set_uploaded_many(bundle.members, uploader.account)
+            for member in bundle.members:
+                self.file_queue.done(member)
+            self._verify_later(bundle.members, uploader)
+            mainlog.info(f'{bundle} 上传完成')
+        else:
+            for member in bundle.members:
+                self._retry_later(member, error or f'{bundle} 上传失败')
+
+        self.bundler.remove(bundle)
+
+    def _verify_later(self, members, uploader):
+        '''把刚上传成功的文件交给后台核对，网盘内复制没有 fs_id 的不核对'''
+        if uploader is not None:
+            self.verifier.submit(uploader.fs_id, members, uploader.file, uploader.codec, uploader.upload_path,
+                                 uploader.account)
+
+    def _admit(self, task):
+        '''领取文件并分给一个账号，别的机器在传或者账号的网盘空间放不下时推迟'''
+        if not self.coordinator.admit(task):
+            return False
+        account = self.accounts.account_for(task)
+        if self.quotas[account].admit(task):
+            return True
+        self.accounts.forget(task)
+        self.coordinator.release(task)
+        return False
+
+    def _settle(self, files, uploaded, uploader):
+        '''结算网盘空间，归还账号的并发额度和多机协调的租约'''
+        for file_path in files:
+            self.quotas[self.accounts.account_for(file_path)].settle(file_path, uploaded)
+            self.accounts.forget(file_path)
+            self.coordinator.finish(file_path, uploaded)
+        if uploader is not None:
+            self.accounts.release(uploader.account)
+
+    def _retry_later(self, file_path, error=None):
+        '''记录失败并交给重试调度器，之后释放租约'''
+        self.retry.failed(file_path, error or '上传失败')
+        self.file_queue.done(file_path)
+
+    def _make_uploader(self, task):
+        '''
+        为普通文件或者打包好的 Bundle 创建上传器，占用分配到的账号的一个并发额度
+
+        同时把文件交给其他目的地：普通文件读一遍算 md5 时顺便写入，包内文件排队单独写入
+        '''
+        account = self.accounts.account_for(task.members[0] if isinstance(task, Bundle) else task)
+        if not self.accounts.acquire(account):
+            raise Exception('程序正在退出')
+        try:
+            if isinstance(task, Bundle):
+                self.fanout.enqueue(task.members)
+                return self.uploader_class(task.bundle_path, self.config, upload_relpath=task.upload_relpath,
+                                           account=account)
+            uploader = self.uploader_class(task, self.config, account=account)
+            self.fanout.tee(uploader.file)
+            return uploader
+        except Exception:
+            self.accounts.release(account)
+            raise
+
+    def _take_bundle(self):
+        '''
+        取出一个到期的打包分组
+
+        没打进包的文件和空包直接交回队列，此时返回 None
+        '''
+        bundle = self.bundler.pop_due()
+        if bundle is None:
+            return None
+
+        # 没打进包的文件结算预留的空间和租约，交给重试调度器
+        self._settle(bundle.failed, False, None)
+        for file_path in bundle.failed:
+            self._retry_later(file_path, '打包失败')
+
+        if not bundle.members:
+            self.bundler.remove(bundle)
+            return None
+
+        self._assign_bundle(bundle)
+        return bundle
+
+    def _assign_bundle(self, bundle):
+        '''包上传到第一个文件的账号，其他文件也改分到这个账号，预留的网盘空间跟着挪过去'''
+        account = self.accounts.account_for(bundle.members[0])
+        for member in bundle.members[1:]:
+            previous = self.accounts.account_for(member)
+            if previous != account:
+                self.quotas[previous].move(member, self.quotas[account])
+        self.accounts.assign(bundle.members, account)
+        return account
+
+    def _bundle_task(self, task):
+        '''小文件交给打包器，返回是否已经接手（租约留到包上传结束）'''
+        if not self.bundler.accepts(task):
+            return False
+
+        self.status_manager.set_uploading(task)
+        self.bundler.add(task)
+        return True
+
+    def _prepare_files(self):
+        '''流水线的准备阶段：哈希、切片、预上传'''
+        while not shutdown_event.is_set():
+            if not self._slots.acquire(timeout=5):
+                continue
+            if not self.breaker.wait(timeout=5):
+                self._slots.release()
+                continue
+
+            task = self._take_bundle()
+            if task is None:
+                try:
+                    task = self.file_queue.get(timeout=5)
+                except Empty:
+                    self._slots.release()
+                    continue
+
+                if not self._admit(task) or self._bundle_task(task):
+                    self._slots.release()
+                    continue
+
+                mainlog.debug(f'设置任务状态为正在上传')
+                self.status_manager.set_uploading(task)
+
+            self.stats.move(to_stage='preparing')
+            start = time.monotonic()
+            uploader = None
+            try:
+                uploader = self._make_uploader(task)
+                uploader.prepare()
+            except Exception as e:
+                mainlog.info(f'准备上传 {task} 失败: {e}')
+                self.stats.move(from_stage='preparing')
+                self._slots.release()
+                self._handle_result(task, False, uploader, e)
+                continue
+            finally:
+                self.stats.add_busy('prepare', time.monotonic() - start)
+
+            self.stats.move('preparing', 'ready')
+            self.ready_queue.put((task, uploader))
+
+    def _transfer_files(self):
+        '''流水线的传输阶段：分片上传、创建文件'''
+        mainlog.info(f'开始监控上传任务（流水线深度 {self.pipeline_depth}）')
+        last_report = time.monotonic()
+        inflight = {} # asyncio 引擎下同时在传的文件 future -> (task, uploader, 开始时间)
+        while not shutdown_event.is_set():
+            last_report = self._report_stages(last_report)
+
+            # 熔断期间不开始新的传输，已经在传的文件继续收尾
+            if len(inflight) < self.concurrent_files and self.breaker.wait(timeout=0 if inflight else 5):
+                try:
+                    task, uploader = self.ready_queue.get(timeout=0.1 if inflight else 5)
+                except Empty:
+                    task = None
+                    if not inflight:
+                        mainlog.debug('上传队列空闲中...')
+
+                if task is not None:
+                    self._slots.release()
+                    self._renew(task)
+                    self.stats.move('ready', 'uploading')
+                    self.uploader = uploader
+                    if hasattr(uploader, 'submit_transfer'):
+                        inflight[uploader.submit_transfer()] = (task, uploader, time.monotonic())
+                        continue
+
+                    start = time.monotonic()
+                    error = None
+                    try:
+                        uploaded = uploader.start_upload()
+                    except Exception as e:
+                        mainlog.info(f'上传 {task} 出错: {e}')
+                        uploaded, error = False, e
+                    self._finish_transfer(task, uploader, uploaded, start, error)
+                    continue
+
+            if inflight:
+                done, _ = concurrent.futures.wait(inflight, timeout=0.5, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    self._finish_future(future, inflight.pop(future))
+
+        # 退出前让在传的文件停下来并等它们清理完切片
+        for task, uploader, start in inflight.values():
+            uploader.stop_upload()
+        for future, item in inflight.items():
+            concurrent.futures.wait([future])
+            self._finish_future(future, item)
+
+        # 等准备线程结束，并清理已经准备好但没来得及上传的切片
+        for t in self._prepare_threads:
+            t.join()
+        while not self.ready_queue.empty():
+            task, uploader = self.ready_queue.get()
+            uploader.discard()
+            if isinstance(task, Bundle):
+                self.bundler.remove(task)
+
+        return "Upload stoped"
+
+    def _renew(self, task):
+        '''续租，准备阶段可能排了很久'''
+        for key in (task.members if isinstance(task, Bundle) else [task]):
+            self.file_queue.renew(key)
+
+    def _finish_future(self, future, item):
+        task, uploader, start = item
+        error = None
+        try:
+            uploaded = future.result()
+        except Exception as e:
+            mainlog.info(f'上传 {task} 出错: {e}')
+            uploaded, error = False, e
+        self._finish_transfer(task, uploader, uploaded, start, error)
+
+    def _finish_transfer(self, task, uploader, uploaded, start, error=None):
+        self.stats.add_busy('transfer', time.monotonic() - start)
+        self.stats.move(from_stage='uploading')
+        self._handle_result(task, uploaded, uploader, error)
+
     def _upload_files(self):
-        
+
         mainlog.info(f'开始监控上传任务')
         while not shutdown_event.is_set():
+            if not self.breaker.wait(timeout=5):
+                continue
+
+            bundle = self._take_bundle()
+            if bundle:
+                self.uploader = None
+                error = None
+                try:
+                    self.uploader = self._make_uploader(bundle)
+                    uploaded = self.uploader.start_upload()
+                except Exception as e:
+                    mainlog.info(f'上传 {bundle} 出错: {e}')
+                    uploaded, error = False, e
+                self._handle_result(bundle, uploaded, self.uploader, error)
+                continue
+
             try:
                 # 尝试从队列中获取任务，最多等待一定时间
                 mainlog.debug(f'从队列中提取任务')
                 task = self.file_queue.get(timeout=5)
                 mainlog.debug(f'提取完毕')
 
-                # 检查是否是特殊的停止信号（放在队列里面的None信号）
-                if task is None:
-                    self._stop_monitoring = True
-                    break
+                # 网盘放不下的文件推迟，小文件交给打包器
+                if not self._admit(task) or self._bundle_task(task):
+                    continue
 
                 # 处理上传任务
                 # 设置正在上传状态
                 mainlog.debug(f'设置任务状态为正在上传')
                 self.status_manager.set_uploading(task)
 
-                # 创建上传器
+                # 创建上传器并开始上传，出错的文件交给重试调度器，不会卡住整个循环
                 mainlog.debug(f'创建上传器')
-                self.uploader = BaiduCloudUploader(task, self.config)
-
-                # 开始上传
-                uploaded = self.uploader.start_upload()
+                self.uploader = None
+                error = None
+                try:
+                    self.uploader = self._make_uploader(task)
+                    uploaded = self.uploader.start_upload()
+                except Exception as e:
+                    mainlog.info(f'上传 {task} 出错: {e}')
+                    uploaded, error = False, e
 
                 # 处理上传结果
-                if uploaded:
-                    self.status_manager.set_uploaded(task)
-                else:
-                    self.status_manager.set_not_uploaded(task)
-                    self.file_queue.put(task)
-                    mainlog.debug(f'上传{task}失败，重新插入上传任务队列。')
-
-                self.file_queue.task_done()
+                self._handle_result(task, uploaded, self.uploader, error)
 
             except Empty:
                 # 队列空闲，继续检查停止条件
@@ -0,0 +1,229 @@
+import json
+import time
+import threading
+
+from file_uploader import _sdk, SDK_FAST_PATH, PAN_HOST, get_api_breaker, get_overwrite_marks, remote_md5_is_content
+from storage_auth import get_token_provider
+from content_index import get_content_index
+
+import logging
+from utils import MAIN_LOG, shutdown_event
+mainlog = logging.getLogger(MAIN_LOG)
+
+FILEMETAS_MAX_FSIDS = 100 # filemetas 一次最多查询 100 个 fs_id
+
+
+class VerifyItem:
+    '''
+    一个等待核对的网盘文件
+
+    Args:
+        fs_id (int) : create / 秒传返回的网盘文件 id
+        members (list) : 对应的本地文件，打包上传时是包内所有文件
+        file (File) : 实际上传的文件，用来取大小和 md5
+        codec (str) : 压缩格式，压缩上传的文件只核对大小
+        remote_path (str) : 网盘路径
+        account (str) : 上传到的百度网盘账号
+    '''
+    def __init__(self, fs_id, members, file, codec, remote_path, account=None):
+        self.fs_id = fs_id
+        self.members = members
+        self.file = file
+        self.codec = codec
+        self.remote_path = remote_path
+        self.account = account
+
+    def expected_md5(self):
+        '''本地内容的 md5，压缩上传或者本地文件已经不在（打包的临时 tar）时返回 None'''
+        if self.codec is not None:
+            return None
+        try:
+            return self.file.file_md5
+        except OSError:
+            return None
+
+
+class UploadVerifier:
+    '''
+    上传完成后在后台批量核对网盘上的文件
+
+    create 接口返回成功不代表网盘上的内容就是本地的内容，逐个文件在上传线程里核对又会
+    多一次接口往返。上传成功后只把 fs_id 交给核对器就返回，后台线程攒够 `batch_size`
+    个或者等满 `interval` 秒后，用 `MultimediafileApi.xpanmultimediafilemetas` 一次查一批，
+    比较路径、大小和 md5（不压缩、不超过一个分片的文件，见 `remote_md5_is_content`）。对不上或者网盘上已经查不到的文件按一次上传失败
+    交给重试调度器，退避后重新上传，重复失败的最终进入上传失败。
+
+    重新上传要覆盖原路径上坏掉的文件（`OverwriteMarks`），否则网盘会把新文件改名，核对又因为
+    路径对不上失败。路径对不上说明这次上传已经被改了名，改名后的那份是刚上传的，直接删掉。
+
+    fs_id 只在同一个账号里有效，一批只查同一个账号的文件。待核对的 fs_id 只保存在内存里，
+    进程退出时还没核对的文件不再核对。
+
+    Args:
+        config (Config) : 配置管理器
+        retry (RetryScheduler) : 核对失败的文件交给它放回待上传
+
+    Attributes:
+        verified : 核对通过的文件数
+        mismatched : 核对失败、重新上传的文件数
+
+    Methods:
+        start() : 启动后台核对线程
+        submit(fs_id, members, file, codec, remote_path, account) : 登记一个刚上传成功的文件，不阻塞
+        flush() : 立即核对所有待核对的文件，返回本次核对的个数
+        pending() : 待核对的文件数
+    '''
+    def __init__(self, config, retry):
+        verify_config = config.get_verify_config()
+        self.enabled = verify_config.get('enabled')
+        self.batch_size = max(1, min(FILEMETAS_MAX_FSIDS, verify_config.get('batch_size')))
+        self.interval = verify_config.get('interval')
+        self.check_md5 = verify_config.get('check_md5')
+        self.retry = retry
+        self.config = config
+        self.breaker = get_api_breaker(config)
+        self.overwrites = get_overwrite_marks(config)
+        self.pan_host = PAN_HOST
+        self.verified = 0
+        self.mismatched = 0
+        self._items = []
+        self._oldest = None # 最早一个待核对文件登记的时间
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+
+    def start(self):
+        if self.enabled:
+            threading.Thread(target=self._run, name='upload-verifier', daemon=True).start()
+
+    def submit(self, fs_id, members, file, codec=None, remote_path=None, account=None):
+        if not self.enabled or fs_id is None:
+            return
+        with self._cond:
+            if not self._items:
+                self._oldest = time.monotonic()
+            self._items.append(VerifyItem(fs_id, list(members), file, codec, remote_path, account))
+            if len(self._items) >= self.batch_size:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._items)
+
+    def flush(self):
+        checked = 0
+        with self._flush_lock:
+            while True:
+                with self._cond:
+                    batch = self._take_batch()
+                    self._oldest = time.monotonic() if self._items else None
+                if not batch:
+                    return checked
+                if not self._verify(batch):
+                    # 接口调用失败，放回去等下一轮
+                    with self._cond:
+                        self._items[:0] = batch
+                        self._oldest = self._oldest or time.monotonic()
+                    return checked
+                checked += len(batch)
+
+    def _take_batch(self):
+        '''取出最多 batch_size 个和第一个文件同账号的文件，调用方持有 self._cond'''
+        if not self._items:
+            return []
+        account = self._items[0].account
+        batch, rest = [], []
+        for item in self._items:
+            if item.account == account and len(batch) < self.batch_size:
+                batch.append(item)
+            else:
+                rest.append(item)
+        self._items = rest
+        return batch
+
+    def _run(self):
+        while not shutdown_event.is_set():
+            with self._cond:
+                due = self._items and (len(self._items) >= self.batch_size
+                                       or time.monotonic() - self._oldest >= self.interval)
+                if not due:
+                    self._cond.wait(1)
+                    continue
+            self.breaker.wait()
+            self.flush()
+
+    def _verify(self, batch):
+        '''核对一批文件，接口调用失败时返回 False'''
+        try:
+            api_response = self.breaker.call(self._api_filemetas, [item.fs_id for item in batch], batch[0].account)
+        except Exception as e:
+            mainlog.debug(f'核对 {len(batch)} 个上传文件失败: {e}')
+            return False
+        if api_response.get('errno'):
+            mainlog.debug(f"核对 {len(batch)} 个上传文件失败 错误码:{api_response.get('errno')}")
+            return False
+
+        metas = {meta.get('fs_id'): meta for meta in api_response.get('list') or []}
+        for item in batch:
+            meta = metas.get(item.fs_id)
+            problem = self._compare(item, meta)
+            if problem is None:
+                self.verified += 1
+                if item.remote_path:
+                    self.overwrites.clear(item.account, item.remote_path)
+                continue
+
+            self.mismatched += 1
+            mainlog.warning(f'{item.remote_path} 核对失败（{problem}），重新上传 {len(item.members)} 个文件')
+            if item.remote_path:
+                self.overwrites.mark(item.account, item.remote_path)
+                content_index = get_content_index(self.config, item.account)
+                if content_index is not None:
+                    content_index.forget(item.remote_path)
+                if meta and meta.get('path') and meta.get('path') != item.remote_path:
+                    self._remove_renamed(meta.get('path'), item.account)
+            for member in item.members:
+                self.retry.failed(member, f'上传后核对失败: {problem}')
+        return True
+
+    def _compare(self, item, meta):
+        '''返回对不上的原因，一致时返回 None'''
+        if meta is None:
+            return '网盘上找不到文件'
+        if item.remote_path and meta.get('path') and meta.get('path') != item.remote_path:
+            return f"路径 {meta.get('path')}"
+        if meta.get('size') != item.file.upload_size:
+            return f"大小 {meta.get('size')} != {item.file.upload_size}"
+        if self.check_md5 and meta.get('md5') and remote_md5_is_content(meta.get('size')):
+            expected = item.expected_md5()
+            if expected is not None and meta.get('md5') != expected:
+                return f"md5 {meta.get('md5')} != {expected}"
+        return None
+
+    def _remove_renamed(self, path, account):
+        '''删掉被网盘改名的那份上传，失败时只记日志'''
+        try:
+            api_response = self.breaker.call(self._api_delete, [path], account)
+            if api_response.get('errno'):
+                raise Exception(f"错误码:{api_response.get('errno')}")
+            mainlog.info(f'已删除被改名的上传 {path}')
+        except Exception as e:
+            mainlog.info(f'删除被改名的上传 {path} 失败: {e}')
+
+    def _api_delete(self, paths, account=None):
+        '''删除文件 api 封装，同步执行'''
+        openapi_client = _sdk()[0]
+        from openapi_client.api import filemanager_api
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
+            api_instance = filemanager_api.FilemanagerApi(api_client)
+            return api_instance.filemanagerdelete(
+                get_token_provider(self.config, account).get_token(), 0,
+                json.dumps(paths, ensure_ascii=False), **SDK_FAST_PATH)
+
+    def _api_filemetas(self, fs_ids, account=None):
+        '''批量查询文件信息 api 封装'''
+        openapi_client = _sdk()[0]
+        from openapi_client.api import multimediafile_api
+        with openapi_client.ApiClient(openapi_client.Configuration(host=self.pan_host)) as api_client:
+            api_instance = multimediafile_api.MultimediafileApi(api_client)
+            return api_instance.xpanmultimediafilemetas(
+                get_token_provider(self.config, account).get_token(), json.dumps(fs_ids), **SDK_FAST_PATH)
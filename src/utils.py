@@ -3,6 +3,7 @@ BAIDU_CONFIG_SECTION = 'BaiduCloud'
 MAIN_LOG = 'main_log'
 import os
 import hashlib
+import itertools
 
 import logging
 from utils import MAIN_LOG
@@ -49,6 +50,28 @@ def cal_file_md5(filename):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
+SLICE_MD5_BYTES = 256 * 1024 # 秒传校验用的文件头长度
+
+def cal_file_hashes(filename, sinks=()):
+    '''
+    读一遍文件同时算出整个文件和文件头 256KB 的 md5，秒传需要这两个值
+
+    Args:
+        filename (str) : 文件路径
+        sinks (list) : 读到的每一段数据都按顺序交给这些函数，多目的地上传时顺便写给其他目的地
+
+    Returns:
+        tuple : (content_md5, slice_md5)
+    '''
+    hash_md5 = hashlib.md5()
+    with open(filename, "rb") as f:
+        head = f.read(SLICE_MD5_BYTES)
+        for chunk in itertools.chain([head], iter(lambda: f.read(1024 * 1024), b"")):
+            hash_md5.update(chunk)
+            for sink in sinks:
+                sink(chunk)
+    return hash_md5.hexdigest(), hashlib.md5(head).hexdigest()
+
 class File:
     '''
     文件类
@@ -59,17 +82,53 @@ class File:
     Attributes:
         file_path : 
         file_size : 
-        file_md5 : 
+        file_md5 : 第一次用到时才计算，已经知道的话可以直接赋值，也可以用 compute_hashes() 提前算好
+        slice_md5 : 文件头 256KB 的 md5
+        stat : 创建时的 os.stat 结果，用来识别硬链接
         chunks : 所有切片，一个列表
+        codec : 上传时使用的压缩格式，None 表示不压缩
+        upload_size : 实际上传的字节数，压缩后为压缩流的大小
     
     Methods:
         needs_chunking() : 
     '''
     def __init__(self, file_path):
         self.file_path = file_path
-        self.file_size = os.path.getsize(file_path)
-        self.file_md5 = cal_file_md5(self.file_path)
+        self.stat = os.stat(file_path)
+        self.file_size = self.stat.st_size
+        self._file_md5 = None
+        self._slice_md5 = None
         self.chunks = []  # 切片列表
+        self.codec = None
+        self.upload_size = self.file_size
+
+    @property
+    def file_md5(self):
+        if self._file_md5 is None:
+            self._file_md5, self._slice_md5 = cal_file_hashes(self.file_path)
+        return self._file_md5
+
+    @file_md5.setter
+    def file_md5(self, value):
+        self._file_md5 = value
+
+    @property
+    def slice_md5(self):
+        if self._slice_md5 is None:
+            self._file_md5, self._slice_md5 = cal_file_hashes(self.file_path)
+        return self._slice_md5
+
+    @slice_md5.setter
+    def slice_md5(self, value):
+        self._slice_md5 = value
+
+    def known_hashes(self):
+        '''已经算好的 (file_md5, slice_md5)，没算过的是 None，不会为此读文件'''
+        return self._file_md5, self._slice_md5
+
+    def compute_hashes(self, sinks=()):
+        '''读一遍文件算出两个 md5，读到的数据同时交给 sinks'''
+        self._file_md5, self._slice_md5 = cal_file_hashes(self.file_path, sinks)
 
     def needs_chunking(self, chunk_size):
         # 根据给定的块大小判断文件是否需要切片
@@ -127,6 +186,8 @@ class FilePreprocessor:
     Args:
         File (File) : File类
         chunk_size (int) : 切片大小，单位为B 默认为4MB
+        codec (str) : 切片前边读边压缩，zstd / gzip，默认不压缩
+        level (int) : 压缩级别
 
     Attributes:
         file : 
@@ -135,10 +196,12 @@ class FilePreprocessor:
     Method:
         preprocess() : 
     '''
-    def __init__(self, File, chunk_size=4*1024*1024, max_chunk_amount=1024):
+    def __init__(self, File, chunk_size=4*1024*1024, max_chunk_amount=1024, codec=None, level=None):
         self.file = File
         self.chunk_size = chunk_size
         self.max_chunk_amount = max_chunk_amount
+        self.codec = codec
+        self.level = level
 
     def preprocess(self):
         mainlog.debug(f'文件预处理')
@@ -158,16 +221,28 @@ class FilePreprocessor:
     def _chunk_file(self):
         # 创建文件切片
         mainlog.debug(f'切片文件')
-        with open(self.file.file_path, 'rb') as f:
+        if self.codec:
+            # 切片和 block_list 都基于压缩流
+            from compressor import CompressedReader
+            source = CompressedReader(self.file.file_path, self.codec, self.level)
+        else:
+            source = open(self.file.file_path, 'rb')
+        with source as f:
             mainlog.debug(f'读取文件 {self.file.file_path} 准备切片')
             part_seq = 0
+            upload_size = 0
 
             while True:
                 chunk = f.read(self.chunk_size)
                 if not chunk:
                     mainlog.debug(f'切片列表中含有{len(self.file.chunks)}个切片')
+                    self.file.codec = self.codec
+                    self.file.upload_size = upload_size
+                    if self.codec:
+                        mainlog.debug(f'{self.file.file_path} {self.codec} 压缩 {self.file.file_size} -> {upload_size} 字节')
 
                     return '切片完成'
+                upload_size += len(chunk)
 
                 chunk_path = f"{ self.file.file_path }_path_chunk_{ part_seq }"
                 with open(chunk_path, 'wb') as cf:
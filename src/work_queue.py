@@ -0,0 +1,171 @@
+import time
+import threading
+from collections import deque
+from queue import Empty
+
+import logging
+from utils import MAIN_LOG
+mainlog = logging.getLogger(MAIN_LOG)
+
+RESCAN_INTERVAL = 60 # 窗口空闲时重新扫描状态库的最短间隔（秒）
+DEFAULT_LEASE = 6 * 3600 # 取出的任务多久没有 done / renew 视为丢失（秒）
+
+
+class PendingQueue:
+    '''
+    有界的上传任务队列，状态库里的待上传文件才是完整的任务列表
+
+    内存里只放一个小窗口（默认 1000 个路径），低于低水位时按 rowid 游标从状态库
+    分批补充。窗口满时 `put()` 不再入内存，只记下有溢出，文件已经在库里登记为未上传，
+    下一轮扫描会取到。积压再多，内存占用也只和窗口大小有关。
+
+    队列按文件路径去重：路径已经在窗口里或者已经被取走（持有租约）时，`put()` 不做任何事，
+    同一个文件不会被两个线程同时哈希、上传。`get()` 取走的路径带一个租约，处理完调用
+    `done()`，失败要重试调用 `requeue()`；租约到期还没有结束的任务视为丢失，重新放回窗口。
+
+    Args:
+        maxsize (int) : 窗口大小
+        low_water (int) : 低于多少个时从库里补充，默认窗口的 1/4
+        lease_seconds (int) : 租约时长
+
+    Methods:
+        bind(store, restore_upto) : 绑定状态库，restore_upto 之前的“正在上传”记录视为上次中断，第一轮一起恢复
+        put(key) : 加入任务，已在队列或处理中时忽略
+        get(timeout) : 取出任务并持有租约
+        renew(key) : 延长租约
+        done(key) : 任务结束，释放租约
+        requeue(key) : 释放租约并重新加入队列
+        inflight() : 持有租约的任务数
+    '''
+    def __init__(self, maxsize=1000, low_water=None, lease_seconds=DEFAULT_LEASE):
+        self.maxsize = max(1, maxsize)
+        self.low_water = low_water if low_water is not None else max(1, self.maxsize // 4)
+        self.lease_seconds = lease_seconds
+        self._items = deque()
+        self._members = set()
+        self._leases = {} # key -> 租约到期时间
+        self._cond = threading.Condition()
+
+        self._store = None
+        self._cursor = 0 # 下一次从状态库哪个 rowid 之后开始读
+        self._restore_upto = 0
+        self._spilled = False # 有任务因为窗口满没放进内存
+        self._last_scan = 0
+
+    def bind(self, store, restore_upto=0):
+        with self._cond:
+            self._items.clear()
+            self._members.clear()
+            self._store = store
+            self._cursor = 0
+            self._restore_upto = restore_upto
+            self._spilled = True # 第一轮一定要扫
+
+    def put(self, key):
+        '''
+        加入任务
+
+        Returns:
+            bool : 是否加入了内存窗口（已在队列、处理中或窗口已满时为 False）
+        '''
+        with self._cond:
+            return self._put(key)
+
+    def _put(self, key):
+        if key in self._members or key in self._leases:
+            return False
+        if len(self._items) >= self.maxsize and self._store is not None:
+            self._spilled = True
+            return False
+        self._append(key)
+        self._cond.notify()
+        return True
+
+    def get(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._reclaim_expired()
+                if len(self._items) < self.low_water:
+                    self._refill()
+                if self._items:
+                    key = self._items.popleft()
+                    self._members.discard(key)
+                    self._leases[key] = time.monotonic() + self.lease_seconds
+                    return key
+                if not block:
+                    raise Empty
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                # 有新任务会被 notify，没有的话最多等到下一次允许重新扫描
+                self._cond.wait(RESCAN_INTERVAL if remaining is None else min(remaining, RESCAN_INTERVAL))
+
+    def renew(self, key):
+        '''延长租约，返回租约是否仍然有效'''
+        with self._cond:
+            if key not in self._leases:
+                return False
+            self._leases[key] = time.monotonic() + self.lease_seconds
+            return True
+
+    def done(self, key):
+        '''任务结束（成功，或者交给了别的地方处理），释放租约'''
+        with self._cond:
+            self._leases.pop(key, None)
+
+    def requeue(self, key):
+        '''释放租约并重新加入队列，窗口满时留在状态库里等下一轮扫描'''
+        with self._cond:
+            self._leases.pop(key, None)
+            return self._put(key)
+
+    def inflight(self):
+        with self._cond:
+            return len(self._leases)
+
+    def qsize(self):
+        with self._cond:
+            return len(self._items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def _append(self, key):
+        self._items.append(key)
+        self._members.add(key)
+
+    def _reclaim_expired(self):
+        now = time.monotonic()
+        expired = [key for key, deadline in self._leases.items() if deadline <= now]
+        for key in expired:
+            mainlog.warning(f'{key} 的租约已过期，重新放回队列')
+            del self._leases[key]
+            self._put(key)
+
+    def _refill(self):
+        '''从状态库补充到窗口满，读到末尾后游标回到开头，有溢出或到了重新扫描的时间才再扫'''
+        if self._store is None:
+            return
+        if self._cursor == 0 and not self._spilled and time.monotonic() - self._last_scan < RESCAN_INTERVAL:
+            return
+        if self._cursor == 0:
+            self._spilled = False
+            self._last_scan = time.monotonic()
+
+        need = self.maxsize - len(self._items)
+        while need > 0:
+            limit = need
+            rows = self._store.pending_after(self._cursor, limit, self._restore_upto)
+            for rowid, path in rows:
+                self._cursor = rowid
+                if path not in self._members and path not in self._leases:
+                    self._append(path)
+                    need -= 1
+            if len(rows) < limit:
+                # 读到末尾，这一轮扫描结束；之后的“正在上传”都是本次运行里正在处理的
+                if self._restore_upto:
+                    mainlog.debug('状态库第一轮恢复完成')
+                self._cursor = 0
+                self._restore_upto = 0
+                break
@@ -0,0 +1,75 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+
+from configer import Config
+from fake_pcs import FakePCS
+
+def _base_config(tmp_path):
+    '''测试共用的最小配置：本地目录、假的百度网盘应用和 token，库文件都放在 tmp_path'''
+    return {
+        'LocalFiles': {
+            'devicename': 'testdevice',
+            'localdirectory': tmp_path / 'local',
+        },
+        'BaiduCloud': {
+            'appname': 'test',
+            'appid': 1,
+            'appkey': 'key',
+            'secretkey': 'secret',
+            'accesstoken': 'token',
+        },
+        'Upload': {
+            'hostdiscovery': 'false',
+            'contentindex': tmp_path / 'content_index.db',
+        },
+    }
+
+@pytest.fixture
+def fake_pcs():
+    '''本地的假百度网盘，测试结束时关闭'''
+    fake = FakePCS().start()
+    yield fake
+    fake.stop()
+
+@pytest.fixture
+def make_config(tmp_path):
+    '''
+    生成测试配置文件并读取
+
+    每个测试只写自己关心的键，其余用 `_base_config` 的值：
+
+        config = make_config({'Upload': {'rapidupload': 'false'}, 'Verify': {'batchsize': 10}})
+
+    某个区块传 None 时整个删掉，name 用来在同一个 tmp_path 里生成多份配置（多台机器）。
+    '''
+    def make(overrides=None, name='config.ini'):
+        sections = _base_config(tmp_path)
+        for section, values in (overrides or {}).items():
+            if values is None:
+                sections.pop(section, None)
+            else:
+                sections.setdefault(section, {}).update(values)
+
+        lines = []
+        for section, values in sections.items():
+            lines.append(f'[{section}]')
+            lines.extend(f'{key} = {value}' for key, value in values.items())
+            lines.append('')
+        config_file = tmp_path / name
+        config_file.write_text('\n'.join(lines), encoding='utf-8')
+        return Config(str(config_file))
+    return make
+
+@pytest.fixture
+def make_uploader(fake_pcs):
+    '''指向假网盘的 `BaiduCloudUploader`'''
+    def make(path, config, **kwargs):
+        from file_uploader import BaiduCloudUploader # 依赖百度 SDK，用到时才导入
+        uploader = BaiduCloudUploader(str(path), config, **kwargs)
+        uploader.pan_host = fake_pcs.url
+        return uploader
+    return make
@@ -0,0 +1,326 @@
+'''
+本地的假百度网盘服务，用来离线测试上传相关功能
+
+只实现了测试用得到的接口，返回格式参照百度网盘开放平台文档：
+
+- GET  /rest/2.0/pcs/file?method=locateupload  上传服务器列表
+- POST /rest/2.0/xpan/file?method=precreate     预上传
+- POST /rest/2.0/pcs/superfile2?method=upload   分片上传，返回分片 md5
+- POST /rest/2.0/xpan/file?method=create        合并分片创建文件，按预上传时的 rtype 处理路径冲突（改名时是 name(1).ext）
+- POST /rest/2.0/pcs/file?method=rapidupload    秒传，按 md5、文件头 md5 和大小匹配已有文件
+- POST /rest/2.0/xpan/file?method=filemanager&opera=copy  网盘内复制
+- POST /rest/2.0/xpan/file?method=filemanager&opera=delete / move  删除、移动，async=2 时返回 taskid
+- GET  /rest/2.0/xpan/multimedia?method=listall  递归列出目录，按 start / limit 翻页
+- GET  /rest/2.0/xpan/multimedia?method=filemetas  按 fs_id 批量查询文件信息，查不到的不返回，dlink=1 时带下载链接
+- GET  /dlink?fsid=...                           按 Range 下载文件内容，User-Agent 必须是 pan.baidu.com
+'''
+import json
+import time
+import posixpath
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class FakePCS:
+    '''
+    假百度网盘服务
+
+    Args:
+        delay (float) : 每个请求额外的延迟（秒），模拟慢的上传服务器
+        servers (list) : locateupload 返回的上传服务器，默认只有自己
+
+    Attributes:
+        url : 服务地址，如 http://127.0.0.1:12345
+        files : 已创建的文件 path -> {'size', 'md5', 'slice_md5', 'fs_id', 'server_mtime'}
+        parts : 收到的分片 (uploadid, partseq) -> bytes
+        requests : 收到的请求 (method 参数, query 字典) 列表
+        clients : 收到的请求 (method 参数, 客户端 IP) 列表，测试本地出口地址绑定用
+        dlink_limit : 还能成功响应几个下载请求，之后返回 HTTP 500，None 表示不限制
+        failures : method -> 接下来几个该接口的请求返回 HTTP 500，模拟偶发错误
+        stalls : method -> 接下来几个该接口的请求先等 `stall_seconds` 秒再响应，模拟卡住的连接
+        peak : 同时在处理的请求数的最大值，测试并发上传用
+        expired_tokens : 已经失效的 token，带着它的接口请求返回 errno 111
+    '''
+    def __init__(self, delay=0, servers=None):
+        self.delay = delay
+        self.servers = servers
+        self.files = {}
+        self.parts = {}
+        self.uploads = {}
+        self.requests = []
+        self.clients = []
+        self.contents = {} # md5 -> 文件内容
+        self.dlink_limit = None
+        self.failures = {}
+        self.stalls = {}
+        self.stall_seconds = 5
+        self.peak = 0
+        self.expired_tokens = set()
+        self._active = 0
+        self.lock = threading.Lock()
+        self._next_fs_id = 1000
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                fake._handle(self, b'')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                fake._handle(self, self.rfile.read(length))
+
+        self._httpd = _Server(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self._httpd.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def add_file(self, path, content):
+        '''在网盘里放一个已有的文件，秒传测试用'''
+        with self.lock:
+            return self._store_file(path, content)
+
+    def count(self, method):
+        '''收到的某个 method 的请求数'''
+        with self.lock:
+            return sum(1 for m, _ in self.requests if m == method)
+
+    def _handle(self, handler, body):
+        parts = urlsplit(handler.path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        form = {}
+        content_type = handler.headers.get('Content-Type', '')
+        if content_type.startswith('application/x-www-form-urlencoded'):
+            form = {k: v[0] for k, v in parse_qs(body.decode('utf-8')).items()}
+
+        method = query.get('method', parts.path)
+        with self.lock:
+            self.requests.append((method, query))
+            self.clients.append((method, handler.client_address[0]))
+
+        with self.lock:
+            failed = self._take(self.failures, method)
+            stalled = self._take(self.stalls, method)
+            self._active += 1
+            self.peak = max(self.peak, self._active)
+        try:
+            if self.delay:
+                time.sleep(self.delay)
+            if stalled:
+                time.sleep(self.stall_seconds)
+        finally:
+            with self.lock:
+                self._active -= 1
+        if failed:
+            return self._reply(handler, {'errno': 31299, 'errmsg': 'injected failure'}, status=500)
+
+        if parts.path == '/dlink':
+            return self._download(handler, query)
+        if query.get('access_token') in self.expired_tokens:
+            return self._reply(handler, {'errno': 111, 'errmsg': 'access token invalid or no longer valid'})
+        route = getattr(self, f'_api_{method}', None)
+        if route is None:
+            return self._reply(handler, {'errno': 2, 'errmsg': f'unknown method {method}'}, status=404)
+        return self._reply(handler, route(query, form, body, content_type))
+
+    def _take(self, counts, method):
+        if counts.get(method, 0) <= 0:
+            return False
+        counts[method] -= 1
+        return True
+
+    def _download(self, handler, query):
+        with self.lock:
+            fs_id = int(query.get('fsid', 0))
+            entry = next((e for e in self.files.values() if e['fs_id'] == fs_id), None)
+            refused = handler.headers.get('User-Agent') != 'pan.baidu.com' or query.get('access_token') is None
+            if not refused and self.dlink_limit is not None:
+                refused = self.dlink_limit <= 0
+                self.dlink_limit -= 1
+        if entry is None or refused:
+            return self._reply(handler, {'errno': 31045}, status=404 if entry is None else 500)
+
+        content = self.contents[entry['md5']]
+        start, end, status = 0, len(content) - 1, 200
+        if handler.headers.get('Range'):
+            first, last = handler.headers['Range'].split('=')[1].split('-')
+            start, end, status = int(first), min(int(last), len(content) - 1), 206
+        data = content[start:end + 1]
+        handler.send_response(status)
+        handler.send_header('Content-Length', str(len(data)))
+        if status == 206:
+            handler.send_header('Content-Range', f'bytes {start}-{end}/{len(content)}')
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _reply(self, handler, result, status=200):
+        data = json.dumps(result).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _api_locateupload(self, query, form, body, content_type):
+        servers = self.servers or [self.url]
+        return {
+            'error_code': 0,
+            'host': urlsplit(servers[0]).netloc,
+            'servers': [{'server': s} for s in servers],
+            'bak_servers': [],
+            'quic_servers': [],
+            'expire': 60,
+        }
+
+    def _api_precreate(self, query, form, body, content_type):
+        with self.lock:
+            uploadid = f'fake-upload-{len(self.uploads) + 1}'
+            self.uploads[uploadid] = form
+        return {'errno': 0, 'return_type': 1, 'uploadid': uploadid, 'block_list': []}
+
+    def _api_upload(self, query, form, body, content_type):
+        data = _multipart_file(body, content_type)
+        with self.lock:
+            self.parts[(query.get('uploadid'), int(query.get('partseq', 0)))] = data
+        return {'md5': hashlib.md5(data).hexdigest(), 'request_id': 1}
+
+    def _api_create(self, query, form, body, content_type):
+        uploadid = form.get('uploadid')
+        with self.lock:
+            seqs = sorted(seq for uid, seq in self.parts if uid == uploadid)
+            content = b''.join(self.parts[(uploadid, seq)] for seq in seqs)
+            rtype = self.uploads.get(uploadid, form).get('rtype', 0) # 以预上传时的 rtype 为准
+            path = self._resolve_conflict(form.get('path'), int(rtype), hashlib.md5(content).hexdigest())
+            if path is None:
+                return {'errno': -8, 'errmsg': 'file already exists'}
+            entry = self._store_file(path, content)
+        return {'errno': 0, 'fs_id': entry['fs_id'], 'md5': entry['md5'], 'size': entry['size'],
+                'path': path, 'isdir': 0}
+
+    def _api_rapidupload(self, query, form, body, content_type):
+        key = (int(form.get('content-length', -1)), form.get('content-md5'), form.get('slice-md5'))
+        with self.lock:
+            for entry in list(self.files.values()):
+                if (entry['size'], entry['md5'], entry['slice_md5']) == key:
+                    path = self._resolve_conflict(form.get('path'), int(form.get('rtype', 0)), entry['md5'])
+                    if path is None:
+                        return {'errno': -8, 'errmsg': 'file already exists'}
+                    self._next_fs_id += 1
+                    copy = dict(entry, fs_id=self._next_fs_id)
+                    self.files[path] = copy
+                    return {'errno': 0, 'info': dict(copy, path=path)}
+        return {'errno': 31079, 'errmsg': 'file md5 not found, you should use upload api to upload the whole file.'}
+
+    def _api_filemanager(self, query, form, body, content_type):
+        if query.get('opera') in ('delete', 'move'):
+            return self._delete_or_move(query.get('opera'), form)
+        if query.get('opera') != 'copy':
+            return {'errno': 2, 'errmsg': f"unsupported opera {query.get('opera')}"}
+        info = []
+        with self.lock:
+            for item in json.loads(form.get('filelist', '[]')):
+                entry = self.files.get(item['path'])
+                if entry is None:
+                    info.append({'errno': -9, 'path': item['path']})
+                    continue
+                self._next_fs_id += 1
+                self.files[f"{item['dest'].rstrip('/')}/{item['newname']}"] = dict(entry, fs_id=self._next_fs_id)
+                info.append({'errno': 0, 'path': item['path']})
+        errno = 0 if all(i['errno'] == 0 for i in info) else 12
+        return {'errno': errno, 'info': info, 'request_id': 1}
+
+    def _delete_or_move(self, opera, form):
+        '''删除、移动直接生效，异步模式下多返回一个 taskid；移动后 fs_id 不变'''
+        with self.lock:
+            for item in json.loads(form.get('filelist', '[]')):
+                path = item if opera == 'delete' else item['path']
+                entry = self.files.pop(path, None)
+                if entry is not None and opera == 'move':
+                    self.files[f"{item['dest'].rstrip('/')}/{item['newname']}"] = entry
+            self._next_fs_id += 1
+            taskid = self._next_fs_id
+        result = {'errno': 0, 'info': [], 'request_id': 1}
+        if form.get('async') == '2':
+            result['taskid'] = taskid
+        return result
+
+    def _api_listall(self, query, form, body, content_type):
+        root = query.get('path', '/').rstrip('/') + '/'
+        start, limit = int(query.get('start', 0)), int(query.get('limit', 1000))
+        with self.lock:
+            entries = [dict(entry, path=path, isdir=0) for path, entry in self.files.items() if path.startswith(root)]
+        if not entries:
+            return {'errno': -9, 'errmsg': 'file does not exist'}
+        if query.get('order') == 'time':
+            entries.sort(key=lambda e: e['server_mtime'], reverse=query.get('desc') == '1')
+        else:
+            entries.sort(key=lambda e: e['path'])
+        page = entries[start:start + limit]
+        return {'errno': 0, 'list': page, 'has_more': int(start + limit < len(entries)), 'cursor': start + len(page)}
+
+    def _api_filemetas(self, query, form, body, content_type):
+        fs_ids = set(json.loads(query.get('fsids', '[]')))
+        with self.lock:
+            metas = [dict(entry, path=path, isdir=0) for path, entry in self.files.items() if entry['fs_id'] in fs_ids]
+        if query.get('dlink') == '1':
+            for meta in metas:
+                meta['dlink'] = f"{self.url}/dlink?fsid={meta['fs_id']}"
+        return {'errno': 0, 'list': metas, 'request_id': 1}
+
+    def _resolve_conflict(self, path, rtype, md5):
+        '''
+        按 rtype 处理路径冲突，调用方持有 self.lock
+
+        0 路径已存在时报错（返回 None），1 路径已存在就改名，2 内容也不同时才改名，3 覆盖
+        '''
+        existing = self.files.get(path)
+        if existing is None or rtype == 3 or (rtype == 2 and existing['md5'] == md5):
+            return path
+        if rtype == 0:
+            return None
+        stem, ext = posixpath.splitext(path)
+        n = 1
+        while f'{stem}({n}){ext}' in self.files:
+            n += 1
+        return f'{stem}({n}){ext}'
+
+    def _store_file(self, path, content):
+        self._next_fs_id += 1
+        entry = {
+            'size': len(content),
+            'md5': hashlib.md5(content).hexdigest(),
+            'slice_md5': hashlib.md5(content[:256 * 1024]).hexdigest(),
+            'fs_id': self._next_fs_id,
+            'server_mtime': int(time.time()),
+        }
+        self.files[path] = entry
+        self.contents[entry['md5']] = content
+        return entry
+
+
+def _multipart_file(body, content_type):
+    '''取出 multipart 请求体里第一个文件的内容'''
+    boundary = content_type.split('boundary=')[-1].strip('"').encode()
+    for part in body.split(b'--' + boundary):
+        head, sep, data = part.partition(b'\r\n\r\n')
+        if sep and b'filename=' in head:
+            return data[:-2] if data.endswith(b'\r\n') else data
+    return b''
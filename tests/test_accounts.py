@@ -0,0 +1,70 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+
+from accounts import AccountPool
+from status_manager import StatusManager
+from work_queue import PendingQueue
+
+def _config(make_config, shard_by='directory'):
+    return make_config({
+        'BaiduCloud': {'accesstoken': 'token0'},
+        'BaiduCloud:second': {'accesstoken': 'token1', 'concurrency': 2},
+        'BaiduCloud:third': {'appname': 'other', 'accesstoken': 'token2'},
+        'Accounts': {'shardby': shard_by},
+    })
+
+def _file(tmp_path, relpath, size):
+    path = tmp_path / relpath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return str(path)
+
+def test_account_sections(tmp_path, make_config):
+    '''账号区块没写的应用信息沿用 [BaiduCloud]，token 和并发额度各自独立'''
+    config = _config(make_config)
+    assert config.get_accounts() == ['default', 'second', 'third']
+    second = config.get_baidu_config('second')
+    assert second['app_name'] == 'test'
+    assert second['access_token'] == 'token1'
+    assert second['concurrency'] == 2
+    assert config.get_baidu_config('third')['app_name'] == 'other'
+    assert config.get_baidu_config()['access_token'] == 'token0'
+
+def test_directory_sharding_is_stable(tmp_path, make_config):
+    '''同一个目录的文件固定在同一个账号，换一个进程结果也一样'''
+    config = _config(make_config)
+    files = [_file(tmp_path, f'night{n}/light_{i}.fits', 10) for n in range(6) for i in range(3)]
+    first = AccountPool(config)
+    second = AccountPool(config)
+    for path in files:
+        assert first.account_for(path) == second.account_for(path)
+        assert first.account_for(path) == first.account_for(files[files.index(path) // 3 * 3])
+    assert len({first.account_for(path) for path in files}) > 1
+
+def test_size_sharding_balances_bytes(tmp_path, make_config):
+    '''按大小分配时，新文件分给目前分到字节数最少的账号'''
+    pool = AccountPool(_config(make_config, 'size'))
+    big = pool.account_for(_file(tmp_path, 'a/big.fits', 100))
+    medium = pool.account_for(_file(tmp_path, 'a/medium.fits', 60))
+    small = pool.account_for(_file(tmp_path, 'a/small.fits', 50))
+    assert len({big, medium, small}) == 3
+    assert pool.account_for(_file(tmp_path, 'a/next.fits', 10)) == small
+
+def test_recorded_account_is_preferred(tmp_path, make_config):
+    '''上传过的文件重新上传时还是分到原来的账号'''
+    config = _config(make_config)
+    manager = StatusManager(PendingQueue(maxsize=10), str(tmp_path / 'upload_status.db'), None)
+    path = _file(tmp_path, 'night1/light_0.fits', 10)
+    manager.add(path)
+    pool = AccountPool(config, manager)
+    other = next(account for account in config.get_accounts() if account != pool.account_for(path))
+    manager.set_uploaded(path, other)
+    assert manager.get_account(path) == other
+    assert pool.account_for(path) != other # 分配记录在 forget 之前不变
+    pool.forget(path)
+    assert pool.account_for(path) == other
@@ -0,0 +1,80 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from async_http import AsyncHttpClient, encode_multipart, encode_form
+import pytest
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+    '''把收到的请求体长度和 multipart 文件内容长度回显出来'''
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length)
+        if self.path.startswith('/chunked'):
+            self.send_response(200)
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for piece in (b'{"len": ', str(length).encode(), b'}'):
+                self.wfile.write(f'{len(piece):x}\r\n'.encode() + piece + b'\r\n')
+            self.wfile.write(b'0\r\n\r\n')
+            return
+
+        data = f'{{"len": {length}, "path": "{self.path}"}}'.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = 128 # 默认 backlog 只有 5，并发连接会被重置
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    httpd = Server(('127.0.0.1', 0), EchoHandler)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    yield f'http://127.0.0.1:{httpd.server_address[1]}'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_many_concurrent_requests_on_one_loop(server):
+    '''几百个请求同时挂在一个事件循环上，连接被复用'''
+    async def main():
+        client = AsyncHttpClient(max_connections=20)
+        body, content_type = encode_multipart({}, {'file': ('part', b'x' * 1000)})
+        responses = await asyncio.gather(*(
+            client.request('POST', f'{server}/p?i={i}', body, {'Content-Type': content_type})
+            for i in range(300)))
+        idle = sum(len(c) for c in client._idle.values())
+        await client.close()
+        return responses, idle
+
+    responses, idle = asyncio.run(main())
+    assert all(r.status == 200 for r in responses)
+    assert responses[5].json()['path'] == '/p?i=5'
+    assert responses[0].json()['len'] > 1000
+    assert 0 < idle <= 20
+
+def test_chunked_response(server):
+    async def main():
+        client = AsyncHttpClient()
+        body, content_type = encode_form({'a': 1})
+        r = await client.request('POST', f'{server}/chunked', body, {'Content-Type': content_type})
+        await client.close()
+        return r
+
+    assert asyncio.run(main()).json() == {'len': 3}
@@ -0,0 +1,101 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import glob
+import time
+import hashlib
+import pytest
+pytest.importorskip('urllib3') # async_uploader 依赖百度 SDK
+
+from async_uploader import AsyncBaiduCloudUploader
+
+CONTENT = os.urandom(17 * 1024 * 1024) # 切成 5 个分片
+PARTS = 5
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''asyncio 引擎把分片传到假网盘，不秒传、不对冲、不熔断，方便数请求'''
+    local_dir = tmp_path / 'local'
+    local_dir.mkdir()
+    path = local_dir / 'light.fits'
+    path.write_bytes(CONTENT)
+
+    def make(timeouts=None):
+        config = make_config({
+            'Upload': {
+                'engine': 'asyncio',
+                'uploadhosts': fake_pcs.url,
+                'rapidupload': 'false',
+                'dedup': 'false',
+                'partconcurrency': PARTS,
+            },
+            'Timeouts': dict({'hedge': 'false'}, **(timeouts or {})),
+            'CircuitBreaker': {'enabled': 'false'},
+        })
+        uploader = AsyncBaiduCloudUploader(str(path), config)
+        uploader.pan_host = fake_pcs.url
+        uploader.hosts.discover('token', '/apps/test/light.fits', 'probe') # 测速也会发分片请求，先测完再注入故障
+        return uploader
+    return fake_pcs, make, str(path)
+
+def _part_requests(fake, uploader):
+    '''这个文件收到的分片请求，不算测速'''
+    return [int(query['partseq']) for method, query in fake.requests
+            if method == 'upload' and query.get('uploadid') == uploader.uploadid]
+
+def _chunks_left(path):
+    return glob.glob(f'{path}_path_chunk_*')
+
+def test_parts_upload_concurrently(setup):
+    '''precreate 之后分片同时上传，全部成功后 create 合并'''
+    fake, make, path = setup
+    fake.delay = 0.2
+    uploader = make()
+    uploader.prepare()
+    assert fake.count('precreate') == 1 and not _part_requests(fake, uploader)
+
+    assert uploader.submit_transfer().result(30)
+    assert sorted(_part_requests(fake, uploader)) == list(range(PARTS)) and fake.count('create') == 1
+    assert fake.peak > 1
+    entry = fake.files['/apps/test/light.fits']
+    assert entry['md5'] == hashlib.md5(CONTENT).hexdigest()
+    assert uploader.fs_id == entry['fs_id']
+    assert not _chunks_left(path)
+
+def test_failed_part_is_retried(setup):
+    '''出错的分片单独重传，其他分片不重传'''
+    fake, make, _ = setup
+    uploader = make()
+    fake.failures['upload'] = 2
+    assert uploader.start_upload()
+    assert len(_part_requests(fake, uploader)) == PARTS + 2
+    assert fake.files['/apps/test/light.fits']['md5'] == hashlib.md5(CONTENT).hexdigest()
+
+def test_stalled_part_times_out_and_is_retried(setup):
+    '''卡住的分片按 upload 超时放弃后重传，不等服务器响应'''
+    fake, make, _ = setup
+    uploader = make({'upload': 0.5})
+    fake.stalls['upload'] = 1
+    start = time.monotonic()
+    assert uploader.start_upload()
+    assert time.monotonic() - start < fake.stall_seconds
+    assert len(_part_requests(fake, uploader)) == PARTS + 1
+    assert fake.files['/apps/test/light.fits']['md5'] == hashlib.md5(CONTENT).hexdigest()
+
+def test_timeouts_give_up_and_clean_up(setup):
+    '''precreate 超时时 prepare 抛出异常；分片一直超时用完重试次数后上传失败，都清理切片'''
+    fake, make, path = setup
+    fake.stall_seconds = 2
+    fake.stalls['precreate'] = 1
+    with pytest.raises(Exception):
+        make({'precreate': 0.3}).prepare()
+    assert not _chunks_left(path)
+
+    uploader = make({'upload': 0.3})
+    fake.stalls['upload'] = 100
+    uploader.prepare()
+    assert not uploader.transfer()
+    assert fake.count('create') == 0
+    assert not _chunks_left(path)
@@ -0,0 +1,102 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import json
+import tarfile
+from unittest.mock import Mock
+from bundler import SmallFileBundler
+import pytest
+
+@pytest.fixture
+def bundler(tmp_path):
+    '''阈值 1KB、时间窗口 0 秒的打包器'''
+    local_dir = tmp_path / 'local'
+    (local_dir / 'night1').mkdir(parents=True)
+    config = Mock()
+    config.get_local_config.return_value = {'local_directory': str(local_dir)}
+    config.get_bundle_config.return_value = {
+        'enabled': True,
+        'threshold_kb': 1,
+        'window': 0,
+        'max_bundle_mb': 256,
+        'bundle_dir': str(tmp_path / 'bundles'),
+        'index_file': str(tmp_path / 'bundle_index.db'),
+    }
+    yield SmallFileBundler(config), local_dir
+
+def test_accepts_only_small_files(bundler):
+    b, local_dir = bundler
+    small = local_dir / 'night1' / 'guide.log'
+    small.write_bytes(b'x' * 100)
+    big = local_dir / 'night1' / 'light.fits'
+    big.write_bytes(b'x' * 4096)
+
+    assert b.accepts(str(small))
+    assert not b.accepts(str(big))
+    assert not b.accepts(str(local_dir / 'not_exist'))
+
+def test_bundle_offsets_and_index(bundler):
+    '''索引里的偏移能直接从包里读回原文件内容'''
+    b, local_dir = bundler
+    files = []
+    for i in range(3):
+        f = local_dir / 'night1' / (f'guide_{i}_' + 'x' * 120 + '.log')
+        f.write_bytes(os.urandom(200 + i))
+        files.append(str(f))
+        b.add(str(f))
+
+    bundle = b.pop_due()
+    assert bundle.members == files
+    assert bundle.upload_relpath.startswith('night1/_bundle_')
+    assert b.pop_due() is None
+
+    b.commit(bundle, f'/apps/test/{bundle.upload_relpath}')
+    with open(bundle.bundle_path, 'rb') as tar:
+        for f in files:
+            entry = b.lookup(f)
+            tar.seek(entry['offset'])
+            with open(f, 'rb') as origin:
+                assert tar.read(entry['size']) == origin.read()
+
+    assert tarfile.is_tarfile(bundle.bundle_path)
+    b.remove(bundle)
+    assert not os.path.exists(bundle.bundle_path)
+
+def test_missing_file_returned_as_failed(bundler):
+    b, local_dir = bundler
+    f = local_dir / 'night1' / 'gone.log'
+    f.write_bytes(b'x')
+    b.add(str(f))
+    os.remove(f)
+
+    bundle = b.pop_due()
+    assert bundle.members == []
+    assert bundle.failed == [str(f)]
+
+def test_build_error_returns_all_files(bundler, tmp_path):
+    '''包目录写不了时整个分组交回正常流程，不留下写了一半的包'''
+    b, local_dir = bundler
+    (tmp_path / 'bundles').write_bytes(b'') # 包目录的位置被一个文件占了
+    files = []
+    for i in range(2):
+        f = local_dir / 'night1' / f'guide_{i}.log'
+        f.write_bytes(b'x')
+        files.append(str(f))
+        b.add(str(f))
+
+    bundle = b.pop_due()
+    assert bundle.members == []
+    assert bundle.failed == files
+    assert b.pop_due() is None
+
+def test_legacy_json_index_is_imported(bundler, tmp_path):
+    '''旧版本的 JSON 索引第一次查询时导入索引库'''
+    b, local_dir = bundler
+    entry = {'bundle': '/apps/test/night1/_bundle_1.tar', 'member': 'guide.log', 'offset': 512, 'size': 100}
+    with open(tmp_path / 'bundle_index.json', 'w', encoding='utf-8') as f:
+        json.dump({'guide.log': entry}, f)
+
+    assert b.lookup('guide.log') == entry
+    assert b.lookup('other.log') is None
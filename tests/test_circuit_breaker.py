@@ -0,0 +1,53 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+from circuit_breaker import CircuitBreaker, is_service_failure
+import pytest
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+
+def _fail(status):
+    raise HTTPError(status)
+
+def test_only_service_errors_count():
+    '''网络错误、5xx、频控算服务端故障，4xx 和 token 失效不算'''
+    assert is_service_failure(error=ConnectionResetError())
+    assert is_service_failure(error=HTTPError(503))
+    assert is_service_failure(error=HTTPError(429))
+    assert not is_service_failure(error=HTTPError(400))
+    assert is_service_failure({'errno': 31034})
+    assert not is_service_failure({'errno': 111})
+    assert not is_service_failure({'errno': 0, 'md5': 'x'})
+
+def test_trips_and_recovers_after_probe():
+    '''故障占比超过阈值后断开，探测成功后恢复'''
+    healthy = [False]
+    def probe():
+        if not healthy[0]:
+            raise ConnectionError('still down')
+        return {'errno': 0, 'total': 1}
+
+    breaker = CircuitBreaker(window=60, error_rate=0.5, min_calls=4, probe_interval=0.05, probe=probe)
+    breaker.call(lambda: {'errno': 0})
+    breaker.call(lambda: {'errno': 31034})
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            breaker.call(_fail, 502)
+    assert breaker.is_open()
+    assert not breaker.wait(timeout=0.2) # 探测一直失败，保持断开
+
+    healthy[0] = True
+    assert breaker.wait(timeout=2)
+    assert not breaker.is_open()
+
+def test_client_errors_do_not_trip():
+    breaker = CircuitBreaker(min_calls=2)
+    for _ in range(10):
+        with pytest.raises(HTTPError):
+            breaker.call(_fail, 404)
+    assert not breaker.is_open()
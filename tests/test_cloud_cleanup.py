@@ -0,0 +1,50 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+pytest.importorskip('urllib3') # cloud_cleanup 依赖百度 SDK
+
+from cloud_cleanup import CloudCleanup
+from downloader import Downloader
+
+FRAME = os.urandom(32 * 1024)
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''三帧已经下载到 NAS，其中一帧在 NAS 上被误删了'''
+    def make(mode):
+        for i in range(3):
+            fake_pcs.add_file(f'/apps/test/night1/light_{i}.fits', FRAME + bytes([i]))
+        nas = tmp_path / 'nas'
+        config = make_config({
+            'Download': {'localdirectory': nas, 'journal': tmp_path / 'download_journal.db'},
+            'Cleanup': {'mode': mode, 'batchsize': 2, 'requestspersecond': 0, 'pollinterval': 0},
+        })
+        downloader = Downloader(config)
+        downloader.pan_host = fake_pcs.url
+        assert downloader.run() == 3
+        os.remove(nas / 'night1' / 'light_2.fits')
+
+        cleanup = CloudCleanup(config)
+        cleanup.pan_host = fake_pcs.url
+        return fake_pcs, cleanup, downloader
+    return make
+
+def test_delete_only_confirmed(setup):
+    '''两个批次提交异步删除，NAS 上没有副本的文件保留在网盘'''
+    fake, cleanup, _ = setup('delete')
+    assert cleanup.run() == 2
+    assert sorted(fake.files) == ['/apps/test/night1/light_2.fits']
+    assert fake.count('filemanager') == 1
+    assert [row[0] for row in cleanup.journal.downloaded()] == ['/apps/test/night1/light_2.fits']
+    assert cleanup.run() == 0
+
+def test_archive_moves_files(setup):
+    '''归档后的文件不会再被下载'''
+    fake, cleanup, downloader = setup('archive')
+    assert cleanup.run() == 2
+    assert sorted(fake.files) == ['/apps/test/archive/night1/light_0.fits', '/apps/test/archive/night1/light_1.fits',
+                                  '/apps/test/night1/light_2.fits']
+    assert downloader.discover(full=True) == 0
@@ -0,0 +1,64 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import gzip
+from compressor import CompressionPolicy, zstandard
+from utils import File, FilePreprocessor
+import pytest
+
+def _policy(**kwargs):
+    compression_config = {
+        'enabled': True,
+        'zstd_extensions': '.fits',
+        'gzip_extensions': 'cr2',
+        'zstd_level': 3,
+        'gzip_level': 6,
+        'min_size_kb': 1,
+    }
+    compression_config.update(kwargs)
+    return CompressionPolicy(compression_config)
+
+def test_policy_chooses_codec_by_extension(tmp_path):
+    fits = tmp_path / 'light.FITS'
+    fits.write_bytes(bytes(4096))
+    raw = tmp_path / 'dark.cr2'
+    raw.write_bytes(bytes(4096))
+    tiny = tmp_path / 'flat.fits'
+    tiny.write_bytes(bytes(10))
+    jpg = tmp_path / 'preview.jpg'
+    jpg.write_bytes(bytes(4096))
+
+    policy = _policy()
+    fits_codec = 'zstd' if zstandard else 'gzip' # 没装 zstandard 时退回 gzip
+    assert policy.codec_for(str(fits)) == (fits_codec, policy.levels[fits_codec])
+    assert policy.codec_for(str(raw)) == ('gzip', 6)
+    assert policy.codec_for(str(tiny)) == (None, None)
+    assert policy.codec_for(str(jpg)) == (None, None)
+    assert policy.suffix('gzip') == '.gz'
+    assert _policy(enabled=False).codec_for(str(fits)) == (None, None)
+
+def test_block_list_over_compressed_stream(tmp_path):
+    '''切片和 block_list 基于压缩流，拼起来能还原原文件'''
+    path = tmp_path / 'light.fits'
+    content = (bytes(3000) + os.urandom(1000)) * 300
+    path.write_bytes(content)
+
+    file = File(str(path))
+    FilePreprocessor(file, chunk_size=64 * 1024, codec='gzip', level=6).preprocess()
+
+    stream = b''.join(open(chunk.chunk_path, 'rb').read() for chunk in file.chunks)
+    assert gzip.decompress(stream) == content
+    assert file.codec == 'gzip'
+    assert file.upload_size == len(stream) < file.file_size
+    assert len(file.chunks) == -(-len(stream) // (64 * 1024))
+    file.remove_chunks()
+
+def test_policy_shared_per_config(make_config, caplog):
+    '''同一份配置只建一次压缩策略，没装 zstandard 的警告不会每个文件打一次'''
+    from compressor import get_compression_policy
+    config = make_config({'Compression': {'enabled': 'true', 'zstdextensions': '.fits'}})
+    policies = [get_compression_policy(config) for _ in range(3)]
+    assert all(policy is policies[0] for policy in policies)
+    assert len([r for r in caplog.records if 'zstandard' in r.getMessage()]) == (0 if zstandard else 1)
@@ -285,3 +285,11 @@ def test_update_and_save_wrong_sections_options():
         pytest.fail('更新区块错误配置时未能提出异常')
     except:
         assert True
+
+def test_get_upload_config_with_default(temp_config_file_of_normal_options):
+    '''没有 Upload 区块时使用默认值'''
+    config = Config(filename=str(temp_config_file_of_normal_options))
+    upload_config = config.get_upload_config()
+
+    assert upload_config['pipeline_depth'] == 2
+    assert upload_config['stage_report_interval'] == 60
@@ -0,0 +1,80 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import hashlib
+import sqlite3
+import pytest
+pytest.importorskip('urllib3') # file_uploader 依赖百度 SDK
+
+from content_index import ContentIndex
+from file_uploader import server_copy_savings
+
+DARK = os.urandom(64 * 1024)
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''night1 里上传过的主暗场，night2 里是它的硬链接，night3 里是内容相同的复制品'''
+    local_dir = tmp_path / 'local'
+    for night in ('night1', 'night2', 'night3'):
+        (local_dir / night).mkdir(parents=True)
+    (local_dir / 'night1' / 'dark.fits').write_bytes(DARK)
+    os.link(local_dir / 'night1' / 'dark.fits', local_dir / 'night2' / 'dark.fits')
+    (local_dir / 'night3' / 'dark.fits').write_bytes(DARK)
+    config = make_config({'Upload': {'rapidupload': 'false'}})
+
+    # 模拟 night1 的文件已经正常上传过
+    first = str(local_dir / 'night1' / 'dark.fits')
+    fake_pcs.add_file('/apps/test/night1/dark.fits', DARK)
+    ContentIndex(str(tmp_path / 'content_index.db')).add(
+        hashlib.md5(DARK).hexdigest(), len(DARK), None, '/apps/test/night1/dark.fits', os.stat(first))
+    return fake_pcs, config, local_dir
+
+def test_hardlink_copied_without_hashing(setup, make_uploader):
+    fake, config, local_dir = setup
+    copies = server_copy_savings.snapshot()['files']
+
+    uploader = make_uploader(local_dir / 'night2' / 'dark.fits', config)
+    assert uploader.start_upload()
+    assert uploader.file._slice_md5 is None # 没有读文件计算 md5
+    assert fake.count('precreate') == 0
+    assert fake.files['/apps/test/night2/dark.fits']['md5'] == hashlib.md5(DARK).hexdigest()
+    assert server_copy_savings.snapshot()['files'] - copies == 1
+
+def test_same_content_copied(setup, make_uploader):
+    fake, config, local_dir = setup
+    uploader = make_uploader(local_dir / 'night3' / 'dark.fits', config)
+    assert uploader.start_upload()
+    assert '/apps/test/night3/dark.fits' in fake.files
+
+def test_missing_source_is_forgotten(setup, make_uploader):
+    '''网盘上的源文件已经删掉时复制失败，索引里的记录也删掉'''
+    fake, config, local_dir = setup
+    del fake.files['/apps/test/night1/dark.fits']
+
+    uploader = make_uploader(local_dir / 'night3' / 'dark.fits', config)
+    uploader.upload_path = '/apps/test/night3/dark.fits'
+    assert not uploader._try_server_copy()
+    assert uploader.content_index.find(hashlib.md5(DARK).hexdigest(), len(DARK)) is None
+
+def test_locked_index_does_not_fail_upload(setup, tmp_path, make_config, make_uploader):
+    '''别的进程一直锁着内容索引时，上传照常算成功，只是这次没记进索引'''
+    fake, _, local_dir = setup
+    (local_dir / 'night4').mkdir()
+    path = local_dir / 'night4' / 'light.fits'
+    light = os.urandom(64 * 1024)
+    path.write_bytes(light)
+    config = make_config({'Upload': {'rapidupload': 'false', 'uploadhosts': fake.url}})
+
+    uploader = make_uploader(path, config)
+    uploader.content_index.db.execute('PRAGMA busy_timeout = 50')
+    other = sqlite3.connect(str(tmp_path / 'content_index.db'), isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    try:
+        assert uploader.start_upload()
+    finally:
+        other.execute('ROLLBACK')
+        other.close()
+    assert fake.files['/apps/test/night4/light.fits']['md5'] == hashlib.md5(light).hexdigest()
+    assert uploader.content_index.find(hashlib.md5(light).hexdigest(), len(light)) is None
@@ -0,0 +1,84 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+pytest.importorskip('urllib3') # downloader 依赖百度 SDK
+
+from downloader import Downloader, PART_SUFFIX
+
+LIGHT = os.urandom(256 * 1024)
+FLAT = os.urandom(100 * 1024 + 7)
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''网盘上两晚的数据，分区间大小 64KB，每个文件只开一个连接，方便数请求'''
+    fake_pcs.add_file('/apps/test/obs/night1/light.fits', LIGHT)
+    fake_pcs.add_file('/apps/test/obs/night2/flat.fits', FLAT)
+    nas = tmp_path / 'nas'
+    config = make_config({'Download': {
+        'localdirectory': nas,
+        'connections': 1,
+        'chunkmb': 0.0625,
+        'journal': tmp_path / 'download_journal.db',
+    }})
+    return fake_pcs, config, nas
+
+def _downloader(fake, config):
+    d = Downloader(config)
+    d.pan_host = fake.url
+    return d
+
+def test_download_new_files(setup):
+    '''首次下载全部文件，再运行一次没有新文件时不再下载'''
+    fake, config, nas = setup
+    assert _downloader(fake, config).run() == 2
+    assert (nas / 'obs' / 'night1' / 'light.fits').read_bytes() == LIGHT
+    assert (nas / 'obs' / 'night2' / 'flat.fits').read_bytes() == FLAT
+    assert fake.count('/dlink') == 4 + 2
+
+    fake.add_file('/apps/test/obs/night3/flat.fits', FLAT)
+    assert _downloader(fake, config).run() == 1
+    assert fake.count('/dlink') == 6 + 2
+
+def test_resume_from_journal(setup):
+    '''中途失败后重新运行，只下载还没完成的区间'''
+    fake, config, nas = setup
+    del fake.files['/apps/test/obs/night2/flat.fits']
+    fake.dlink_limit = 2
+    assert _downloader(fake, config).run() == 0
+    part = nas / 'obs' / 'night1' / ('light.fits' + PART_SUFFIX)
+    assert part.exists()
+
+    fake.dlink_limit = None
+    requests = fake.count('/dlink')
+    assert _downloader(fake, config).run() == 1
+    assert fake.count('/dlink') - requests == 2
+    assert (nas / 'obs' / 'night1' / 'light.fits').read_bytes() == LIGHT
+    assert not part.exists()
+
+def test_md5_only_checked_for_single_part_files(setup):
+    '''分片上传的大文件网盘 md5 不是内容 md5，照常完成；小文件 md5 不一致时下次重新下载'''
+    fake, config, nas = setup
+    big = os.urandom(5 * 1024 * 1024)
+    fake.add_file('/apps/test/obs/night3/big.fits', big)
+    for remote, content in (('/apps/test/obs/night3/big.fits', big), ('/apps/test/obs/night2/flat.fits', FLAT)):
+        fake.files[remote]['md5'] = f'{len(content):032x}' # 假网盘按 md5 找内容
+        fake.contents[fake.files[remote]['md5']] = content
+
+    assert _downloader(fake, config).run() == 2
+    assert (nas / 'obs' / 'night3' / 'big.fits').read_bytes() == big
+    assert not (nas / 'obs' / 'night2' / 'flat.fits').exists()
+
+def test_failed_batch_does_not_stop_later_batches(setup, monkeypatch):
+    '''一批下载链接获取失败时跳过这一批，后面的批次照常下载'''
+    import downloader
+    monkeypatch.setattr(downloader, 'FILEMETAS_MAX_FSIDS', 1)
+    fake, config, nas = setup
+    fake.failures['filemetas'] = 1
+
+    assert _downloader(fake, config).run() == 1
+    assert _downloader(fake, config).run() == 1
+    assert (nas / 'obs' / 'night1' / 'light.fits').read_bytes() == LIGHT
+    assert (nas / 'obs' / 'night2' / 'flat.fits').read_bytes() == FLAT
@@ -0,0 +1,84 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+
+import utils
+from backends import get_backend, LocalDirectoryUploader
+from fanout import FanOut
+from status_manager import STATUS_UPLOADED, STATUS_NOT_UPLOADED
+from utils import File, cal_file_md5
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+@pytest.fixture
+def setup(tmp_path, make_config):
+    '''两个 USB 目的地，第二个的目标目录其实是一个文件，写不进去'''
+    local = tmp_path / 'local'
+    (local / 'night1').mkdir(parents=True)
+    frame = local / 'night1' / 'light_0.fits'
+    frame.write_bytes(DATA)
+    (tmp_path / 'broken').write_bytes(b'not a directory')
+
+    config = make_config({
+        'FanOut': {'destinations': 'usb, broken', 'queuedepth': 2},
+        'Destination:usb': {
+            'backend': 'local',
+            'directory': tmp_path / 'usb',
+            'statusfile': tmp_path / 'upload_status.usb.db',
+        },
+        'Destination:broken': {
+            'directory': tmp_path / 'broken',
+            'statusfile': tmp_path / 'upload_status.broken.db',
+        },
+    })
+    return config, str(frame), tmp_path
+
+def test_tee_reads_file_once(setup, monkeypatch):
+    '''算 md5 的那一遍读取同时写给所有目的地，之后百度网盘的上传器不再读文件'''
+    config, frame, tmp_path = setup
+    reads = []
+    original = utils.cal_file_hashes
+    monkeypatch.setattr(utils, 'cal_file_hashes', lambda *args: reads.append(args[0]) or original(*args))
+
+    fanout = FanOut(config)
+    file = File(frame)
+    fanout.tee(file)
+    assert file.file_md5 == cal_file_md5(frame)
+    assert file.slice_md5
+    assert reads == [frame]
+
+    usb, broken = fanout.destinations
+    assert (tmp_path / 'usb' / 'night1' / 'light_0.fits').read_bytes() == DATA
+    assert usb.status.get_status(frame) == STATUS_UPLOADED
+
+    # 坏掉的目的地只在自己的状态库里记一次失败
+    assert broken.status.get_status(frame) == STATUS_NOT_UPLOADED
+    assert broken.retry.pending() == 1
+    assert broken.status.scheduled_retries()[0][1] == frame
+
+    # 再来一次时已经写过的目的地不再写
+    os.remove(tmp_path / 'usb' / 'night1' / 'light_0.fits')
+    fanout.tee(File(frame))
+    assert not (tmp_path / 'usb' / 'night1' / 'light_0.fits').exists()
+
+def test_local_backend_standalone(setup):
+    '''单独写入时先写 .part 再改名，停止时不留下半个文件'''
+    config, frame, tmp_path = setup
+    uploader = get_backend('local')(frame, config, config.get_destination_config('usb'))
+    assert isinstance(uploader, LocalDirectoryUploader)
+    assert uploader.start_upload()
+    assert open(uploader.target, 'rb').read() == DATA
+    assert not os.path.exists(uploader.target + '.part')
+
+    os.remove(uploader.target)
+    uploader.stop_upload()
+    assert not uploader.start_upload()
+    assert not os.listdir(os.path.dirname(uploader.target))
+
+def test_unknown_backend(setup):
+    config, _, _ = setup
+    with pytest.raises(ValueError):
+        get_backend('s3')
@@ -0,0 +1,80 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import asyncio
+import itertools
+import threading
+import time
+from hedging import Hedger
+
+def _warm(hedger, seconds=0.01):
+    '''先积累一批正常耗时的样本'''
+    for _ in range(hedger.min_samples):
+        hedger.run(lambda: time.sleep(seconds) or True)
+
+def test_slow_part_is_hedged():
+    '''第一次请求卡住，对冲请求先完成'''
+    hedger = Hedger(percentile=95, min_samples=10)
+    assert hedger.threshold() is None
+    _warm(hedger)
+    assert 0.01 <= hedger.threshold() < 0.5
+
+    calls = itertools.count()
+    def upload():
+        time.sleep(2 if next(calls) == 0 else 0.01)
+        return True
+
+    start = time.monotonic()
+    assert hedger.run(upload)
+    assert time.monotonic() - start < 1
+    assert hedger.snapshot() == {'hedged': 1, 'hedge_won': 1}
+
+def test_fast_part_is_not_hedged():
+    hedger = Hedger(percentile=95, min_samples=10)
+    _warm(hedger, 0.05)
+    assert hedger.run(lambda: True)
+    assert hedger.snapshot() == {'hedged': 0, 'hedge_won': 0}
+
+def test_async_hedge_cancels_slow_request():
+    hedger = Hedger(percentile=95, min_samples=10)
+    _warm(hedger)
+    calls = itertools.count()
+    cancelled = []
+
+    async def upload():
+        try:
+            await asyncio.sleep(5 if next(calls) == 0 else 0.01)
+            return True
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    assert asyncio.run(hedger.run_async(upload))
+    assert cancelled == [True]
+    assert hedger.snapshot() == {'hedged': 1, 'hedge_won': 1}
+
+def test_hedging_skipped_when_pool_is_busy():
+    '''输掉的请求取消不了，还占着对冲线程时新的分片不对冲，直接在当前线程上传'''
+    hedger = Hedger(percentile=95, min_samples=10, max_workers=2)
+    _warm(hedger)
+    release = threading.Event()
+    calls = itertools.count()
+    def upload():
+        if next(calls) == 0:
+            release.wait(5) # 卡住的主请求
+        else:
+            time.sleep(0.01)
+        return True
+
+    assert hedger.run(upload)
+    assert hedger.snapshot() == {'hedged': 1, 'hedge_won': 1}
+    # 卡住的请求还占着一个线程，剩下一个不够对冲
+    assert hedger.run(lambda: threading.current_thread().name.startswith('hedge') is False)
+    assert hedger.hedge_skipped == 1
+    release.set()
+    deadline = time.monotonic() + 5
+    while hedger._busy and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert hedger._busy == 0
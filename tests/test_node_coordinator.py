@@ -0,0 +1,72 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import time
+import pytest
+
+from node_coordinator import NodeCoordinator
+from status_manager import StatusManager, STATUS_UPLOADED
+from work_queue import PendingQueue
+
+def _node(tmp_path, make_config, name, root, lease_seconds):
+    '''一台机器：自己的配置、状态库和队列，检测目录挂载在 root'''
+    config = make_config({
+        'LocalFiles': {'devicename': name, 'localdirectory': root},
+        'Coordination': {
+            'enabled': 'true',
+            'store': tmp_path / 'shared' / 'leases.db',
+            'nodename': name,
+            'batchsize': 3,
+            'leaseseconds': lease_seconds,
+        },
+    }, name=f'{name}.ini')
+    queue = PendingQueue(maxsize=10)
+    manager = StatusManager(queue, str(tmp_path / f'{name}_status.db'), None)
+    files = []
+    for i in range(5):
+        path = os.path.join(root, f'light_{i}.fits')
+        manager.add(path)
+        files.append(path)
+    return NodeCoordinator(config, manager, queue), manager, files
+
+@pytest.fixture
+def nodes(tmp_path, make_config):
+    '''两台机器看到的是同一个共享目录，挂载点不同'''
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    for i in range(5):
+        (shared / f'light_{i}.fits').write_bytes(b'x')
+    os.symlink(shared, tmp_path / 'mnt_b')
+    a = _node(tmp_path, make_config, 'a', shared, lease_seconds=1)
+    b = _node(tmp_path, make_config, 'b', tmp_path / 'mnt_b', lease_seconds=300)
+    return a, b
+
+def test_claims_in_batches(nodes):
+    '''第一台机器一次领取三个文件，第二台只能领到剩下的'''
+    (a, _, a_files), (b, b_manager, b_files) = nodes
+    assert a.admit(a_files[0])
+    assert a.admit(a_files[1]) and a.admit(a_files[2]) # 已经在同一批里领到
+    assert not b.admit(b_files[1])
+    assert b_manager.scheduled_retries()[0][1] == b_files[1] # 推迟，不算失败
+    assert b.admit(b_files[3])
+
+def test_finished_files_are_not_uploaded_twice(nodes):
+    (a, _, a_files), (b, b_manager, b_files) = nodes
+    assert a.admit(a_files[0])
+    a.finish(a_files[0], True)
+    assert not b.admit(b_files[0])
+    assert b_manager.get_status(b_files[0]) == STATUS_UPLOADED
+
+def test_failed_and_crashed_leases_are_taken_over(nodes):
+    '''失败的文件马上放开；机器宕机不再心跳时，租约过期后由另一台接着传'''
+    (a, _, a_files), (b, _, b_files) = nodes
+    assert a.admit(a_files[0])
+    a.finish(a_files[0], False)
+    assert b.admit(b_files[0])
+
+    assert a.admit(a_files[1])
+    assert not b.admit(b_files[2])
+    time.sleep(1.1)
+    assert b.admit(b_files[2])
@@ -0,0 +1,87 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import hashlib
+import threading
+import concurrent.futures
+import pytest
+pytest.importorskip('urllib3') # process_uploader 依赖百度 SDK
+
+import process_uploader
+from process_uploader import ProcessBaiduCloudUploader, ProcessUploadEngine
+
+FRAMES = [os.urandom(5 * 1024 * 1024 + i) for i in range(3)]
+
+def _upload_and_inspect(*args):
+    '''在子进程里上传一个文件，再看子进程里有没有 TokenProvider 和刷新线程'''
+    import storage_auth
+    result = process_uploader._upload_in_worker(*args)
+    threads = [t.name for t in threading.enumerate()]
+    return result, len(storage_auth._providers), threads
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch, fake_pcs, make_config):
+    '''两个子进程，三个需要切片的帧'''
+    local_dir = tmp_path / 'local'
+    local_dir.mkdir()
+    paths = []
+    for i, data in enumerate(FRAMES):
+        path = local_dir / f'light_{i}.fits'
+        path.write_bytes(data)
+        paths.append(str(path))
+
+    config = make_config({'Upload': {
+        'uploadhosts': fake_pcs.url,
+        'rapidupload': 'false',
+        'dedup': 'false',
+        'processes': 2,
+    }})
+    engine = ProcessUploadEngine(config.filename, 2)
+    monkeypatch.setattr(process_uploader, '_engine', engine)
+    yield fake_pcs, config, paths
+    engine.close()
+
+def test_uploads_run_in_worker_processes(setup):
+    '''子进程传完之后，网盘路径、fs_id 和 md5 填回主进程的代理'''
+    fake, config, paths = setup
+    uploaders = []
+    for path in paths:
+        uploader = ProcessBaiduCloudUploader(path, config)
+        uploader.pan_host = fake.url
+        uploader.prepare()
+        uploaders.append(uploader)
+    futures = [uploader.submit_transfer() for uploader in uploaders]
+    assert all(future.result(timeout=60) for future in concurrent.futures.as_completed(futures))
+
+    for i, uploader in enumerate(uploaders):
+        entry = fake.files[f'/apps/test/light_{i}.fits']
+        assert entry['md5'] == hashlib.md5(FRAMES[i]).hexdigest()
+        assert uploader.upload_path == f'/apps/test/light_{i}.fits'
+        assert uploader.fs_id == entry['fs_id']
+        assert uploader.file.upload_size == len(FRAMES[i])
+    assert fake.count('precreate') == 3
+
+def test_worker_errors_surface_in_parent(setup):
+    '''子进程里的异常变成主进程 future 的异常，不会卡住子进程'''
+    fake, config, paths = setup
+    uploader = ProcessBaiduCloudUploader(paths[0], config)
+    uploader.pan_host = fake.url
+    os.remove(paths[0])
+    with pytest.raises(Exception):
+        uploader.start_upload()
+
+    uploader = ProcessBaiduCloudUploader(paths[1], config)
+    uploader.pan_host = fake.url
+    assert uploader.start_upload()
+
+def test_workers_never_refresh_tokens(setup):
+    '''子进程只用主进程发来的 token，不创建 TokenProvider，也没有后台刷新线程'''
+    fake, config, paths = setup
+    engine = process_uploader._engine
+    args = (paths[0], None, None, 'token', (None, None), fake.url)
+    result, providers, threads = engine.pool.submit(_upload_and_inspect, *args).result(timeout=60)
+    assert result.get('uploaded'), result
+    assert providers == 0
+    assert not [name for name in threads if name.startswith('token-')]
@@ -0,0 +1,65 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+pytest.importorskip('urllib3') # quota 依赖百度 SDK
+
+from quota import QuotaGate
+from status_manager import StatusManager, STATUS_NOT_UPLOADED
+from work_queue import PendingQueue
+
+MB = 1024 * 1024
+
+@pytest.fixture
+def setup(tmp_path, make_config):
+    '''网盘剩余 10MB，本地一个 8MB、一个 6MB、一个 1MB 的文件'''
+    config = make_config({'Quota': {'reservemb': 0}})
+    quota = {'errno': 0, 'total': 100 * MB, 'used': 90 * MB}
+
+    queue = PendingQueue(maxsize=10)
+    manager = StatusManager(queue, str(tmp_path / 'upload_status.db'), None)
+    files = {}
+    for name, size in (('big.fits', 8), ('mid.fits', 6), ('small.fits', 1)):
+        path = tmp_path / name
+        with open(path, 'wb') as f:
+            f.truncate(size * MB)
+        files[name] = str(path)
+        manager.add(str(path))
+
+    gate = QuotaGate(config, manager, queue, fetch=lambda: quota)
+    gate.refresh()
+    return gate, quota, queue, manager, files
+
+def _take(queue):
+    return queue.get(timeout=0)
+
+def test_files_that_do_not_fit_are_deferred(setup):
+    '''8MB 放行后只剩 2MB，6MB 的推迟，1MB 的照常放行'''
+    gate, quota, queue, manager, files = setup
+    assert gate.admit(_take(queue)) # big
+    assert not gate.admit(_take(queue)) # mid
+    assert gate.admit(_take(queue)) # small
+    assert gate.remaining() == 1 * MB
+    assert gate.deferred() == 1
+    assert manager.get_status(files['mid.fits']) == STATUS_NOT_UPLOADED
+    assert files['mid.fits'] not in [path for _, path in manager.pending_after(0, 10)] # 推迟期间队列读不到
+
+    gate.settle(files['big.fits'], True)
+    gate.settle(files['small.fits'], False)
+    assert gate.remaining() == 2 * MB
+
+def test_deferred_files_come_back_smallest_first(setup):
+    '''清理网盘后刷新，推迟的文件按从小到大重新排队'''
+    gate, quota, queue, manager, files = setup
+    quota['used'] = 99.5 * MB
+    gate.refresh()
+    for _ in range(3):
+        assert not gate.admit(_take(queue))
+    assert gate.deferred() == 3
+
+    quota['used'] = 86 * MB
+    gate.refresh()
+    assert [_take(queue), _take(queue)] == [files['small.fits'], files['mid.fits']]
+    assert gate.deferred() == 1
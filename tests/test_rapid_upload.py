@@ -0,0 +1,44 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+pytest.importorskip('urllib3') # file_uploader 依赖百度 SDK
+
+from file_uploader import rapid_upload_savings
+
+CONTENT = os.urandom(300 * 1024)
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''本地目录里一个 300KB 的文件，上传配置指向假网盘的秒传接口'''
+    (tmp_path / 'local' / 'night1').mkdir(parents=True)
+    path = tmp_path / 'local' / 'night1' / 'flat.fits'
+    path.write_bytes(CONTENT)
+    config = make_config({'Upload': {'rapiduploadurl': f'{fake_pcs.url}/rest/2.0/pcs/file'}})
+    return fake_pcs, config, str(path)
+
+def test_rapid_upload_skips_transfer(setup, make_uploader):
+    '''网盘里已有相同内容，秒传成功后不切片、不预上传'''
+    fake, config, path = setup
+    fake.add_file('/apps/test/old/flat.fits', CONTENT)
+    saved = rapid_upload_savings.snapshot()['bytes']
+
+    uploader = make_uploader(path, config)
+    assert uploader.start_upload()
+    assert uploader.file.chunks == []
+    assert fake.count('precreate') == 0
+    assert fake.files['/apps/test/night1/flat.fits']['md5'] == fake.files['/apps/test/old/flat.fits']['md5']
+    assert rapid_upload_savings.snapshot()['bytes'] - saved == len(CONTENT)
+
+def test_rapid_upload_miss_falls_back(setup, make_uploader):
+    '''网盘里没有相同内容时秒传失败，交给正常的上传流程'''
+    fake, config, path = setup
+    fake.add_file('/apps/test/old/flat.fits', CONTENT[:-1] + b'x') # 文件头相同，内容不同
+
+    uploader = make_uploader(path, config)
+    uploader.upload_path = '/apps/test/night1/flat.fits'
+    assert not uploader._try_rapid_upload()
+    assert not uploader.uploaded_remotely
+    assert fake.count('rapidupload') == 1
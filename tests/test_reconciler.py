@@ -0,0 +1,64 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import pytest
+pytest.importorskip('urllib3') # reconciler 依赖百度 SDK
+
+import reconciler
+from reconciler import Reconciler, RemoteIndex
+from status_manager import StatusManager, STATUS_UPLOADED
+from work_queue import PendingQueue
+
+@pytest.fixture
+def setup(tmp_path, monkeypatch, fake_pcs, make_config):
+    '''本地 3 个文件：网盘上有且大小一致、网盘上大小不一致、网盘上没有'''
+    monkeypatch.setattr(reconciler, 'LIST_PAGE_SIZE', 2) # 让翻页真正发生
+    local_dir = tmp_path / 'local'
+    (local_dir / 'night1').mkdir(parents=True)
+    for name, size in (('same.fits', 100), ('partial.fits', 200), ('new.fits', 300)):
+        (local_dir / 'night1' / name).write_bytes(b'\x00' * size)
+    fake_pcs.add_file('/apps/test/night1/same.fits', b'\x00' * 100)
+    fake_pcs.add_file('/apps/test/night1/partial.fits', b'\x00' * 150)
+    for i in range(5):
+        fake_pcs.add_file(f'/apps/test/other/{i}.fits', b'x')
+
+    config = make_config()
+    manager = StatusManager(PendingQueue(), str(tmp_path / 'upload_status.db'), None)
+
+    def make(ttl=3600):
+        r = Reconciler(config, manager, RemoteIndex(str(tmp_path / 'remote_index.db'), ttl))
+        r.pan_host = fake_pcs.url
+        return r
+    return fake_pcs, manager, make, local_dir
+
+def test_reconcile_marks_matching_files(setup):
+    fake, manager, make, local_dir = setup
+    assert make().reconcile() == 1
+    assert fake.count('listall') == 4 # 7 个文件，每页 2 个
+    assert manager.get_status(str(local_dir / 'night1' / 'same.fits')) == STATUS_UPLOADED
+    assert manager.get_status(str(local_dir / 'night1' / 'partial.fits')) == 'NOT_EXIST'
+
+    # 缓存有效期内再次对账不请求网盘
+    assert make().reconcile() == 0
+    assert fake.count('listall') == 4
+
+def test_expired_cache_refreshes_incrementally(setup):
+    fake, manager, make, local_dir = setup
+    make().reconcile()
+    fake.add_file('/apps/test/night1/new.fits', b'\x00' * 300)
+
+    assert make(ttl=0).reconcile() == 1
+    assert manager.get_status(str(local_dir / 'night1' / 'new.fits')) == STATUS_UPLOADED
+    assert any(query.get('order') == 'time' for method, query in fake.requests if method == 'listall')
+
+def test_small_file_md5_must_match(setup):
+    '''不超过一个分片的文件网盘 md5 就是内容 md5，大小相同内容不同时不算已上传'''
+    fake, manager, make, local_dir = setup
+    (local_dir / 'night1' / 'changed.fits').write_bytes(b'\x01' * 100)
+    fake.add_file('/apps/test/night1/changed.fits', b'\x00' * 100)
+
+    assert make().reconcile() == 1
+    assert manager.get_status(str(local_dir / 'night1' / 'same.fits')) == STATUS_UPLOADED
+    assert manager.get_status(str(local_dir / 'night1' / 'changed.fits')) == 'NOT_EXIST'
@@ -0,0 +1,63 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import sqlite3
+import time
+from queue import Empty
+from retry_scheduler import RetryPolicy, RetryScheduler
+from status_manager import StatusManager, STATUS_FAILED, STATUS_NOT_UPLOADED
+from work_queue import PendingQueue
+import pytest
+
+@pytest.fixture
+def setup(tmp_path):
+    '''一个登记好的文件，取出后持有租约，模拟上传线程正在处理'''
+    queue = PendingQueue(maxsize=10)
+    manager = StatusManager(queue, str(tmp_path / 'upload_status.db'), None)
+    manager.add('night/a.fits')
+    task = queue.get(timeout=0)
+    policy = RetryPolicy({'max_attempts': 3, 'base_delay': 0.2, 'max_delay': 1})
+    return queue, manager, policy, task
+
+def test_backoff_delays_retry(setup):
+    '''失败后重试时间没到不会从库里读出，到期后由调度器放回队列'''
+    queue, manager, policy, task = setup
+    scheduler = RetryScheduler(queue, manager, policy)
+    scheduler.start()
+
+    assert scheduler.failed(task, 'timeout')
+    queue.done(task)
+    assert manager.pending_after(0, 10) == []
+    with pytest.raises(Empty):
+        queue.get(timeout=0)
+
+    assert queue.get(timeout=2) == task
+    assert scheduler.pending() == 0
+    assert policy.delay(2) <= 0.4
+
+def test_dead_letter_and_redrive(setup):
+    '''次数用完后进入上传失败，手动 redrive 后重新待上传'''
+    queue, manager, policy, task = setup
+    scheduler = RetryScheduler(queue, manager, policy)
+    assert scheduler.failed(task, 'timeout')
+    assert scheduler.failed(task, 'timeout')
+    assert not scheduler.failed(task, 'md5 mismatch')
+
+    assert manager.get_status(task) == STATUS_FAILED
+    assert manager.dead_letters() == [(task, 3, 'md5 mismatch')]
+    assert manager.redrive(['night/other.fits']) == 0
+    assert manager.redrive() == 1
+    assert manager.get_status(task) == STATUS_NOT_UPLOADED
+    assert manager.pending_after(0, 10) != []
+
+def test_old_database_gains_retry_columns(tmp_path):
+    '''旧版本建的状态库打开时自动补上重试相关的列'''
+    db = str(tmp_path / 'upload_status.db')
+    with sqlite3.connect(db) as conn:
+        conn.execute('CREATE TABLE status (path TEXT PRIMARY KEY, status TEXT NOT NULL)')
+        conn.execute('INSERT INTO status VALUES (?, ?)', ('night/a.fits', STATUS_NOT_UPLOADED))
+
+    manager = StatusManager(PendingQueue(), db, None)
+    assert manager.pending_after(0, 10, time.time()) == [(1, 'night/a.fits')]
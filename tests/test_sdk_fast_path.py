@@ -0,0 +1,34 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+sys.path.append(os.path.join(project_path, 'external/baidusdk'))
+
+import hashlib
+import pytest
+pytest.importorskip('urllib3')
+
+import openapi_client
+from openapi_client.api import fileupload_api
+
+@pytest.fixture
+def api(fake_pcs):
+    with openapi_client.ApiClient(openapi_client.Configuration(host=fake_pcs.url)) as api_client:
+        yield fileupload_api.FileuploadApi(api_client)
+
+def test_raw_response_matches_default(api):
+    args = ('token', '/apps/test/a.fits', 0, 1024, 1, '["0"]')
+    default = api.xpanfileprecreate(*args, rtype=2)
+    raw = api.xpanfileprecreate(*args, rtype=2, _raw_response=True)
+
+    assert type(raw) is dict
+    assert raw['errno'] == default['errno'] == 0
+    assert raw['uploadid'] and default['uploadid']
+
+def test_raw_response_superfile2(api, tmp_path):
+    part = tmp_path / 'a.fits_path_chunk_0'
+    part.write_bytes(b'\x00\x01' * 1000)
+    with open(part, 'rb') as f:
+        result = api.pcssuperfile2('token', '0', '/apps/test/a.fits', 'fake-upload-1', 'tmpfile',
+                                   file=f, _raw_response=True)
+    assert result['md5'] == hashlib.md5(part.read_bytes()).hexdigest()
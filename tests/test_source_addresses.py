@@ -0,0 +1,68 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import hashlib
+from types import SimpleNamespace
+import pytest
+pytest.importorskip('urllib3') # file_uploader 依赖百度 SDK
+
+from upload_hosts import SourceAddressSelector, PART_BYTES
+
+CONTENT = os.urandom(17 * 1024 * 1024) # 切成 5 个分片
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''两个回环地址当作两块网卡，分片都传到同一个假网盘'''
+    local_dir = tmp_path / 'local'
+    local_dir.mkdir()
+    (local_dir / 'light.fits').write_bytes(CONTENT)
+    config = make_config({'Upload': {
+        'uploadhosts': fake_pcs.url,
+        'sourceaddresses': '127.0.0.1, 127.0.0.2',
+        'rapidupload': 'false',
+        'dedup': 'false',
+    }})
+    return fake_pcs, config, str(local_dir / 'light.fits')
+
+def test_parts_are_spread_across_source_addresses(setup, make_uploader):
+    '''分片连接绑定到不同的本地地址，文件照常合并'''
+    fake, config, path = setup
+    uploader = make_uploader(path, config)
+    assert uploader.start_upload()
+
+    assert fake.files['/apps/test/light.fits']['md5'] == hashlib.md5(CONTENT).hexdigest()
+    sources = [client for method, client in fake.clients if method == 'upload']
+    assert set(sources) == {'127.0.0.1', '127.0.0.2'}
+    assert [address for address, _ in uploader.interfaces.ranking()] == ['127.0.0.1', '127.0.0.2']
+    assert all(throughput for _, throughput in uploader.interfaces.ranking())
+
+def test_faster_interface_gets_more_parts():
+    '''按实测速度加权：快一倍的线路排队的分片多一倍，失败的线路少分'''
+    selector = SourceAddressSelector(['10.0.0.1', '10.0.0.2'])
+    for address, seconds in [('10.0.0.1', 1), ('10.0.0.2', 2)]:
+        selector.pick()
+        selector.report(address, PART_BYTES, seconds, True)
+
+    picked = [selector.pick() for _ in range(9)]
+    assert picked.count('10.0.0.1') == 6
+    assert picked.count('10.0.0.2') == 3
+    for address in picked:
+        selector.report(address, 0, 0, False)
+    for _ in range(3):
+        selector.report('10.0.0.1', 0, 0, False)
+    assert selector.pick() == '10.0.0.2'
+
+def test_missing_chunk_does_not_leak_inflight(setup, tmp_path, make_uploader):
+    '''切片已经被清理时直接失败，服务器和本地地址的排队计数不变'''
+    fake, config, path = setup
+    uploader = make_uploader(path, config)
+    uploader.upload_path = '/apps/test/light.fits'
+    uploader.hosts.discover('token', uploader.upload_path, 'uploadid')
+    assert uploader.hosts.hosts
+    chunk = SimpleNamespace(chunk_path=str(tmp_path / 'missing.part'), chunk_index=0, chunk_md5='')
+    assert not uploader._api_chunk_upload('token', chunk, 'uploadid')
+
+    assert all(address.inflight == 0 for address in uploader.interfaces.addresses.values())
+    assert all(host.inflight == 0 for host in uploader.hosts.hosts.values())
@@ -0,0 +1,70 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import json
+from queue import Queue
+import status_manager
+from status_manager import StatusManager, STATUS_NOT_UPLOADED, STATUS_UPLOADED, STATUS_UPLOADING
+import pytest
+
+def _drain(queue):
+    items = []
+    while not queue.empty():
+        items.append(queue.get())
+    return items
+
+@pytest.fixture
+def legacy(tmp_path):
+    '''旧版 JSON 状态文件'''
+    path = tmp_path / 'upload_status.json'
+    path.write_text(json.dumps({
+        'file1': STATUS_NOT_UPLOADED,
+        'file2': STATUS_UPLOADED,
+        'file3': STATUS_UPLOADING,
+    }), encoding='utf-8')
+    return path
+
+def test_migrate_legacy_json(tmp_path, legacy):
+    queue = Queue()
+    manager = StatusManager(queue, str(tmp_path / 'upload_status.db'), str(legacy))
+    assert manager.restored.wait(5)
+
+    assert manager.get_status('file2') == STATUS_UPLOADED
+    assert manager.get_status('file4') == 'NOT_EXIST'
+    assert not legacy.exists()
+    assert sorted(_drain(queue)) == ['file1', 'file3']
+
+    # 重启后从数据库读，不再迁移
+    manager.set_uploaded('file1')
+    manager = StatusManager(queue, str(tmp_path / 'upload_status.db'), str(legacy))
+    assert manager.restored.wait(5)
+    assert _drain(queue) == ['file3']
+
+def test_restore_streams_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(status_manager, 'RESTORE_BATCH', 7)
+    db = str(tmp_path / 'upload_status.db')
+    manager = StatusManager(Queue(), db, None)
+    names = [f'night/light_{i:03d}.fits' for i in range(50)]
+    for name in names:
+        manager.add(name)
+    manager.set_uploaded_many(names[:10])
+
+    queue = Queue()
+    manager = StatusManager(queue, db, None)
+    manager.add('night/new.fits') # 恢复开始后登记的文件由 FileChecker 自己入队，不会重复
+    assert manager.restored.wait(5)
+
+    assert _drain(queue) == names[10:]
+    assert manager.count(STATUS_NOT_UPLOADED) == 41
+
+def test_update_requires_existing(tmp_path):
+    manager = StatusManager(Queue(), str(tmp_path / 'upload_status.db'), None)
+    manager.add('a.fits')
+    with pytest.raises(ValueError):
+        manager.add('a.fits')
+    with pytest.raises(ValueError):
+        manager.set_uploading('b.fits')
+    manager.remove_status('a.fits')
+    assert not manager.is_exsit('a.fits')
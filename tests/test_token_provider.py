@@ -0,0 +1,85 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import time
+import threading
+import pytest
+pytest.importorskip('urllib3') # storage_auth 依赖百度 SDK
+
+from storage_auth import TokenProvider, TOKEN_REFRESH_MARGIN
+
+
+class FakeAuth:
+    '''只记录刷新次数的 BaiduAuth 替身'''
+    def __init__(self, token='old', expires_at=0):
+        self.access_token = token
+        self.expires_at = expires_at
+        self.renew_count = 0
+
+    def renew_token(self):
+        time.sleep(0.2) # 模拟网络请求
+        self.renew_count += 1
+        self.access_token = f'new{self.renew_count}'
+        self.expires_at = time.time() + 30 * 24 * 3600
+
+    def get_token(self):
+        return self.access_token
+
+
+def test_concurrent_renew_is_single_flight():
+    '''多个分片线程同时发现 token 失效，只刷新一次'''
+    auth = FakeAuth()
+    provider = TokenProvider(None, auth=auth)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(provider.renew_token('old'))) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert auth.renew_count == 1
+    assert results == ['new1'] * 10
+
+def test_stale_token_returns_current():
+    '''拿着旧 token 来刷新时，如果已经被别人刷新过，不再重复刷新'''
+    auth = FakeAuth(token='fresh', expires_at=time.time() + 3600 * 48)
+    provider = TokenProvider(None, auth=auth)
+
+    assert provider.renew_token('old') == 'fresh'
+    assert auth.renew_count == 0
+
+def test_expired_token_blocks_until_refreshed():
+    auth = FakeAuth(expires_at=time.time() - 1)
+    provider = TokenProvider(None, auth=auth)
+
+    assert provider.get_token() == 'new1'
+
+def test_expiring_token_refreshed_in_background():
+    '''快过期时先返回旧 token，后台刷新'''
+    auth = FakeAuth(expires_at=time.time() + TOKEN_REFRESH_MARGIN / 2)
+    provider = TokenProvider(None, auth=auth)
+
+    assert provider.get_token() == 'old'
+    deadline = time.time() + 5
+    while auth.renew_count == 0 and time.time() < deadline:
+        time.sleep(0.05)
+    assert provider.get_token() == 'new1'
+
+def test_background_refresh_burst_refreshes_once():
+    '''一批后台刷新在第一次刷新完成之后才开始，也不会再刷新'''
+    auth = FakeAuth(expires_at=time.time() + TOKEN_REFRESH_MARGIN / 2)
+    provider = TokenProvider(None, auth=auth)
+
+    for _ in range(5):
+        provider._safe_renew('old')
+    threads = [threading.Thread(target=provider._safe_renew, args=('old',)) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert auth.renew_count == 1
+    assert auth.access_token == 'new1'
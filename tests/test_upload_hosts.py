@@ -0,0 +1,71 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+from fake_pcs import FakePCS
+from upload_hosts import UploadHostSelector
+import pytest
+
+@pytest.fixture
+def servers():
+    '''一快一慢两台假上传服务器，locateupload 由快的那台返回两台'''
+    fast = FakePCS().start()
+    slow = FakePCS(delay=0.2).start()
+    fast.servers = [slow.url, fast.url]
+    yield fast, slow
+    fast.stop()
+    slow.stop()
+
+def _selector(fast, **kwargs):
+    return UploadHostSelector(
+        default_host=fast.url, locate_url=f'{fast.url}/rest/2.0/pcs/file', **kwargs)
+
+def test_discover_ranks_fast_host_first(servers):
+    fast, slow = servers
+    selector = _selector(fast)
+    selector.discover('token', '/apps/test/a.fits', 'uploadid')
+
+    assert fast.count('locateupload') == 1
+    assert [url for url, _ in selector.ranking()] == [fast.url, slow.url]
+
+    # 未过刷新间隔不重复发现
+    selector.discover('token', '/apps/test/b.fits', 'uploadid')
+    assert fast.count('locateupload') == 1
+
+def test_pick_spreads_parts_and_rerank(servers):
+    fast, slow = servers
+    selector = _selector(fast)
+    selector.discover('token', '/apps/test/a.fits', 'uploadid')
+
+    picked = [selector.pick() for _ in range(10)]
+    assert slow.url in picked
+    assert picked.count(fast.url) > picked.count(slow.url)
+    for url in picked:
+        selector.report(url, 4 * 1024 * 1024, 1, True)
+
+    # 快的服务器连续失败后排名下降
+    for _ in range(5):
+        selector.report(fast.url, 0, 0, False)
+    assert selector.ranking()[0][0] == slow.url
+
+def test_locate_failure_falls_back_to_default(servers):
+    fast, slow = servers
+    selector = UploadHostSelector(default_host=fast.url, locate_url='http://127.0.0.1:1/rest/2.0/pcs/file')
+    selector.discover('token', '/apps/test/a.fits', 'uploadid')
+
+    assert [url for url, _ in selector.ranking()] == [fast.url]
+    assert selector.pick() == fast.url
+
+def test_failed_discovery_is_cached():
+    '''所有服务器都测速失败时，刷新间隔内不再重复发现，用默认服务器'''
+    selector = UploadHostSelector(default_host='http://127.0.0.1:1', locate_url='http://127.0.0.1:1/rest/2.0/pcs/file',
+                                  probe_timeout=1)
+    probed = []
+    probe = selector.probe
+    selector.probe = lambda url: probed.append(url) or probe(url)
+
+    selector.discover('token', '/apps/test/a.fits', 'uploadid')
+    selector.discover('token', '/apps/test/b.fits', 'uploadid')
+    assert probed == ['http://127.0.0.1:1']
+    assert selector.pick() == 'http://127.0.0.1:1'
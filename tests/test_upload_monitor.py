@@ -0,0 +1,197 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import time
+import threading
+import pytest
+pytest.importorskip('urllib3') # upload_monitor 依赖百度 SDK
+
+from bundler import Bundle
+from status_manager import StatusManager, STATUS_UPLOADED
+from upload_monitor import UploadMonitor
+from utils import File, shutdown_event
+from work_queue import PendingQueue
+
+
+class FakeUploader:
+    '''按文件名决定在哪个阶段出错的上传器，记录每个阶段的调用顺序'''
+    log = []
+
+    def __init__(self, file_name, config, upload_relpath=None, account=None):
+        if 'bad_init' in file_name:
+            raise Exception('文件已经不在了')
+        self.file = File(file_name)
+        self.account = account
+        self.fs_id = None
+        self.codec = None
+        self.upload_path = None
+
+    def prepare(self):
+        FakeUploader.log.append(('prepare', self.file.file_path))
+        if 'bad_prepare' in self.file.file_path:
+            raise Exception('预上传失败')
+
+    def start_upload(self):
+        FakeUploader.log.append(('transfer', self.file.file_path))
+        if 'bad_transfer' in self.file.file_path:
+            raise Exception('分片上传失败')
+        return True
+
+    def discard(self):
+        pass
+
+    def stop_upload(self):
+        pass
+
+def _file(tmp_path, relpath, size):
+    path = tmp_path / 'local' / relpath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        f.truncate(size)
+    return str(path)
+
+@pytest.fixture
+def make_monitor(tmp_path, monkeypatch, make_config):
+    '''不启动线程的 UploadMonitor，状态库和其他文件都在 tmp_path 里'''
+    monkeypatch.chdir(tmp_path)
+    def make(overrides=None):
+        queue = PendingQueue(maxsize=100)
+        manager = StatusManager(queue, str(tmp_path / 'upload_status.db'), None)
+        return UploadMonitor(queue, manager, make_config(overrides)), queue, manager
+    return make
+
+def test_bundle_members_follow_bundle_account(tmp_path, make_monitor):
+    '''按大小分配时包内文件可能分在不同账号，打包后都改到包的账号，预留的空间也挪过去'''
+    monitor, _, manager = make_monitor({
+        'BaiduCloud:second': {'accesstoken': 'token1'},
+        'Accounts': {'shardby': 'size'},
+    })
+    members = [_file(tmp_path, f'night1/small_{i}.fits', 100 + i) for i in range(3)]
+    for path in members:
+        manager.add(path)
+        assert monitor._admit(path)
+    assert len({monitor.accounts.account_for(path) for path in members}) == 2
+
+    account = monitor._assign_bundle(Bundle(str(tmp_path / 'bundle.tar'), 'night1/bundle.tar', members))
+    assert all(monitor.accounts.account_for(path) == account for path in members)
+    assert sorted(monitor.quotas[account]._reserved) == sorted(members)
+    other = next(a for a in monitor.quotas if a != account)
+    assert monitor.quotas[other]._reserved == {}
+
+    monitor._settle(members, True, None)
+    assert monitor.quotas[account]._reserved == {}
+
+def _run_pipeline(monitor, queue, files):
+    '''只启动流水线的准备和传输线程（pipelinedepth 为 0 时是逐个上传的线程），所有文件结束后停下'''
+    FakeUploader.log = []
+    monitor.uploader_class = FakeUploader
+    for path in files:
+        monitor.status_manager.add(path)
+        queue.put(path)
+    if monitor.pipeline_depth:
+        monitor._prepare_threads = [threading.Thread(target=monitor._prepare_files) for _ in range(monitor.pipeline_depth)]
+        transfer = threading.Thread(target=monitor._transfer_files)
+    else:
+        monitor._prepare_threads = []
+        transfer = threading.Thread(target=monitor._upload_files)
+    for t in monitor._prepare_threads + [transfer]:
+        t.start()
+    try:
+        deadline = time.time() + 20
+        while (queue.qsize() or queue.inflight()) and transfer.is_alive() and time.time() < deadline:
+            time.sleep(0.05)
+        assert transfer.is_alive(), '上传线程意外退出'
+    finally:
+        shutdown_event.set()
+        transfer.join()
+        shutdown_event.clear()
+
+_PIPELINE = {'Upload': {'pipelinedepth': 1}, 'Quota': {'enabled': 'false'}}
+
+def test_tasks_move_through_pipeline(tmp_path, make_monitor):
+    '''每个文件先准备再传输，成功后标记已上传，各阶段计数回到 0'''
+    monitor, queue, manager = make_monitor(_PIPELINE)
+    files = [_file(tmp_path, f'night1/light_{i}.fits', 10) for i in range(3)]
+    _run_pipeline(monitor, queue, files)
+
+    for path in files:
+        assert FakeUploader.log.index(('prepare', path)) < FakeUploader.log.index(('transfer', path))
+        assert manager.get_status(path) == STATUS_UPLOADED
+    depths = monitor.stage_depths()
+    assert (depths['preparing'], depths['ready'], depths['uploading']) == (0, 0, 0)
+    assert monitor._slots._value == monitor.pipeline_depth
+
+def test_failures_release_slots(tmp_path, make_monitor):
+    '''准备或传输出错的文件交给重试，流水线的名额归还，后面的文件照常上传'''
+    monitor, queue, manager = make_monitor(_PIPELINE)
+    files = [_file(tmp_path, f'night1/{name}.fits', 10) for name in ('bad_prepare', 'bad_transfer', 'good')]
+    _run_pipeline(monitor, queue, files)
+
+    assert ('transfer', files[0]) not in FakeUploader.log
+    assert manager.get_status(files[2]) == STATUS_UPLOADED
+    assert sorted(path for _, path in manager.scheduled_retries()) == sorted(files[:2])
+    assert monitor._slots._value == monitor.pipeline_depth
+    depths = monitor.stage_depths()
+    assert (depths['preparing'], depths['ready'], depths['uploading']) == (0, 0, 0)
+
+def test_bottleneck(make_monitor):
+    '''有就绪文件在等是传输跟不上，只有排队或准备中是准备跟不上'''
+    monitor, queue, _ = make_monitor(_PIPELINE)
+    assert monitor.bottleneck() == 'idle'
+    queue.put('a.fits')
+    assert monitor.bottleneck() == 'prepare'
+    monitor.stats.move(to_stage='ready')
+    assert monitor.bottleneck() == 'transfer'
+    queue.get(timeout=0)
+    monitor.stats.move('ready', 'preparing')
+    assert monitor.bottleneck() == 'prepare'
+    monitor.stats.move(from_stage='preparing')
+    assert monitor.bottleneck() == 'idle'
+
+_SERIAL = {'Upload': {'pipelinedepth': 0}, 'Quota': {'enabled': 'false'}}
+
+def test_serial_upload_survives_uploader_error(tmp_path, make_monitor):
+    '''逐个上传时第一个文件就创建不了上传器，交给重试，线程继续上传后面的文件'''
+    monitor, queue, manager = make_monitor(_SERIAL)
+    files = [_file(tmp_path, f'night1/{name}.fits', 10) for name in ('bad_init', 'good')]
+    _run_pipeline(monitor, queue, files)
+
+    assert [path for _, path in manager.scheduled_retries()] == files[:1]
+    assert manager.get_status(files[1]) == STATUS_UPLOADED
+
+def test_failed_uploader_releases_budget_once(tmp_path, make_monitor):
+    '''账号有并发上限时，创建上传器失败只归还它自己占的额度，不会多还一次'''
+    monitor, queue, manager = make_monitor({
+        'Upload': {'pipelinedepth': 0},
+        'Quota': {'enabled': 'false'},
+        'BaiduCloud': {'concurrency': 1},
+    })
+    files = [_file(tmp_path, f'night1/{name}.fits', 10) for name in ('good_1', 'bad_init', 'good_2')]
+    _run_pipeline(monitor, queue, files)
+
+    assert manager.get_status(files[0]) == STATUS_UPLOADED
+    assert manager.get_status(files[2]) == STATUS_UPLOADED
+    assert [path for _, path in manager.scheduled_retries()] == files[1:2]
+    assert all(budget._value == 1 for budget in monitor.accounts._budgets.values())
+
+def test_bundle_build_error_hands_files_back(tmp_path, make_monitor):
+    '''打包出错时包内文件交给重试，预留的网盘空间和账号分配都还回去，线程不受影响'''
+    (tmp_path / 'bundles').write_bytes(b'') # 包目录的位置被一个文件占了
+    monitor, _, manager = make_monitor({'Bundle': {
+        'enabled': 'true',
+        'window': 0,
+        'bundledir': tmp_path / 'bundles',
+        'indexfile': tmp_path / 'bundle_index.db',
+    }})
+    members = [_file(tmp_path, f'night1/guide_{i}.log', 100) for i in range(2)]
+    for path in members:
+        manager.add(path)
+        assert monitor._admit(path)
+        assert monitor._bundle_task(path)
+
+    assert monitor._take_bundle() is None
+    assert sorted(path for _, path in manager.scheduled_retries()) == members
+    assert all(quota._reserved == {} for quota in monitor.quotas.values())
+    assert monitor.accounts._assigned == {}
@@ -0,0 +1,160 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import time
+import pytest
+pytest.importorskip('urllib3') # upload_verifier 依赖百度 SDK
+
+from retry_scheduler import RetryPolicy, RetryScheduler
+from status_manager import StatusManager, STATUS_NOT_UPLOADED, STATUS_UPLOADED
+from upload_verifier import UploadVerifier
+from utils import File
+from work_queue import PendingQueue
+
+FLAT = os.urandom(300 * 1024)
+
+@pytest.fixture
+def setup(tmp_path, fake_pcs, make_config):
+    '''两个已经上传成功的平场，网盘上各有一份'''
+    local_dir = tmp_path / 'local'
+    local_dir.mkdir()
+    config = make_config({'Verify': {'batchsize': 10, 'interval': 0.1}})
+
+    queue = PendingQueue(maxsize=10)
+    manager = StatusManager(queue, str(tmp_path / 'upload_status.db'), None)
+    files = {}
+    for name in ('a.fits', 'b.fits'):
+        path = local_dir / name
+        path.write_bytes(FLAT)
+        manager.add(str(path))
+        manager.set_uploaded(str(path))
+        files[str(path)] = fake_pcs.add_file(f'/apps/test/{name}', FLAT)['fs_id']
+
+    retry = RetryScheduler(queue, manager, RetryPolicy({'max_attempts': 3, 'base_delay': 60, 'max_delay': 60}))
+    verifier = UploadVerifier(config, retry)
+    verifier.pan_host = fake_pcs.url
+    return fake_pcs, verifier, manager, files
+
+def _submit(verifier, files):
+    for path, fs_id in files.items():
+        verifier.submit(fs_id, [path], File(path), None, f'/apps/test/{os.path.basename(path)}')
+
+def test_matching_uploads_stay_uploaded(setup):
+    '''一批文件只调用一次 filemetas'''
+    fake, verifier, manager, files = setup
+    _submit(verifier, files)
+    assert verifier.flush() == 2
+    assert fake.count('filemetas') == 1
+    assert verifier.verified == 2 and verifier.mismatched == 0
+    assert all(manager.get_status(path) == STATUS_UPLOADED for path in files)
+
+def test_mismatch_goes_back_to_pending(setup):
+    '''网盘上内容被截断、文件被删掉时重新回到待上传'''
+    fake, verifier, manager, files = setup
+    a, b = sorted(files)
+    fake.files['/apps/test/a.fits']['size'] -= 1
+    del fake.files['/apps/test/b.fits']
+
+    _submit(verifier, files)
+    verifier.flush()
+    assert verifier.mismatched == 2
+    assert manager.get_status(a) == STATUS_NOT_UPLOADED
+    assert manager.get_status(b) == STATUS_NOT_UPLOADED
+    assert verifier.retry.pending() == 2
+
+def test_background_thread_flushes_after_interval(setup):
+    '''登记后立即返回，由后台线程在 interval 之后核对'''
+    fake, verifier, manager, files = setup
+    verifier.start()
+    _submit(verifier, files)
+    assert fake.count('filemetas') == 0
+
+    for _ in range(50):
+        if verifier.verified == 2:
+            break
+        time.sleep(0.1)
+    assert verifier.verified == 2
+    assert verifier.pending() == 0
+
+def test_renamed_upload_is_overwritten_on_retry(tmp_path, setup, make_config, make_uploader):
+    '''网盘上同名文件内容不同，上传被改名；核对失败后删掉改名的那份，重新上传覆盖原路径再核对通过'''
+    fake, verifier, manager, _ = setup
+    path = tmp_path / 'local' / 'c.fits'
+    path.write_bytes(FLAT)
+    manager.add(str(path))
+    fake.add_file('/apps/test/c.fits', b'stale')
+    config = make_config({
+        'Verify': {'batchsize': 10, 'interval': 0.1},
+        'Upload': {'uploadhosts': fake.url, 'rapidupload': 'false', 'dedup': 'false'},
+    })
+
+    def upload_and_verify():
+        uploader = make_uploader(path, config)
+        assert uploader.start_upload()
+        verifier.submit(uploader.fs_id, [str(path)], uploader.file, None, uploader.upload_path)
+        verifier.flush()
+        return uploader
+
+    uploader = upload_and_verify()
+    assert uploader.rtype == 2
+    assert verifier.mismatched == 1
+    assert '/apps/test/c(1).fits' not in fake.files
+    assert verifier.overwrites.marked(None, '/apps/test/c.fits')
+
+    uploader = upload_and_verify()
+    assert uploader.rtype == 3
+    assert verifier.verified == 1 and verifier.mismatched == 1
+    assert not verifier.overwrites.marked(None, '/apps/test/c.fits')
+    assert fake.files['/apps/test/c.fits']['size'] == len(FLAT)
+    assert not any('(' in remote for remote in fake.files)
+
+class _ExpiringToken:
+    '''第一次拿到的 token 已经失效，刷新后换成假网盘认的 token'''
+    def __init__(self):
+        self.token = 'expired'
+
+    def get_token(self):
+        return self.token
+
+    def renew_token(self, stale_token=None):
+        self.token = 'token'
+        return self.token
+
+def test_overwrite_survives_token_refresh(tmp_path, setup, make_config, make_uploader):
+    '''覆盖重传时预上传遇到 token 失效，刷新后重试仍然覆盖原路径'''
+    fake, verifier, manager, _ = setup
+    path = tmp_path / 'local' / 'c.fits'
+    path.write_bytes(FLAT)
+    fake.add_file('/apps/test/c.fits', b'stale')
+    fake.expired_tokens.add('expired')
+    verifier.overwrites.mark(None, '/apps/test/c.fits')
+    config = make_config({
+        'Verify': {'batchsize': 10, 'interval': 0.1},
+        'Upload': {'uploadhosts': fake.url, 'rapidupload': 'false', 'dedup': 'false'},
+    })
+
+    auth = _ExpiringToken()
+    uploader = make_uploader(path, config, auth=auth)
+    assert uploader.start_upload()
+    assert auth.token == 'token'
+    assert fake.count('precreate') == 2
+    assert fake.files['/apps/test/c.fits']['size'] == len(FLAT)
+    assert '/apps/test/c(1).fits' not in fake.files
+
+def test_md5_only_checked_for_single_part_files(tmp_path, setup):
+    '''分片上传的大文件网盘 md5 不是内容 md5，不比较；一个分片的文件 md5 不一致时核对失败'''
+    fake, verifier, manager, files = setup
+    a = sorted(files)[0]
+    big = tmp_path / 'local' / 'big.fits'
+    big.write_bytes(os.urandom(5 * 1024 * 1024))
+    fs_id = fake.add_file('/apps/test/big.fits', big.read_bytes())['fs_id']
+    for remote in ('/apps/test/a.fits', '/apps/test/big.fits'):
+        fake.files[remote]['md5'] = '0' * 32
+
+    _submit(verifier, {a: files[a], str(big): fs_id})
+    verifier.flush()
+    assert verifier.verified == 1 and verifier.mismatched == 1
+    assert verifier.retry.pending() == 1
+    assert [path for _, path in manager.scheduled_retries()] == [a]
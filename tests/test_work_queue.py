@@ -0,0 +1,95 @@
+import sys, os
+project_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+src_path = os.path.join(project_path, 'src')
+sys.path.append(src_path)
+
+import time
+from queue import Empty
+from status_manager import StatusManager, STATUS_UPLOADED
+from work_queue import PendingQueue
+import pytest
+
+@pytest.fixture
+def store(tmp_path):
+    '''2000 个待上传、500 个已上传、10 个上次中断时正在上传的状态库'''
+    db = str(tmp_path / 'upload_status.db')
+    manager = StatusManager(PendingQueue(), db, None)
+    pending = [f'night/light_{i:04d}.fits' for i in range(2000)]
+    for name in pending:
+        manager.add(name)
+    done = [f'night/done_{i:04d}.fits' for i in range(500)]
+    for name in done:
+        manager.add(name)
+    manager.set_uploaded_many(done)
+    for name in pending[:10]:
+        manager.set_uploading(name)
+    return db, pending
+
+def _consume(queue, manager):
+    '''模拟上传监控：取出后立即标记为正在上传'''
+    taken = []
+    while True:
+        try:
+            task = queue.get(timeout=0)
+        except Empty:
+            return taken
+        assert queue.qsize() <= queue.maxsize
+        manager.set_uploading(task)
+        taken.append(task)
+
+def test_window_refills_from_store(store):
+    db, pending = store
+    queue = PendingQueue(maxsize=100)
+    manager = StatusManager(queue, db, None)
+    assert queue.qsize() == 0 # 启动时不读入任何任务
+
+    taken = _consume(queue, manager)
+    assert taken == pending # 中断的任务也恢复，且每个只出现一次
+    assert manager.count(STATUS_UPLOADED) == 500
+
+def test_put_spills_when_full(store):
+    db, pending = store
+    queue = PendingQueue(maxsize=10)
+    manager = StatusManager(queue, db, None)
+    first = queue.get(timeout=0)
+    manager.set_uploading(first)
+
+    # 第一个新文件补满窗口，第二个只登记到库里，之后扫描时取到
+    for name in ['night/new_1.fits', 'night/new_2.fits']:
+        queue.put(name)
+        manager.add(name)
+    assert queue.qsize() == 10
+
+    taken = _consume(queue, manager)
+    assert taken[-1] == 'night/new_2.fits' # 溢出的那个在下一轮扫描时取到
+    assert len(set(taken)) == len(taken) == len(pending) + 1
+
+def test_put_is_idempotent_while_leased():
+    '''排队中或处理中的文件不会重复入队，结束后才能再次加入'''
+    queue = PendingQueue(maxsize=10)
+    assert queue.put('night/a.fits')
+    assert not queue.put('night/a.fits')
+
+    task = queue.get(timeout=0)
+    assert queue.inflight() == 1
+    assert not queue.put(task) # 正在处理，FileChecker 再扫到也不会入队
+    assert queue.empty()
+
+    assert queue.requeue(task) # 失败退回
+    assert queue.inflight() == 0 and queue.qsize() == 1
+    queue.done(queue.get(timeout=0))
+    assert queue.inflight() == 0
+    assert queue.put(task)
+
+def test_expired_lease_is_reclaimed():
+    '''持有租约的线程丢失后，任务到期重新出现在队列里'''
+    queue = PendingQueue(maxsize=10, lease_seconds=0.05)
+    queue.put('night/a.fits')
+    task = queue.get(timeout=0)
+    with pytest.raises(Empty):
+        queue.get(timeout=0)
+
+    time.sleep(0.1)
+    assert queue.get(timeout=0) == task
+    assert not queue.renew('night/b.fits')
+    assert queue.renew(task)